@@ -0,0 +1,100 @@
+"""Measure a fresh worker's first request, with and without the startup prewarm.
+
+    python benchmarks/cold_start.py --rows 100000 --runs 5
+
+Each run is a new Python process that loads the app modules (after installing
+the on-disk blob stand-in), optionally lets the prewarm (STARTUP_PREWARM) run
+for up to --delay seconds, then times its first and second get_latency
+requests. The report lists medians per mode and the coldstart.report() of the
+last run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "python-functions"))
+
+import generate
+
+
+def child(blob_dir, delay):
+    started = time.perf_counter()
+    import localblob
+    localblob.install(localblob.LocalBlobService(blob_dir))
+    harness_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    import coldstart
+    import telemetry_aio
+    import_ms = (time.perf_counter() - started) * 1000
+
+    thread = coldstart.start_prewarm()
+    if thread is not None:
+        thread.join(delay)
+
+    def request():
+        started = time.perf_counter()
+        status = asyncio.run(telemetry_aio.run("get_latency", {}, log=lambda *args, **kwargs: None))[0]
+        return round((time.perf_counter() - started) * 1000, 1), status
+
+    first, second = request(), request()
+    print(json.dumps({
+        "harnessMs": round(harness_ms, 1),
+        "importMs": round(import_ms, 1),
+        "firstRequestMs": first[0],
+        "secondRequestMs": second[0],
+        "status": first[1],
+        "coldstart": coldstart.report(),
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time cold starts of the telemetry backend locally.")
+    parser.add_argument("--rows", type=int, default=10000, help="rows per dataset")
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "telemetry-bench"),
+                        help="where generated datasets and the blob stand-in live")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per mode")
+    parser.add_argument("--delay", type=float, default=30.0, help="seconds the prewarm may run before the first request")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args.child, args.delay)
+        return 0
+
+    data_dir = os.path.join(args.data_dir, f"{args.rows}-{args.regions}-{args.days}-{args.seed}")
+    generate.write_all(data_dir, args.rows, args.regions, args.days, args.seed)
+    blob_dir = os.path.join(args.data_dir, "cold-start-blobs")
+    for blob_name in generate.DATASETS:
+        os.makedirs(os.path.join(blob_dir, "telemetry"), exist_ok=True)
+        with open(os.path.join(data_dir, blob_name), "rb") as src, open(os.path.join(blob_dir, "telemetry", blob_name), "wb") as dst:
+            dst.write(src.read())
+
+    env = {**os.environ, "BLOB_TOKEN_REFRESH": "false", "BINARY_SNAPSHOTS": "false", "INTERACTION_LOG_FLUSH_SECONDS": "3600"}
+    print(f"{'mode':<12}{'import ms':>12}{'1st req ms':>12}{'2nd req ms':>12}")
+    last = None
+    for mode in ("lazy", "prewarm"):
+        runs = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, __file__, "--child", blob_dir, "--delay", str(args.delay)],
+                                 env={**env, "STARTUP_PREWARM": "true" if mode == "prewarm" else "false"},
+                                 capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        last = runs[-1]
+        medians = [statistics.median(run[key] for run in runs) for key in ("importMs", "firstRequestMs", "secondRequestMs")]
+        print(f"{mode:<12}" + "".join(f"{value:>12.1f}" for value in medians))
+    print(json.dumps(last["coldstart"], indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Synthetic telemetry in the shape of the telemetry container's blobs.
+
+    python benchmarks/generate.py --rows 100000 --regions 20 --out bench-data/
+
+writes latency.json, errors.json ({"errorEntries": [...]}) and incidents.json.
+Output is deterministic for a given seed and is written row by row, so
+multi-million-row files don't need to fit in memory as Python objects.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+
+AZURE_REGIONS = [
+    "eastus", "eastus2", "westus", "westus2", "westus3", "centralus", "northcentralus", "southcentralus",
+    "northeurope", "westeurope", "uksouth", "ukwest", "francecentral", "germanywestcentral", "swedencentral",
+    "eastasia", "southeastasia", "japaneast", "japanwest", "australiaeast", "centralindia", "brazilsouth",
+    "canadacentral", "koreacentral", "southafricanorth", "uaenorth",
+]
+ERROR_CODES = [500, 502, 503, 504, 404, 429, "TimeoutError", "ConnectionReset"]
+INCIDENT_STATUSES = ["Open", "Investigating", "Mitigated", "Resolved"]
+INCIDENT_WORDS = [
+    "latency", "spike", "timeout", "database", "connection", "pool", "exhausted", "dns", "failure", "gateway",
+    "certificate", "expired", "deployment", "rollback", "throttling", "storage", "queue", "backlog", "memory",
+    "leak", "cpu", "saturation", "cache", "miss", "network", "partition", "auth", "token", "errors", "elevated",
+]
+START = datetime.datetime(2025, 5, 1)
+
+
+def region_names(count):
+    names = AZURE_REGIONS[:count]
+    return names + [f"region{i}" for i in range(len(names), count)]
+
+
+def _timestamp(rng, days):
+    moment = START + datetime.timedelta(seconds=rng.randrange(days * 86400))
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def latency_rows(rows, regions, days, seed):
+    rng = random.Random(seed)
+    names = region_names(regions)
+    # Each region gets its own typical latency so compare/regions queries have a clear answer
+    typical = {name: rng.uniform(40, 400) for name in names}
+    for _ in range(rows):
+        region = rng.choice(names)
+        yield {"region": region, "timestamp": _timestamp(rng, days), "latencyMs": int(rng.lognormvariate(math.log(typical[region]), 0.5))}
+
+
+def error_rows(rows, regions, days, seed):
+    rng = random.Random(seed + 1)
+    names = region_names(regions)
+    for _ in range(rows):
+        yield {"region": rng.choice(names), "timestamp": _timestamp(rng, days), "errorCode": rng.choice(ERROR_CODES), "errorCount": rng.randint(1, 20)}
+
+
+def incident_rows(rows, regions, days, seed):
+    rng = random.Random(seed + 2)
+    names = region_names(regions)
+    for i in range(rows):
+        yield {
+            "id": f"INC{i:08d}",
+            "region": rng.choice(names),
+            "timestamp": _timestamp(rng, days),
+            "status": rng.choice(INCIDENT_STATUSES),
+            "title": " ".join(rng.sample(INCIDENT_WORDS, rng.randint(3, 7))),
+        }
+
+
+DATASETS = {
+    "latency.json": (latency_rows, None),
+    "errors.json": (error_rows, "errorEntries"),
+    "incidents.json": (incident_rows, None),
+}
+
+
+def write_dataset(blob_name, out, rows, regions=8, days=30, seed=0):
+    """Write one synthetic dataset as JSON to the binary file object out."""
+    generate, wrapper = DATASETS[blob_name]
+    out.write(b'{"%s": [' % wrapper.encode() if wrapper else b"[")
+    for i, row in enumerate(generate(rows, regions, days, seed)):
+        out.write((",\n" if i else "\n").encode() + json.dumps(row).encode())
+    out.write(b"\n]}" if wrapper else b"\n]")
+
+
+def write_all(directory, rows, regions=8, days=30, seed=0):
+    """Write every dataset into directory (skipping ones already generated with the same settings)."""
+    os.makedirs(directory, exist_ok=True)
+    stamp = os.path.join(directory, "settings.json")
+    settings = {"rows": rows, "regions": regions, "days": days, "seed": seed}
+    if os.path.exists(stamp):
+        with open(stamp) as f:
+            if json.load(f) == settings and all(os.path.exists(os.path.join(directory, name)) for name in DATASETS):
+                return
+    for blob_name in DATASETS:
+        with open(os.path.join(directory, blob_name), "wb") as out:
+            write_dataset(blob_name, out, rows, regions, days, seed)
+    with open(stamp, "w") as f:
+        json.dump(settings, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic telemetry blobs.")
+    parser.add_argument("--rows", type=int, default=10000, help="rows per dataset")
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--days", type=int, default=30, help="days of history starting 2025-05-01")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench-data")
+    args = parser.parse_args(argv)
+    write_all(args.out, args.rows, args.regions, args.days, args.seed)
+    for blob_name in DATASETS:
+        path = os.path.join(args.out, blob_name)
+        print(f"{path}: {os.path.getsize(path)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""In-process stand-in for the parts of Azure Blob Storage the backend uses.
+
+install() swaps blob_clients' service factories for LocalBlobService, so every
+module that goes through get_blob_client / get_async_blob_client (snapshot
+cache, binary snapshots, append-blob logs) talks to memory or a local
+directory instead of a storage account. Only the calls the backend makes are
+implemented: conditional download, properties and metadata, (conditional)
+upload, listing by prefix, delete, append blobs.
+"""
+import datetime
+import os
+import threading
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError, ResourceNotModifiedError
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class Properties:
+    def __init__(self, etag, last_modified, size, metadata=None, name=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+        self.metadata = metadata or {}
+        self.name = name
+
+
+class Downloader:
+    def __init__(self, data, properties):
+        self._data = data
+        self.properties = properties
+        self.size = len(data)
+
+    def chunks(self):
+        for start in range(0, len(self._data), CHUNK_SIZE):
+            yield self._data[start:start + CHUNK_SIZE]
+
+    def readall(self):
+        return self._data
+
+    def readinto(self, stream):
+        stream.write(self._data)
+        return len(self._data)
+
+
+class AsyncDownloader(Downloader):
+    async def readall(self):
+        return self._data
+
+
+class LocalBlobService:
+    """Blobs kept in a dict, or as files under root when root is given."""
+
+    def __init__(self, root=None):
+        self.root = root
+        self._blobs = {}
+        self._versions = {}
+        self._metadata = {}
+        self._lock = threading.Lock()
+        self.downloads = 0
+        self.bytes_downloaded = 0
+
+    def get_container_client(self, container_name):
+        return LocalContainer(self, container_name)
+
+    def get_blob_client(self, container_name, blob_name):
+        return LocalBlobClient(self, container_name, blob_name)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key)
+
+    def _read(self, key):
+        with self._lock:
+            if self.root is None:
+                if key not in self._blobs:
+                    raise ResourceNotFoundError(f"{'/'.join(key)} not found")
+                data = self._blobs[key]
+            else:
+                try:
+                    with open(self._path(key), "rb") as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    raise ResourceNotFoundError(f"{'/'.join(key)} not found")
+            return data, self._properties(key, len(data))
+
+    def _properties(self, key, size):
+        if self.root is None:
+            version, modified = self._versions[key]
+        else:
+            stat = os.stat(self._path(key))
+            version, modified = stat.st_mtime_ns, datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+        return Properties(f'"{version:x}-{size:x}"', modified, size, dict(self._metadata.get(key, {})), "/".join(key[1:]))
+
+    def _write(self, key, data, append=False, metadata=None):
+        with self._lock:
+            if not append:
+                self._metadata[key] = dict(metadata or {})
+            if self.root is None:
+                self._blobs[key] = (self._blobs.get(key, b"") if append else b"") + data
+                version = self._versions.get(key, (0, None))[0] + 1
+                self._versions[key] = (version, datetime.datetime.now(datetime.timezone.utc))
+            else:
+                path = self._path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "ab" if append else "wb") as f:
+                    f.write(data)
+
+    def _exists(self, key):
+        return key in self._blobs if self.root is None else os.path.exists(self._path(key))
+
+    def _delete(self, key):
+        with self._lock:
+            self._metadata.pop(key, None)
+            if self.root is None:
+                if self._blobs.pop(key, None) is None:
+                    raise ResourceNotFoundError(f"{'/'.join(key)} not found")
+                self._versions.pop(key, None)
+            else:
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    raise ResourceNotFoundError(f"{'/'.join(key)} not found")
+
+    def _list(self, container_name, prefix):
+        with self._lock:
+            if self.root is None:
+                names = ["/".join(key[1:]) for key in self._blobs if key[0] == container_name]
+            else:
+                top = os.path.join(self.root, container_name)
+                names = [os.path.relpath(os.path.join(d, f), top).replace(os.sep, "/") for d, _, files in os.walk(top) for f in files]
+        return sorted(name for name in names if name.startswith(prefix or ""))
+
+
+class LocalContainer:
+    def __init__(self, service, container_name):
+        self.service = service
+        self.container_name = container_name
+
+    def get_blob_client(self, blob_name):
+        return LocalBlobClient(self.service, self.container_name, blob_name)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        for name in self.service._list(self.container_name, name_starts_with):
+            try:
+                yield self.get_blob_client(name).get_blob_properties()
+            except ResourceNotFoundError:
+                continue
+
+
+class LocalBlobClient:
+    def __init__(self, service, container_name, blob_name):
+        self.service = service
+        self.key = (container_name, *blob_name.split("/"))
+
+    def download_blob(self, etag=None, match_condition=None, **kwargs):
+        data, properties = self.service._read(self.key)
+        if match_condition == MatchConditions.IfModified and etag == properties.etag:
+            raise ResourceNotModifiedError("Not modified")
+        self.service.downloads += 1
+        self.service.bytes_downloaded += len(data)
+        return Downloader(data, properties)
+
+    def get_blob_properties(self, **kwargs):
+        return self.service._read(self.key)[1]
+
+    def upload_blob(self, data, overwrite=False, metadata=None, etag=None, match_condition=None, **kwargs):
+        if not overwrite and self.service._exists(self.key):
+            raise ResourceExistsError("Blob already exists")
+        if match_condition == MatchConditions.IfNotModified and self.get_blob_properties().etag != etag:
+            raise ResourceModifiedError("Blob was modified")
+        self.service._write(self.key, data if isinstance(data, bytes) else data.read(), metadata=metadata)
+        properties = self.get_blob_properties()
+        return {"etag": properties.etag, "last_modified": properties.last_modified}
+
+    def delete_blob(self, **kwargs):
+        self.service._delete(self.key)
+
+    def create_append_blob(self, match_condition=None, **kwargs):
+        if self.service._exists(self.key):
+            if match_condition == MatchConditions.IfMissing:
+                raise ResourceModifiedError("Blob already exists")
+        self.service._write(self.key, b"")
+
+    def append_block(self, data, **kwargs):
+        self.service._write(self.key, data, append=True)
+
+
+class AsyncLocalBlobClient(LocalBlobClient):
+    async def get_blob_properties(self, **kwargs):
+        return LocalBlobClient.get_blob_properties(self, **kwargs)
+
+    async def download_blob(self, etag=None, match_condition=None, **kwargs):
+        stream = LocalBlobClient.download_blob(self, etag=etag, match_condition=match_condition)
+        return AsyncDownloader(stream.readall(), stream.properties)
+
+
+class AsyncLocalBlobService:
+    def __init__(self, service):
+        self.service = service
+
+    def get_blob_client(self, container_name, blob_name):
+        return AsyncLocalBlobClient(self.service, container_name, blob_name)
+
+
+def install(service):
+    """Route every blob client the backend creates to service."""
+    import blob_clients
+    blob_clients.get_blob_service_client = lambda account_url=None, connection_string=None: service
+    async_service = AsyncLocalBlobService(service)
+    blob_clients.get_async_blob_service_client = lambda account_url=None, connection_string=None: async_service
+    return service
@@ -0,0 +1,221 @@
+"""Benchmark the telemetry endpoints against synthetic data and a local blob stand-in.
+
+    python benchmarks/run.py --rows 100000 --concurrency 8 --requests 200
+    python benchmarks/run.py --rows 100000 --save-baseline bench-baseline.json
+    python benchmarks/run.py --rows 100000 --baseline bench-baseline.json
+
+Every scenario drives one branch of get_latency, check_errors, list_incidents,
+detect_anomalies or log_event through the same code the Functions handlers run. Each reports
+p50/p99 latency and throughput; peak RSS is reported for the whole run. With
+--baseline, any scenario whose p50 or p99 grew (or throughput fell) by more
+than --threshold is a regression and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "python-functions"))
+
+import generate
+import localblob
+
+
+def scenarios(regions):
+    names = generate.region_names(regions)
+    region, others = names[0], ",".join(names[:3])
+    latency = [
+        ("latency_default", {}),
+        ("latency_region", {"region": region}),
+        ("latency_day", {"region": region, "date": "2025-05-10"}),
+        ("latency_range", {"start_date": "2025-05-03", "end_date": "2025-05-17"}),
+        ("latency_partial_day", {"region": region, "start_date": "2025-05-03T06:30:00Z", "end_date": "2025-05-04T18:15:00Z"}),
+        ("latency_regions", {"regions": others}),
+        ("latency_compare", {"compare": "true"}),
+        ("latency_compare_p99", {"compare": "true", "stat": "p99"}),
+        ("latency_update", {"update_timestamp": "2025-05-15T12:00:00Z", "region": region}),
+        ("latency_recent", {"date": "recent", "region": region}),
+        ("latency_series_1h", {"interval": "1h", "regions": others}),
+        ("latency_series_1m", {"interval": "1m", "region": region, "points": "300"}),
+    ]
+    errors = [
+        ("errors_total", {}),
+        ("errors_code_region", {"code": "503", "region": region}),
+        ("errors_month", {"date": "2025-05"}),
+        ("errors_series_5m", {"interval": "5m", "date": "2025-05-10"}),
+        ("errors_top_codes", {"group_by": "code", "top": "5", "start_date": "2025-05-03", "end_date": "2025-05-09"}),
+    ]
+    incidents = [
+        ("incidents_open", {"status": "open", "region": region}),
+        ("incidents_page", {"limit": "100", "sort": "desc"}),
+        ("incidents_search", {"q": "gateway time*", "region": region}),
+    ]
+    anomalies = [
+        ("anomalies_latency", {"region": region, "date": "2025-05"}),
+        ("anomalies_errors_day", {"metric": "errors", "bucket": "day"}),
+    ]
+    return ([(name, "get_latency", params) for name, params in latency]
+            + [(name, "check_errors", params) for name, params in errors]
+            + [(name, "list_incidents", params) for name, params in incidents]
+            + [(name, "detect_anomalies", params) for name, params in anomalies]
+            + [("log_event", "log_event", {})])
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def make_call(function, params, mode):
+    import azure.functions as func
+    import telemetry_aio
+    import telemetry_api
+
+    if function == "log_event":
+        import log_event
+        body = json.dumps([{"event": "chat", "query": "why is latency high", "region": "eastus", "n": i} for i in range(10)]).encode()
+        return lambda: log_event.main(func.HttpRequest("POST", "/api/log_event", body=body)).status_code
+    if mode == "async":
+        return lambda: asyncio.run(telemetry_aio.run(function, params))[0]
+    return lambda: telemetry_api.run_cached(function, params)[0]
+
+
+def run_scenario(call, requests, concurrency, warmup):
+    for _ in range(warmup):
+        call()
+
+    def timed(_):
+        started = time.perf_counter()
+        status = call()
+        return (time.perf_counter() - started) * 1000, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(ms for ms, _ in samples)
+    return {
+        "p50Ms": round(percentile(latencies, 0.5), 3),
+        "p99Ms": round(percentile(latencies, 0.99), 3),
+        "meanMs": round(statistics.fmean(latencies), 3),
+        "throughputRps": round(requests / elapsed, 1),
+        "errors": sum(1 for _, status in samples if status >= 400),
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        for metric, worse in (("p50Ms", lambda new, old: new > old * (1 + threshold)),
+                              ("p99Ms", lambda new, old: new > old * (1 + threshold)),
+                              ("throughputRps", lambda new, old: new < old / (1 + threshold))):
+            if base.get(metric) and worse(result[metric], base[metric]):
+                regressions.append(f"{name}: {metric} {base[metric]} -> {result[metric]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the telemetry backend locally.")
+    parser.add_argument("--rows", type=int, default=10000, help="rows per dataset (1K to 10M)")
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--store", choices=["memory", "fs"], default="memory", help="where the blob stand-in keeps blobs")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "telemetry-bench"),
+                        help="generated datasets (and blobs, with --store fs) are kept here between runs")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="drive telemetry_api directly or the async routes")
+    parser.add_argument("--binary-snapshots", action="store_true", help="also publish .snap blobs so tables load from them")
+    parser.add_argument("--no-response-cache", action="store_true", help="recompute every response (RESPONSE_CACHE=false)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--baseline", help="compare against this saved result file")
+    parser.add_argument("--save-baseline", help="write results to this file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before a regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    # No storage account behind the stand-in, so skip the AAD token refresher
+    os.environ.setdefault("BLOB_TOKEN_REFRESH", "false")
+    os.environ.setdefault("BINARY_SNAPSHOTS", "true" if args.binary_snapshots else "false")
+    os.environ.setdefault("SNAPSHOT_DIR", os.path.join(args.data_dir, "snapshots"))
+    if args.no_response_cache:
+        os.environ["RESPONSE_CACHE"] = "false"
+
+    data_dir = os.path.join(args.data_dir, f"{args.rows}-{args.regions}-{args.days}-{args.seed}")
+    generated = time.perf_counter()
+    generate.write_all(data_dir, args.rows, args.regions, args.days, args.seed)
+    print(f"Datasets in {data_dir} ({time.perf_counter() - generated:.1f}s)")
+
+    service = localblob.install(localblob.LocalBlobService(os.path.join(args.data_dir, "blobs") if args.store == "fs" else None))
+    for blob_name in generate.DATASETS:
+        with open(os.path.join(data_dir, blob_name), "rb") as f:
+            service.get_blob_client("telemetry", blob_name).upload_blob(f.read(), overwrite=True)
+    if args.binary_snapshots:
+        import io
+        import snapshot_format
+        for kind, build in snapshot_format.BUILDERS.items():
+            # Built from the generated JSON, the same document the blob holds
+            with open(os.path.join(data_dir, f"{kind}.json"), "rb") as f:
+                data = json.load(f)
+            out = io.BytesIO()
+            snapshot_format.write_snapshot(build(data), build.__name__, out)
+            service.get_blob_client("telemetry", f"{kind}.snap").upload_blob(out.getvalue(), overwrite=True)
+
+    selected = set(args.only.split(",")) if args.only else None
+    results = {}
+    print(f"{'scenario':<22}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+    for name, function, params in scenarios(args.regions):
+        if selected and name not in selected:
+            continue
+        result = run_scenario(make_call(function, params, args.mode), args.requests, args.concurrency, args.warmup)
+        results[name] = result
+        print(f"{name:<22}{result['p50Ms']:>10}{result['p99Ms']:>10}{result['throughputRps']:>10}{result['errors']:>8}")
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "only")},
+        "peakRssMb": peak_rss_mb(),
+        "blobDownloads": service.downloads,
+        "results": results,
+    }
+    print(f"peak RSS {report['peakRssMb']} MB, {service.downloads} blob downloads ({service.bytes_downloaded} bytes)")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("rows", "regions", "store", "mode", "binary_snapshots", "no_response_cache", "concurrency"):
+            recorded = baseline.get("config", {}).get(key)
+            if recorded != report["config"][key]:
+                print(f"Warning: baseline was recorded with {key}={recorded}, this run uses {report['config'][key]}")
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import math
+import os
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+
+import tracing
+from rollups import get_rollup
+from telemetry_query import MISSING_TS, format_timestamp_ms
+
+# Buckets in the rolling median/MAD baseline
+ANOMALY_WINDOW = int(os.environ.get("ANOMALY_WINDOW", "24"))
+# Weight of the newest bucket in the EWMA baseline
+ANOMALY_EWMA_ALPHA = float(os.environ.get("ANOMALY_EWMA_ALPHA", "0.3"))
+# Robust z-score (deviations from the rolling median in MADs) that counts as a spike or dip
+ANOMALY_THRESHOLD = float(os.environ.get("ANOMALY_THRESHOLD", "3.5"))
+# CUSUM decision interval and slack, in the same units; a sustained shift past this is a change point
+ANOMALY_CUSUM_THRESHOLD = float(os.environ.get("ANOMALY_CUSUM_THRESHOLD", "8"))
+ANOMALY_CUSUM_SLACK = float(os.environ.get("ANOMALY_CUSUM_SLACK", "0.5"))
+# Indexes kept per table for client-chosen window/threshold settings; the least recently used go first
+ANOMALY_CUSTOM_INDEXES = int(os.environ.get("ANOMALY_CUSTOM_INDEXES", "8"))
+
+# MAD * 1.4826 estimates the standard deviation of normally distributed data
+_MAD_SCALE = 1.4826
+
+_build_lock = threading.Lock()
+
+
+class Baseline:
+    """Running baselines of one series, advanced one bucket at a time.
+
+    Keeps an EWMA mean/variance, the last `window` values (in arrival order and
+    sorted, for the rolling median and MAD) and a two-sided CUSUM of the robust
+    z-scores. After a change point the baseline restarts from the new level.
+    Copying is O(window), so a detector can checkpoint cheaply.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.recent = deque()
+        self.ordered = []
+        self.ewma = None
+        self.ewm_var = 0.0
+        self.cusum_up = 0.0
+        self.cusum_down = 0.0
+        self.seen = 0
+
+    def copy(self):
+        baseline = Baseline(self.window)
+        baseline.recent = deque(self.recent)
+        baseline.ordered = list(self.ordered)
+        baseline.ewma = self.ewma
+        baseline.ewm_var = self.ewm_var
+        baseline.cusum_up = self.cusum_up
+        baseline.cusum_down = self.cusum_down
+        baseline.seen = self.seen
+        return baseline
+
+    def step(self, value, threshold):
+        """Score value against the baseline so far, then fold it in. Returns (median, ewma, score, kind or None)."""
+        median = ewma = None
+        score, kind = 0.0, None
+        if self.ordered:
+            median = _median(self.ordered)
+            mad = _median(sorted(abs(v - median) for v in self.ordered))
+            # Flat windows (e.g. no errors at all) have MAD 0; fall back to the EWMA spread, then to 1
+            scale = _MAD_SCALE * mad or math.sqrt(self.ewm_var) or 1.0
+            score = (value - median) / scale
+            ewma = self.ewma
+        if self.seen >= max(2, self.window // 2):
+            if score >= threshold:
+                kind = "spike"
+            elif score <= -threshold:
+                kind = "dip"
+            # Clipped, so a lone outlier can't trip the change detector by itself
+            clipped = max(-threshold, min(threshold, score))
+            self.cusum_up = max(0.0, self.cusum_up + clipped - ANOMALY_CUSUM_SLACK)
+            self.cusum_down = max(0.0, self.cusum_down - clipped - ANOMALY_CUSUM_SLACK)
+            if self.cusum_up > ANOMALY_CUSUM_THRESHOLD or self.cusum_down > ANOMALY_CUSUM_THRESHOLD:
+                kind = "shift_up" if self.cusum_up > ANOMALY_CUSUM_THRESHOLD else "shift_down"
+                self.cusum_up = self.cusum_down = 0.0
+
+        self.recent.append(value)
+        insort(self.ordered, value)
+        if len(self.recent) > self.window:
+            self.ordered.pop(bisect_left(self.ordered, self.recent.popleft()))
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            diff = value - self.ewma
+            self.ewma += ANOMALY_EWMA_ALPHA * diff
+            self.ewm_var = (1 - ANOMALY_EWMA_ALPHA) * (self.ewm_var + ANOMALY_EWMA_ALPHA * diff * diff)
+        self.seen += 1
+        if kind in ("shift_up", "shift_down"):
+            # New level: relearn the baseline from here rather than alerting until the window catches up
+            self.recent = deque([value])
+            self.ordered = [value]
+            self.ewma = value
+            self.ewm_var = 0.0
+            self.seen = 1
+        return median, ewma, score, kind
+
+
+def _median(ordered):
+    n = len(ordered)
+    return ordered[n // 2] if n % 2 else (ordered[n // 2 - 1] + ordered[n // 2]) / 2
+
+
+class RegionDetector:
+    """Anomalies found so far in one region's bucket series, resumable from its last bucket.
+
+    The last bucket may still grow as rows arrive, so the baseline is also kept
+    as it was before that bucket; resuming re-scores it and moves on.
+    """
+
+    def __init__(self, window, threshold):
+        self.threshold = threshold
+        self.baseline = Baseline(window)
+        self.anomalies = []
+        self.latest = None
+        self.last_start = None
+        self._before_last = None
+
+    def resumable_from(self, bucket_start):
+        return self.last_start is None or bucket_start >= self.last_start
+
+    def resumed(self, series):
+        """A new detector continuing this one over series [(bucket start, value), ...] (the full, updated series)."""
+        detector = RegionDetector(self.baseline.window, self.threshold)
+        start = 0
+        if self.last_start is not None:
+            start = bisect_left(series, (self.last_start,))
+            detector.baseline = self._before_last.copy()
+            detector.anomalies = [a for a in self.anomalies if a["bucketStart"] < self.last_start]
+        detector.run(series[start:])
+        return detector
+
+    def run(self, series):
+        last = len(series) - 1
+        for n, (bucket_start, value) in enumerate(series):
+            if n == last:
+                self._before_last = self.baseline.copy()
+            self.last_start = bucket_start
+            median, ewma, score, kind = self.baseline.step(value, self.threshold)
+            point = {
+                "bucketStart": bucket_start,
+                "timestamp": format_timestamp_ms(bucket_start),
+                "value": round(value, 3),
+                "baseline": round(median, 3) if median is not None else None,
+                "ewma": round(ewma, 3) if ewma is not None else None,
+                "score": round(score, 2),
+            }
+            if kind is not None:
+                self.anomalies.append({**point, "kind": kind})
+            self.latest = point
+
+
+class AnomalyIndex:
+    """Per-region detectors over a table's rollup buckets for one bucket width and setting.
+
+    Latency buckets are scored on their mean; error buckets on their total, with
+    empty buckets between a region's first and last counted as zero. Built in a
+    single pass over the rollup; extended() re-runs only the regions new rows
+    touched, from their last bucket onward when the rows are recent.
+    """
+
+    def __init__(self, table, bucket_ms, window, threshold, fill_gaps):
+        self.table = table
+        self.bucket_ms = bucket_ms
+        self.window = window
+        self.threshold = threshold
+        self.fill_gaps = fill_gaps
+        self.detectors = {}
+        for code, series in self._series().items():
+            detector = self.detectors[code] = RegionDetector(window, threshold)
+            detector.run(series)
+
+    def _series(self, codes=None):
+        # {region code: [(bucket start, value), ...]} merged across the other dimensions' groups
+        table = self.table
+        rollup = get_rollup(table, self.bucket_ms)
+        pos = rollup.dims.index(table.partition_by)
+        buckets = {}
+        for key, group in rollup.groups.items():
+            if codes is not None and key[pos] not in codes:
+                continue
+            merged = buckets.setdefault(key[pos], {})
+            for start, count, total in zip(group.starts, group.counts, group.sums):
+                acc = merged.setdefault(start, [0, 0])
+                acc[0] += count
+                acc[1] += total
+        result = {}
+        for code, merged in buckets.items():
+            if not merged:
+                continue
+            if self.fill_gaps:
+                first, last = min(merged), max(merged)
+                result[code] = [(start, float(merged[start][1]) if start in merged else 0.0)
+                                for start in range(first, last + self.bucket_ms, self.bucket_ms)]
+            else:
+                result[code] = [(start, merged[start][1] / merged[start][0]) for start in sorted(merged)]
+        return result
+
+    def extended(self, table, new_ids):
+        index = AnomalyIndex.__new__(AnomalyIndex)
+        index.__dict__.update(self.__dict__)
+        index.table = table
+        index.detectors = dict(self.detectors)
+        column, timestamps = table.codes[table.partition_by], table.timestamps
+        earliest = {}
+        for i in new_ids:
+            ts = timestamps[i]
+            if ts == MISSING_TS:
+                continue
+            start = ts - ts % self.bucket_ms
+            if start < earliest.get(column[i], start + 1):
+                earliest[column[i]] = start
+        for code, series in index._series(set(earliest)).items():
+            previous = self.detectors.get(code)
+            if previous is not None and previous.resumable_from(earliest[code]):
+                index.detectors[code] = previous.resumed(series)
+            else:
+                detector = index.detectors[code] = RegionDetector(self.window, self.threshold)
+                detector.run(series)
+        return index
+
+
+def get_anomaly_index(table, bucket_ms, window=ANOMALY_WINDOW, threshold=ANOMALY_THRESHOLD, fill_gaps=False):
+    # The default setting is built once per table, then extended as delta segments arrive
+    if window == ANOMALY_WINDOW and threshold == ANOMALY_THRESHOLD:
+        key = ("anomalies", bucket_ms, fill_gaps)
+        if key not in table.derived:
+            with _build_lock:
+                if key not in table.derived:
+                    table.derived[key] = AnomalyIndex(table, bucket_ms, window, threshold, fill_gaps)
+        return table.derived[key]
+    # Other settings come from the query string, so they share a small LRU (rebuilt after a delta
+    # lands) instead of each keeping an index for the table's lifetime. The threshold shapes the
+    # baselines themselves (CUSUM clipping, restarts after change points), so it can't be applied
+    # to a shared index afterwards.
+    key = (bucket_ms, window, threshold, fill_gaps)
+    with _build_lock:
+        custom = table.derived.setdefault("anomalies_custom", OrderedDict())
+        index = custom.get(key)
+        if index is not None:
+            custom.move_to_end(key)
+            return index
+    # Built without the lock, so one slow custom query doesn't hold up every other table's builds;
+    # two requests racing for the same key both build it and the first one stored wins
+    index = AnomalyIndex(table, bucket_ms, window, threshold, fill_gaps)
+    with _build_lock:
+        stored = custom.get(key)
+        if stored is not None:
+            custom.move_to_end(key)
+            return stored
+        custom[key] = index
+        while len(custom) > ANOMALY_CUSTOM_INDEXES:
+            custom.popitem(last=False)
+        return index
+
+
+@tracing.timed("aggregate")
+def detect(table, bucket_ms, regions=None, window=ANOMALY_WINDOW, threshold=ANOMALY_THRESHOLD, fill_gaps=False):
+    """{region: RegionDetector} for the given normalized regions (None = all with data)."""
+    index = get_anomaly_index(table, bucket_ms, window, threshold, fill_gaps)
+    names = table.dictionaries[table.partition_by]
+    result = {}
+    for code, detector in index.detectors.items():
+        if regions is None or names[code] in regions:
+            result[names[code]] = detector
+    return result
@@ -0,0 +1,16 @@
+import azure.functions as func
+import json
+import logging
+import telemetry_api
+import telemetry_aio
+import tracing
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Processing batch request.')
+    try:
+        queries = req.get_json()
+    except ValueError:
+        return func.HttpResponse(json.dumps({"error": "Body must be JSON."}), status_code=400, mimetype="application/json")
+    with tracing.request("batch", req) as trace:
+        status_code, response = await telemetry_aio.batch(queries)
+    return telemetry_api.http_response(trace, status_code, response)
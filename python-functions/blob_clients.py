@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+
+# The Azure SDK and requests are imported on first use: together they take a
+# noticeable share of a cold worker's startup, and some functions never need them
+
+TELEMETRY_CONTAINER = "telemetry"
+STORAGE_SCOPE = "https://storage.azure.com/.default"
+# Max pooled HTTPS connections per storage host, shared by every handler on the worker
+BLOB_POOL_SIZE = int(os.environ.get("BLOB_POOL_SIZE", "32"))
+# Refresh the AAD token this many seconds before it expires
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+_lock = threading.Lock()
+_credential = None
+_session = None
+_clients = {}
+_refresher = None
+# {event loop: {"credential": ..., account key: aio BlobServiceClient}}
+_async_clients = {}
+
+
+def get_credential():
+    """Return the worker-wide DefaultAzureCredential, creating it on first use."""
+    global _credential, _refresher
+    with _lock:
+        if _credential is None:
+            from azure.identity import DefaultAzureCredential
+            _credential = DefaultAzureCredential()
+            if os.environ.get("BLOB_TOKEN_REFRESH", "true").lower() == "true":
+                _refresher = threading.Thread(target=_refresh_token_forever, name="blob-token-refresh", daemon=True)
+                _refresher.start()
+        return _credential
+
+
+def get_blob_service_client(account_url=None, connection_string=None):
+    """Return a cached BlobServiceClient for the given account URL or connection string.
+
+    With no arguments the client is built from BLOB_ACCOUNT_URL using AAD auth.
+    All clients share one requests session, so connections are reused across
+    invocations and threads.
+    """
+    if connection_string is None and account_url is None:
+        account_url = os.environ.get("BLOB_ACCOUNT_URL")
+    key = ("conn", connection_string) if connection_string is not None else ("url", account_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    credential = get_credential() if connection_string is None else None
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from azure.core.pipeline.transport import RequestsTransport
+            from azure.storage.blob import BlobServiceClient
+            transport = RequestsTransport(session=_get_session(), session_owner=False)
+            if connection_string is not None:
+                client = BlobServiceClient.from_connection_string(connection_string, transport=transport)
+            else:
+                client = BlobServiceClient(account_url=account_url, credential=credential, transport=transport)
+            _clients[key] = client
+    return client
+
+
+def get_container_client(container_name=TELEMETRY_CONTAINER, account_url=None, connection_string=None):
+    return get_blob_service_client(account_url, connection_string).get_container_client(container_name)
+
+
+def get_blob_client(blob_name, container_name=TELEMETRY_CONTAINER, account_url=None, connection_string=None):
+    return get_container_client(container_name, account_url, connection_string).get_blob_client(blob_name)
+
+
+def get_async_blob_service_client(account_url=None, connection_string=None):
+    """azure.storage.blob.aio counterpart of get_blob_service_client, cached per event loop.
+
+    aio clients and credentials hold an aiohttp session bound to the loop they
+    were first used on, so each loop (in practice the worker's one loop) gets
+    its own. They are kept by the loop object itself, so a new loop can't be
+    handed a client of an old one that had the same id(), and dropped once
+    their loop has closed.
+    """
+    import asyncio
+    from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+    if connection_string is None and account_url is None:
+        account_url = os.environ.get("BLOB_ACCOUNT_URL")
+    loop = asyncio.get_running_loop()
+    key = ("conn", connection_string) if connection_string is not None else ("url", account_url)
+    with _lock:
+        for closed in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[closed]
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            if connection_string is not None:
+                client = AsyncBlobServiceClient.from_connection_string(connection_string)
+            else:
+                if clients.get("credential") is None:
+                    clients["credential"] = AsyncDefaultAzureCredential()
+                client = AsyncBlobServiceClient(account_url=account_url, credential=clients["credential"])
+            clients[key] = client
+    return client
+
+
+def get_async_blob_client(blob_name, container_name=TELEMETRY_CONTAINER, account_url=None, connection_string=None):
+    return get_async_blob_service_client(account_url, connection_string).get_blob_client(container_name, blob_name)
+
+
+def _get_session():
+    # Called with _lock held
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=BLOB_POOL_SIZE)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def _refresh_token_forever():
+    # Keep a valid storage token cached so request threads never block on token acquisition
+    while True:
+        try:
+            token = _credential.get_token(STORAGE_SCOPE)
+            delay = token.expires_on - time.time() - TOKEN_REFRESH_MARGIN_SECONDS
+        except Exception as e:
+            logging.warning(f"Background token refresh failed: {e}")
+            delay = 30
+        time.sleep(max(delay, 30))
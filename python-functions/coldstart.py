@@ -0,0 +1,143 @@
+"""Cold-start timings and an optional prewarm for a fresh worker.
+
+The Azure SDK is imported lazily (see blob_clients.py), so loading the app is
+cheap and the first request pays for SDK imports, credential discovery and the
+snapshot download instead. With STARTUP_PREWARM=true a background thread does
+that work as soon as the worker has imported the app: it imports the SDK,
+acquires a storage token, and loads and indexes the telemetry datasets, so
+the first request finds them in the snapshot cache.
+
+Every step is timed; report() returns the timings (milliseconds since the
+process started for milestones) and they are logged once after the prewarm
+and once after the first request.
+"""
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Warm SDK, token and datasets in a background thread when the worker starts
+STARTUP_PREWARM = os.environ.get("STARTUP_PREWARM", "false").lower() == "true"
+STARTUP_PREWARM_DATASETS = [name for name in os.environ.get("STARTUP_PREWARM_DATASETS", "latency.json,errors.json,incidents.json").split(",") if name]
+# Imported by the prewarm (the modules blob_clients defers)
+PREWARM_IMPORTS = ("requests", "azure.core", "azure.identity", "azure.storage.blob")
+
+
+def _process_started():
+    # Wall-clock start of this process on Linux; elsewhere, when this module was imported
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+_started = _process_started()
+_lock = threading.Lock()
+_report = {"milestones": {}, "imports": {}, "prewarm": {}, "firstRequest": None}
+_prewarm_thread = None
+
+
+def mark(name):
+    """Record a startup milestone (first occurrence only) as milliseconds since the process started."""
+    with _lock:
+        _report["milestones"].setdefault(name, round((time.time() - _started) * 1000, 1))
+
+
+def report():
+    with _lock:
+        return json.loads(json.dumps(_report))
+
+
+def start_prewarm():
+    """Start the prewarm thread once per worker when STARTUP_PREWARM is on; returns it (or None)."""
+    global _prewarm_thread
+    with _lock:
+        if STARTUP_PREWARM and _prewarm_thread is None:
+            _prewarm_thread = threading.Thread(target=prewarm, name="startup-prewarm", daemon=True)
+            _prewarm_thread.start()
+        return _prewarm_thread
+
+
+def request_finished(function, started):
+    """Record the first request's duration (started is its time.perf_counter()); later calls are no-ops."""
+    if _report["firstRequest"] is not None:
+        return
+    with _lock:
+        if _report["firstRequest"] is not None:
+            return
+        _report["firstRequest"] = {
+            "function": function,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+            "prewarmed": "prewarmed" in _report["milestones"],
+        }
+    mark("first_request")
+    logging.info(f"Cold start: {json.dumps(report())}")
+
+
+def prewarm(datasets=None):
+    """Import the SDK, acquire a storage token and load and index datasets (default STARTUP_PREWARM_DATASETS)."""
+    mark("prewarm_started")
+    for module in PREWARM_IMPORTS:
+        _timed(_report["imports"], module, _import, module)
+
+    # Connection-string clients don't use the credential; the aio credential is per event loop and isn't warmed
+    if os.environ.get("BLOB_ACCOUNT_URL"):
+        from blob_clients import STORAGE_SCOPE, get_credential
+        _timed(_report["prewarm"], "token", lambda: get_credential().get_token(STORAGE_SCOPE))
+
+    import telemetry_api
+    from common import load_table
+    builders = {blob_name: build for blob_name, build in telemetry_api.QUERY_DATASETS.values()}
+    for blob_name in STARTUP_PREWARM_DATASETS if datasets is None else datasets:
+        build = builders.get(blob_name)
+        if build is None:
+            logging.warning(f"Prewarm: no table builder for {blob_name}")
+            continue
+        table = _timed(_report["prewarm"], f"{blob_name}.load", load_table, blob_name, build)
+        if table is not None:
+            _timed(_report["prewarm"], f"{blob_name}.index", _index, table, build)
+    mark("prewarmed")
+    logging.info(f"Cold start: {json.dumps(report())}")
+
+
+def _import(module):
+    # Already-imported modules cost nothing, which is worth knowing too
+    if module not in sys.modules:
+        importlib.import_module(module)
+
+
+def _index(table, build):
+    # The indexes the default queries hit first
+    from heavy_hitters import get_heavy_hitter_index
+    from rollups import DAY_MS, HOUR_MS, get_rollup
+    from search import get_search_index
+    from sketches import get_sketch_index
+    if build.__name__ == "incidents_table":
+        get_search_index(table)
+    if table.measure is None:
+        return
+    get_rollup(table, DAY_MS)
+    get_rollup(table, HOUR_MS)
+    if build.__name__ == "latency_table" and table.partition_by is not None:
+        get_sketch_index(table)
+    if build.__name__ == "errors_table" and table.partition_by is not None:
+        get_heavy_hitter_index(table, "errorCode")
+
+
+def _timed(timings, name, fn, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    except Exception as e:
+        logging.warning(f"Prewarm step {name} failed: {e}")
+        return None
+    finally:
+        with _lock:
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
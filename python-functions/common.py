@@ -1,48 +1,61 @@
-import azure.functions as func
 import datetime
 import json
 import logging
-from azure.storage.blob import BlobServiceClient
-from azure.identity import DefaultAzureCredential
 import os
+from blob_clients import get_blob_client
+from deltas import delta_tables
+from interaction_log import get_append_logger
+from snapshot_cache import snapshot_cache
+from snapshot_format import BINARY_SNAPSHOTS, binary_snapshots
+import tracing
 
-def load_json_from_blob(blob_name):
-    credential = DefaultAzureCredential()
-    account_url = os.environ.get("BLOB_ACCOUNT_URL")
-    logging.info(f"BLOB_ACCOUNT_URL: {account_url}")
-    container_name = "telemetry"
-    blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
-    container_client = blob_service_client.get_container_client(container_name)
-    blob_client = container_client.get_blob_client(blob_name)
+def load_table(blob_name, build, prefilter=None):
+    """Return build(data) for the cached snapshot of blob_name, e.g. a telemetry_query.Table.
+
+    prefilter(row) is only used when the blob is too big to cache: rows it rejects
+    are dropped while streaming, so build only sees what the request needs.
+    A fresh binary snapshot (<name>.snap) is preferred over parsing the JSON.
+    Delta segments written since the snapshot are merged in (see deltas.py).
+    """
+    with tracing.stage("load"):
+        return delta_tables.apply(blob_name, build, _load_table(blob_name, build, prefilter), prefilter)
+
+def _load_table(blob_name, build, prefilter):
+    if BINARY_SNAPSHOTS:
+        table = binary_snapshots.load(blob_name, build.__name__)
+        if table is not None:
+            return table
+    blob_client = get_blob_client(blob_name)
     try:
-        download_stream = blob_client.download_blob()
-        data = json.loads(download_stream.readall())
+        return snapshot_cache.get_derived(blob_name, blob_client, build.__name__, build, prefilter=prefilter)
     except Exception as e:
         logging.error(f"Failed to load {blob_name} from blob: {e}")
-        data = []
-    return data
+        return build([])
+
+def snapshot_version(blob_name):
+    """Version (ETag) of the table load_table would return right now without touching storage, or None."""
+    etag = binary_snapshots.fresh_etag(blob_name) if BINARY_SNAPSHOTS else None
+    if etag is None:
+        etag = snapshot_cache.fresh_etag(blob_name)
+    return delta_tables.fresh_version(blob_name, etag) if etag is not None else None
+
+def get_snapshot_cache_stats():
+    """This worker's snapshot cache counters (hits, misses, revalidations, ...) with its entries and bytes."""
+    return snapshot_cache.stats()
+
+def log_snapshot_cache_stats():
+    # Logged by the compaction timer, so the counters show up in App Insights every 15 minutes
+    stats = get_snapshot_cache_stats()
+    logging.info(f"Snapshot cache: {json.dumps(stats)}", extra={"custom_dimensions": stats})
 
 def build_params_dict(**kwargs):
     return {k: v for k, v in kwargs.items() if v is not None and v != ""}
 
 def log_interaction(query, parameters, response, timestamp, log_file="interactions-log.json"):
-    # Use Azure Blob Storage for logging with Azure AD auth
-    account_url = os.environ.get("BLOB_ACCOUNT_URL")  # e.g., https://<storage-account-name>.blob.core.windows.net
-    credential = DefaultAzureCredential()
-    container_name = "telemetry"
-    blob_name = log_file
-    blob_service_client = BlobServiceClient(account_url=account_url, credential=credential)
-    container_client = blob_service_client.get_container_client(container_name)
-    blob_client = container_client.get_blob_client(blob_name)
-    try:
-        download_stream = blob_client.download_blob()
-        logs = json.loads(download_stream.readall())
-    except Exception:
-        logs = []
-    logs.append({
+    # Buffered and appended to hourly JSON Lines append blobs off the request path
+    get_append_logger(log_file).append({
         "query": query,
         "parameters": parameters,
         "response": response,
         "timestamp": timestamp
     })
-    blob_client.upload_blob(json.dumps(logs, indent=2), overwrite=True, content_settings=None)
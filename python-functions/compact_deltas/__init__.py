@@ -0,0 +1,9 @@
+import azure.functions as func
+import logging
+import common
+import deltas
+
+def main(timer: func.TimerRequest) -> None:
+    merged = deltas.compact_all()
+    logging.info(f"Delta compaction merged {merged}")
+    common.log_snapshot_cache_stats()
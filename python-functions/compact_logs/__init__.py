@@ -0,0 +1,7 @@
+import azure.functions as func
+import logging
+import log_segments
+
+def main(timer: func.TimerRequest) -> None:
+    written = log_segments.compact_all()
+    logging.info(f"Log compaction wrote {written}")
@@ -0,0 +1,282 @@
+"""Append-only delta segments on top of the telemetry base snapshots.
+
+New rows for latency.json are written as small JSON Lines blobs under a
+time-partitioned prefix instead of rewriting the whole file:
+
+    latency-deltas/2025/05/25/120301.123456-1a2b3c4d.jsonl
+
+Loaders keep serving the table built from the base blob and fold in only the
+segments they haven't seen yet (Table.extended, which also extends rollups and
+sketches). compact() periodically merges old segments into a new base blob and
+records the last merged segment as its delta_watermark, so readers never apply
+a segment twice.
+
+    python deltas.py append latency.json new-rows.jsonl
+    python deltas.py compact latency.json
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import tracing
+from blob_clients import get_blob_client, get_container_client
+
+# Apply delta segments on top of the base snapshots
+DELTA_SEGMENTS = os.environ.get("DELTA_SEGMENTS", "true").lower() == "true"
+# How often a loaded table looks for new segments
+DELTA_POLL_SECONDS = float(os.environ.get("DELTA_POLL_SECONDS", "30"))
+# Compaction waits until at least this many segments are old enough to merge...
+DELTA_COMPACT_MIN_SEGMENTS = int(os.environ.get("DELTA_COMPACT_MIN_SEGMENTS", "20"))
+# ...where old enough means named this long ago; later segments are left for the next run
+DELTA_COMPACT_MIN_AGE_SECONDS = float(os.environ.get("DELTA_COMPACT_MIN_AGE_SECONDS", "300"))
+
+
+def segment_prefix(blob_name):
+    stem = blob_name[:-5] if blob_name.endswith(".json") else blob_name
+    return f"{stem}-deltas/"
+
+
+def segment_blob_name(blob_name, when):
+    """e.g. latency.json -> latency-deltas/2025/05/25/120301.123456-1a2b3c4d.jsonl; names sort by time."""
+    return f"{segment_prefix(blob_name)}{when:%Y/%m/%d/%H%M%S.%f}-{uuid.uuid4().hex[:8]}.jsonl"
+
+
+def append_rows(blob_name, rows, when=None):
+    """Write rows as a new delta segment of blob_name and return the segment's name."""
+    when = when or datetime.datetime.now(datetime.timezone.utc)
+    name = segment_blob_name(blob_name, when)
+    body = "".join(json.dumps(row) + "\n" for row in rows).encode("utf-8")
+    get_blob_client(name).upload_blob(body)
+    return name
+
+
+def list_segments(blob_name):
+    """Names of blob_name's delta segments, oldest first."""
+    return sorted(blob.name for blob in get_container_client().list_blobs(name_starts_with=segment_prefix(blob_name)))
+
+
+def read_segment(name):
+    raw = get_blob_client(name).download_blob().readall()
+    tracing.count("bytes", len(raw))
+    rows = []
+    for line in raw.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            logging.warning(f"Skipping malformed line in {name}")
+            continue
+        if isinstance(row, dict):
+            rows.append(row)
+    return rows
+
+
+class DeltaTables:
+    """Base tables with the delta segments written since they were built.
+
+    Per (blob, builder) this keeps the base table, the table with segments
+    merged and the segment names merged so far. Merging builds a new table and
+    swaps it in whole, so a request keeps the consistent view it started with.
+    The merged table's version is the base ETag plus the newest merged segment
+    (the watermark), which keys cached responses.
+    """
+
+    def __init__(self, poll_seconds=DELTA_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._states = {}
+        self._lock = threading.Lock()
+        self._merge_locks = {}
+
+    def apply(self, blob_name, build, base, prefilter=None):
+        """base (the table built from blob_name) with every pending segment merged in.
+
+        prefilter is only applied to a base without a version (streamed for one request).
+        """
+        if not DELTA_SEGMENTS or base is None or getattr(base, "dimensions", None) is None:
+            return base
+        key = (blob_name, build.__name__)
+        state = self._states.get(key)
+        if self._current(state, base):
+            return state["table"]
+        with self._merge_lock(key):
+            state = self._states.get(key)
+            if self._current(state, base):
+                return state["table"]
+            if state is None or state["base"] is not base:
+                state = {"base": base, "table": base, "merged": frozenset()}
+            # The merged state is shared by every request, so it gets every delta row. Only a
+            # table streamed with a prefilter (too big to cache, no version) is filtered, and
+            # that one is good for this request alone and never stored.
+            shared = base.version is not None
+            try:
+                with tracing.stage("deltas"):
+                    state = self._merge(blob_name, base, state, None if shared else prefilter)
+            except Exception as e:
+                # Keep serving what we have and retry after the next poll interval
+                logging.warning(f"Could not apply delta segments for {blob_name}: {e}")
+                state = {**state, "checked_at": time.monotonic()}
+            if shared:
+                self._states[key] = state
+            return state["table"]
+
+    def fresh_version(self, blob_name, base_version):
+        """Version apply() would return for the base with base_version without listing segments, else None."""
+        if not DELTA_SEGMENTS:
+            return base_version
+        for (name, _), state in list(self._states.items()):
+            if name == blob_name and state["base"].version == base_version and self._current(state, state["base"]):
+                return state["table"].version
+        return None
+
+    def _current(self, state, base):
+        return state is not None and state["base"] is base and time.monotonic() - state["checked_at"] < self.poll_seconds
+
+    def _merge(self, blob_name, base, state, prefilter):
+        names = list_segments(blob_name)
+        floor = base.watermark or ""
+        pending = [name for name in names if name > floor and name not in state["merged"]]
+        table = state["table"]
+        if pending:
+            rows = []
+            for name in pending:
+                rows.extend(read_segment(name))
+            if prefilter is not None:
+                rows = [row for row in rows if prefilter(row)]
+            table = table.extended(rows)
+            merged = state["merged"] | set(pending)
+            table.watermark = max(merged)
+            table.version = f"{base.version}+{len(merged)}:{table.watermark}" if base.version is not None else None
+            logging.info(f"Merged {len(pending)} delta segments ({len(rows)} rows) into {blob_name}")
+        else:
+            merged = state["merged"]
+        return {"base": base, "table": table, "merged": merged, "checked_at": time.monotonic()}
+
+    def _merge_lock(self, key):
+        with self._lock:
+            return self._merge_locks.setdefault(key, threading.Lock())
+
+
+delta_tables = DeltaTables()
+
+
+def _merge_rows(data, rows):
+    # Base blobs are either a list of rows or {"errorEntries": [...]}
+    if isinstance(data, dict):
+        data.setdefault("errorEntries", []).extend(rows)
+        return data
+    return (data if isinstance(data, list) else []) + rows
+
+
+def compact(blob_name, min_segments=DELTA_COMPACT_MIN_SEGMENTS, min_age_seconds=DELTA_COMPACT_MIN_AGE_SECONDS):
+    """Fold blob_name's old delta segments into a new base blob; returns how many were merged.
+
+    The base is replaced only if it hasn't changed since it was read (ETag
+    match), its binary snapshot is regenerated when one exists, and the merged
+    segments are deleted last, so a crash at any point leaves readers with
+    either the old base plus segments or the new base (whose watermark hides
+    the leftover segments).
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+    from snapshot_format import BUILDERS, snapshot_blob_name, write_snapshot
+
+    client = get_blob_client(blob_name)
+    stream = client.download_blob()
+    watermark = (stream.properties.metadata or {}).get("delta_watermark") or ""
+    names = list_segments(blob_name)
+    cutoff = segment_blob_name(blob_name, datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=min_age_seconds))
+    leftovers = [name for name in names if name <= watermark]
+    due = [name for name in names if watermark < name < cutoff]
+    if len(due) < min_segments:
+        _delete(leftovers)
+        return 0
+
+    rows = []
+    for name in due:
+        rows.extend(read_segment(name))
+    data = _merge_rows(json.loads(stream.readall()), rows)
+    try:
+        result = client.upload_blob(json.dumps(data).encode("utf-8"), overwrite=True, metadata={"delta_watermark": due[-1]},
+                                    etag=stream.properties.etag, match_condition=MatchConditions.IfNotModified)
+    except ResourceModifiedError:
+        logging.warning(f"{blob_name} changed during compaction; will retry next run")
+        return 0
+
+    kind = next((k for k in BUILDERS if blob_name.startswith(k)), None)
+    snap_client = get_blob_client(snapshot_blob_name(blob_name))
+    try:
+        snap_client.get_blob_properties()
+        has_snapshot = kind is not None
+    except ResourceNotFoundError:
+        has_snapshot = False
+    if has_snapshot:
+        table = BUILDERS[kind](data)
+        table.watermark = due[-1]
+        out = io.BytesIO()
+        write_snapshot(table, BUILDERS[kind].__name__, out, source_etag=(result or {}).get("etag"))
+        snap_client.upload_blob(out.getvalue(), overwrite=True)
+
+    _delete(leftovers + due)
+    logging.info(f"Compacted {len(due)} delta segments ({len(rows)} rows) into {blob_name}")
+    return len(due)
+
+
+def compact_all(**kwargs):
+    """compact() every dataset that has binary snapshot support; returns {blob_name: segments merged}."""
+    from azure.core.exceptions import ResourceNotFoundError
+    from snapshot_format import BUILDERS
+
+    merged = {}
+    for kind in BUILDERS:
+        blob_name = f"{kind}.json"
+        try:
+            merged[blob_name] = compact(blob_name, **kwargs)
+        except ResourceNotFoundError:
+            continue
+        except Exception as e:
+            logging.error(f"Compaction of {blob_name} failed: {e}")
+    return merged
+
+
+def _delete(names):
+    from azure.core.exceptions import ResourceNotFoundError
+    for name in names:
+        try:
+            get_blob_client(name).delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or compact telemetry delta segments.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    append = sub.add_parser("append", help="upload rows (a JSON array or JSON Lines file) as a new segment")
+    append.add_argument("blob_name", help="base blob, e.g. latency.json")
+    append.add_argument("rows")
+    compaction = sub.add_parser("compact", help="merge old segments into the base blob")
+    compaction.add_argument("blob_name", nargs="?", help="base blob (default: every dataset)")
+    compaction.add_argument("--min-segments", type=int, default=DELTA_COMPACT_MIN_SEGMENTS)
+    compaction.add_argument("--min-age-seconds", type=float, default=DELTA_COMPACT_MIN_AGE_SECONDS)
+    args = parser.parse_args(argv)
+
+    if args.command == "append":
+        with open(args.rows) as f:
+            text = f.read()
+        rows = json.loads(text) if text.lstrip().startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+        print(f"Wrote {len(rows)} rows to {append_rows(args.blob_name, rows)}")
+    else:
+        options = {"min_segments": args.min_segments, "min_age_seconds": args.min_age_seconds}
+        merged = {args.blob_name: compact(args.blob_name, **options)} if args.blob_name else compact_all(**options)
+        for blob_name, count in merged.items():
+            print(f"{blob_name}: merged {count} segments")
+
+
+if __name__ == "__main__":
+    main()
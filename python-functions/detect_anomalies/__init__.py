@@ -0,0 +1,11 @@
+import azure.functions as func
+import logging
+import telemetry_api
+import telemetry_aio
+import tracing
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info("Processing detect_anomalies request")
+    with tracing.request("detect_anomalies", req) as trace:
+        status_code, response, etag = await telemetry_aio.run("detect_anomalies", req.params, if_none_match=req.headers.get("If-None-Match"))
+    return telemetry_api.http_response(trace, status_code, response, etag)
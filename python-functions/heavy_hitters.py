@@ -0,0 +1,232 @@
+import copy
+import heapq
+import os
+import threading
+
+import tracing
+from rollups import DAY_MS, HOUR_MS
+from telemetry_query import MAX_TS, MISSING_TS, TimeRange
+
+# Keys tracked per summary; top-N over a range is exact while it has at most this many distinct keys
+HEAVY_HITTERS_CAPACITY = int(os.environ.get("HEAVY_HITTERS_CAPACITY", "64"))
+
+_build_lock = threading.Lock()
+
+
+class SpaceSaving:
+    """Mergeable heavy-hitter summary (Space-Saving) of weighted keys.
+
+    Tracks at most `capacity` keys, each with a count that may overestimate
+    the true count by at most its error; any key not tracked has a true count
+    of at most floor. Summaries merge by adding counts (a key missing on one
+    side counts as that side's floor) and keeping the largest, so memory stays
+    bounded however many distinct keys there are. total is exact.
+    """
+
+    def __init__(self, capacity=HEAVY_HITTERS_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.floor = 0
+        self.total = 0
+
+    @classmethod
+    def from_counts(cls, counts, capacity=HEAVY_HITTERS_CAPACITY):
+        """Summary of exact {key: count}."""
+        summary = cls(capacity)
+        summary.total = sum(counts.values())
+        summary.counts = {key: [count, 0] for key, count in counts.items()}
+        summary._truncate()
+        return summary
+
+    def add(self, key, weight=1):
+        self.total += weight
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = [weight, 0]
+        else:
+            # Replace the smallest counter; the newcomer may have been counted under it
+            victim = min(self.counts, key=lambda k: self.counts[k][0])
+            low = self.counts.pop(victim)[0]
+            self.floor = max(self.floor, low)
+            self.counts[key] = [low + weight, low]
+
+    def copy(self):
+        summary = copy.copy(self)
+        summary.counts = {key: list(entry) for key, entry in self.counts.items()}
+        return summary
+
+    def merge(self, other):
+        counts = {}
+        for key in self.counts.keys() | other.counts.keys():
+            mine = self.counts.get(key, (self.floor, self.floor))
+            theirs = other.counts.get(key, (other.floor, other.floor))
+            counts[key] = [mine[0] + theirs[0], mine[1] + theirs[1]]
+        self.counts = counts
+        self.floor += other.floor
+        self.total += other.total
+        self._truncate()
+        return self
+
+    def relabeled(self, label):
+        """A copy with every key k replaced by label(k)."""
+        summary = copy.copy(self)
+        summary.counts = {label(key): list(entry) for key, entry in self.counts.items()}
+        return summary
+
+    def top(self, n):
+        """[(key, count, error)] for the n largest counts, largest first."""
+        best = heapq.nlargest(n, self.counts.items(), key=lambda item: (item[1][0], -item[1][1]))
+        return [(key, count, error) for key, (count, error) in best]
+
+    def _truncate(self):
+        if len(self.counts) <= self.capacity:
+            return
+        kept = heapq.nlargest(self.capacity, self.counts.items(), key=lambda item: item[1][0])
+        kept_keys = {key for key, _ in kept}
+        dropped = max(entry[0] for key, entry in self.counts.items() if key not in kept_keys)
+        self.floor = max(self.floor, dropped)
+        self.counts = dict(kept)
+
+
+class HeavyHitterIndex:
+    """Per-region SpaceSaving summaries of a dimension (errorCode) for every populated hour and day.
+
+    Counts are weighted by the table's measure (e.g. errorCount). Range
+    queries merge whole days, then whole hours at the edges, and count raw
+    rows only for partial hours, like SketchIndex.
+    """
+
+    def __init__(self, table, dim, capacity=HEAVY_HITTERS_CAPACITY):
+        self.table = table
+        self.dim = dim
+        self.capacity = capacity
+        self.levels = {DAY_MS: {}, HOUR_MS: {}}
+        self.missing = {}
+        self.min_ts = MAX_TS
+        self.max_ts = MISSING_TS
+        # Exact counts per bucket first, then truncated: tighter than streaming every row through add()
+        exact = {DAY_MS: {}, HOUR_MS: {}}
+        missing = {}
+        region_column, key_column, values = table.codes[table.partition_by], table.codes[dim], table.values
+        for ts, i in zip(*table.partitions[None]):
+            if ts == MISSING_TS:
+                counts = missing.setdefault(region_column[i], {})
+                counts[key_column[i]] = counts.get(key_column[i], 0) + values[i]
+                continue
+            self.min_ts = min(self.min_ts, ts)
+            self.max_ts = max(self.max_ts, ts)
+            for bucket_ms, buckets in exact.items():
+                counts = buckets.setdefault((region_column[i], ts - ts % bucket_ms), {})
+                counts[key_column[i]] = counts.get(key_column[i], 0) + values[i]
+        for bucket_ms, buckets in exact.items():
+            self.levels[bucket_ms] = {key: SpaceSaving.from_counts(counts, capacity) for key, counts in buckets.items()}
+        self.missing = {code: SpaceSaving.from_counts(counts, capacity) for code, counts in missing.items()}
+
+    def extended(self, table, new_ids):
+        """This index for table (an extension of self.table) with only rows new_ids added."""
+        index = copy.copy(self)
+        index.table = table
+        index.levels = {bucket_ms: dict(buckets) for bucket_ms, buckets in self.levels.items()}
+        index.missing = dict(self.missing)
+        region_column, key_column = table.codes[table.partition_by], table.codes[self.dim]
+        copied = set()
+
+        def writable(buckets, key):
+            # Summaries shared with self are copied before the first add
+            summary = buckets.get(key)
+            if summary is None:
+                summary = buckets[key] = SpaceSaving(self.capacity)
+                copied.add(id(summary))
+            elif id(summary) not in copied:
+                summary = buckets[key] = summary.copy()
+                copied.add(id(summary))
+            return summary
+
+        for i in new_ids:
+            ts, value = table.timestamps[i], table.values[i]
+            if ts == MISSING_TS:
+                writable(index.missing, region_column[i]).add(key_column[i], value)
+                continue
+            index.min_ts = min(index.min_ts, ts)
+            index.max_ts = max(index.max_ts, ts)
+            for bucket_ms, buckets in index.levels.items():
+                writable(buckets, (region_column[i], ts - ts % bucket_ms)).add(key_column[i], value)
+        return index
+
+    def summary(self, region_code, lo, hi):
+        """Merged summary of region_code's rows in [lo, hi); lo <= MISSING_TS also includes undated rows."""
+        merged = SpaceSaving(self.capacity)
+        if lo <= MISSING_TS and region_code in self.missing:
+            merged.merge(self.missing[region_code])
+        lo = max(lo, self.min_ts - self.min_ts % DAY_MS)
+        hi = min(hi, self.max_ts - self.max_ts % DAY_MS + DAY_MS)
+        if lo < hi:
+            self._cover(merged, region_code, lo, hi, [DAY_MS, HOUR_MS])
+        return merged
+
+    def _cover(self, merged, region_code, lo, hi, levels):
+        if not levels:
+            table = self.table
+            key_column, counts = table.codes[self.dim], {}
+            for i in table.select(TimeRange(lo, hi), ordered=False, **{table.partition_by: [table.dictionaries[table.partition_by][region_code]]}):
+                counts[key_column[i]] = counts.get(key_column[i], 0) + table.values[i]
+            if counts:
+                merged.merge(SpaceSaving.from_counts(counts, self.capacity))
+            return
+        bucket_ms = levels[0]
+        first = -(-lo // bucket_ms) * bucket_ms
+        last = hi - hi % bucket_ms
+        if first >= last:
+            self._cover(merged, region_code, lo, hi, levels[1:])
+            return
+        self._cover(merged, region_code, lo, first, levels[1:])
+        buckets = self.levels[bucket_ms]
+        for start in range(first, last, bucket_ms):
+            summary = buckets.get((region_code, start))
+            if summary is not None:
+                merged.merge(summary)
+        self._cover(merged, region_code, last, hi, levels[1:])
+
+
+def get_heavy_hitter_index(table, dim):
+    # Built once per table and dimension, then extended as delta segments arrive
+    key = ("heavy_hitters", dim)
+    if key not in table.derived:
+        with _build_lock:
+            if key not in table.derived:
+                table.derived[key] = HeavyHitterIndex(table, dim)
+    return table.derived[key]
+
+
+@tracing.timed("aggregate")
+def top_keys(table, dim, time_filter=None, regions=None, by_region=False):
+    """Merged SpaceSaving of dim's values (names) over time_filter and regions (None = all).
+
+    With by_region, keys are (value, region) pairs. Text-based date filters
+    count the matching raw rows exactly instead.
+    """
+    partition = table.partition_by
+    region_names, names = table.dictionaries[partition], table.dictionaries[dim]
+    if regions is None:
+        codes = list(range(len(region_names)))
+    else:
+        codes = [table.lookups[partition][r] for r in regions if r in table.lookups[partition]]
+
+    if time_filter is not None and not isinstance(time_filter, TimeRange):
+        key_column, region_column, counts = table.codes[dim], table.codes[partition], {}
+        for i in table.select(time_filter, ordered=False, **{partition: [region_names[c] for c in codes]}):
+            key = (names[key_column[i]], region_names[region_column[i]]) if by_region else names[key_column[i]]
+            counts[key] = counts.get(key, 0) + table.values[i]
+        return SpaceSaving.from_counts(counts)
+
+    lo, hi = (time_filter.lo, time_filter.hi) if time_filter is not None else (MISSING_TS, MAX_TS)
+    index = get_heavy_hitter_index(table, dim)
+    merged = SpaceSaving(index.capacity)
+    for code in codes:
+        summary = index.summary(code, lo, hi)
+        if summary.total:
+            region = region_names[code]
+            merged.merge(summary.relabeled((lambda key: (names[key], region)) if by_region else names.__getitem__))
+    return merged
@@ -0,0 +1,200 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from blob_clients import get_blob_client
+
+# Flush once this many entries are buffered...
+INTERACTION_LOG_FLUSH_ENTRIES = int(os.environ.get("INTERACTION_LOG_FLUSH_ENTRIES", "50"))
+# ...and at least this often while entries are pending
+INTERACTION_LOG_FLUSH_SECONDS = float(os.environ.get("INTERACTION_LOG_FLUSH_SECONDS", "5"))
+# Entries kept while storage is unreachable; the oldest are dropped beyond this
+INTERACTION_LOG_MAX_BUFFER = int(os.environ.get("INTERACTION_LOG_MAX_BUFFER", "10000"))
+# Append blocks are capped at 4 MiB by the storage service
+MAX_APPEND_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def partition_blob_name(log_file, when):
+    """Map a legacy log name and a datetime to its hourly JSON Lines append blob.
+
+    e.g. interactions-log.json -> interactions-log/2025/05/25/12.jsonl
+    """
+    prefix = log_file[:-5] if log_file.endswith(".json") else log_file
+    return f"{prefix}/{when:%Y/%m/%d/%H}.jsonl"
+
+
+def _record_time(record, now):
+    # The record's own timestamp (naive UTC), unless it has none usable or claims to be from the future
+    value = record.get("timestamp") if isinstance(record, dict) else None
+    if not isinstance(value, str):
+        return now
+    try:
+        when = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return now
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return min(when, now)
+
+
+class AppendBlobLogger:
+    """Buffers JSON records in memory and appends them to hourly append blobs.
+
+    Callers only pay for a list append; a background thread serializes the
+    buffer as JSON Lines and writes it with append_block, which is atomic per
+    block, so concurrent workers never overwrite each other's entries. Records
+    land in the blob of the hour in their own timestamp field.
+    """
+
+    def __init__(self, log_file, connection_string=None,
+                 flush_entries=INTERACTION_LOG_FLUSH_ENTRIES, flush_seconds=INTERACTION_LOG_FLUSH_SECONDS,
+                 max_buffer=INTERACTION_LOG_MAX_BUFFER):
+        self.log_file = log_file
+        self.connection_string = connection_string
+        self.flush_entries = flush_entries
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._created = set()
+        self._dropped = 0
+        self._stats = {"flushes": 0, "records": 0, "failures": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0}
+        self._thread = threading.Thread(target=self._run, name=f"append-log-{log_file}", daemon=True)
+        self._thread.start()
+
+    def append(self, record):
+        with self._cond:
+            self._buffer.append(record)
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self._dropped += overflow
+            if len(self._buffer) >= self.flush_entries:
+                self._cond.notify()
+
+    def offer(self, records):
+        """Queue a batch only if it fits in the buffer; returns False when the caller should back off."""
+        with self._cond:
+            if len(self._buffer) + len(records) > self.max_buffer:
+                return False
+            self._buffer.extend(records)
+            if len(self._buffer) >= self.flush_entries:
+                self._cond.notify()
+            return True
+
+    def write(self, records):
+        """Append records to storage now, skipping the buffer; raises if not all of them were written."""
+        with self._flush_lock:
+            self._write(list(records))
+
+    def pending(self):
+        with self._cond:
+            return len(self._buffer)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                records, self._buffer = self._buffer, []
+                dropped, self._dropped = self._dropped, 0
+            if dropped:
+                logging.warning(f"Dropped {dropped} {self.log_file} entries while storage was unavailable")
+            if not records:
+                return
+            count = len(records)
+            started = time.perf_counter()
+            try:
+                self._write(records)
+            except Exception as e:
+                logging.error(f"Failed to append {len(records)} entries to {self.log_file}: {e}")
+                with self._cond:
+                    self._stats["failures"] += 1
+                    # Put them back in front of anything logged meanwhile and retry on the next flush.
+                    # This may push the buffer past max_buffer; offer() then rejects until it drains.
+                    self._buffer[:0] = records
+                return
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._cond:
+                self._stats["flushes"] += 1
+                self._stats["records"] += count
+                self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+                self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], round(elapsed_ms, 2))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._buffer)
+        return stats
+
+    def _write(self, records):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+        # Each record goes to the blob of the hour it was logged in, not the hour it is flushed in
+        now = datetime.datetime.utcnow()
+        groups = {}
+        for n, record in enumerate(records):
+            groups.setdefault(partition_blob_name(self.log_file, _record_time(record, now)), []).append(n)
+
+        written = set()
+        try:
+            for blob_name, positions in groups.items():
+                blob_client = get_blob_client(blob_name, connection_string=self.connection_string)
+                if blob_name not in self._created:
+                    try:
+                        blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+                    except (ResourceExistsError, ResourceModifiedError):
+                        pass
+                    self._created.add(blob_name)
+                block, block_size, in_block = [], 0, []
+                for n in positions:
+                    line = (json.dumps(records[n]) + "\n").encode("utf-8")
+                    if block and block_size + len(line) > MAX_APPEND_BLOCK_BYTES:
+                        blob_client.append_block(b"".join(block))
+                        written.update(in_block)
+                        block, block_size, in_block = [], 0, []
+                    block.append(line)
+                    block_size += len(line)
+                    in_block.append(n)
+                if block:
+                    blob_client.append_block(b"".join(block))
+                    written.update(in_block)
+        except Exception:
+            # Only the records that did not make it into a block are retried
+            records[:] = [record for n, record in enumerate(records) if n not in written]
+            raise
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.flush_entries:
+                    self._cond.wait(self.flush_seconds)
+            self.flush()
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+def get_append_logger(log_file, connection_string=None, **options):
+    """The worker's logger for log_file, flushed at exit; options (flush_entries, ...) apply when it is created."""
+    key = (log_file, connection_string)
+    with _loggers_lock:
+        logger = _loggers.get(key)
+        if logger is None:
+            logger = AppendBlobLogger(log_file, connection_string, **options)
+            _loggers[key] = logger
+        return logger
+
+
+def flush_all():
+    with _loggers_lock:
+        loggers = list(_loggers.values())
+    for logger in loggers:
+        logger.flush()
+
+
+atexit.register(flush_all)
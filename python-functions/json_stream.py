@@ -0,0 +1,156 @@
+import codecs
+import json
+import os
+
+# Peak bytes of JSON text (parse buffer + rows kept) a streaming load may hold
+STREAM_MEMORY_BUDGET_BYTES = int(os.environ.get("STREAM_MEMORY_BUDGET_BYTES", str(512 * 1024 * 1024)))
+# Top-level object keys whose array value holds the rows (errors.json is {"errorEntries": [...]})
+ROW_ARRAY_KEYS = ("errorEntries",)
+
+_WHITESPACE = " \t\r\n"
+# Characters that may legally follow a complete value
+_DELIMITERS = _WHITESPACE + ",]}:"
+
+
+class StreamBudgetExceeded(ValueError):
+    pass
+
+
+class _Reader:
+    """Incremental reader over an iterable of byte chunks.
+
+    Values are decoded one at a time with JSONDecoder.raw_decode; when a value
+    straddles a chunk boundary the next chunk is appended and decoding retried.
+    """
+
+    def __init__(self, chunks, budget_bytes):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.budget_bytes = budget_bytes
+        self.kept_bytes = 0
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self._decoder.decode(b"", final=True)
+            self.pos = 0
+            return False
+        self.buf = self.buf[self.pos:] + self._decoder.decode(chunk)
+        self.pos = 0
+        if len(self.buf) + self.kept_bytes > self.budget_bytes:
+            raise StreamBudgetExceeded(f"Streaming JSON load exceeded its {self.budget_bytes} byte budget")
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of JSON stream")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete value; returns (value, size in characters)."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+                # A number cut at a chunk boundary ("12" of "12.5") decodes fine, so only
+                # trust the value once the character after it is visible
+                if self.eof or (end < len(self.buf) and self.buf[end] in _DELIMITERS):
+                    size = end - self.pos
+                    self.pos = end
+                    return value, size
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def array(self, predicate, rows):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return rows
+        while True:
+            row, size = self.value()
+            if predicate is None or predicate(row):
+                rows.append(row)
+                self.kept_bytes += size
+            separator = self.peek()
+            self.pos += 1
+            if separator == "]":
+                return rows
+            if separator != ",":
+                raise ValueError(f"Expected ',' or ']' at offset {self.pos - 1} of JSON stream")
+
+    def object(self, predicate, array_keys):
+        # Returns (object, streamed) where streamed says whether a row array was filtered in place
+        self.expect("{")
+        obj = {}
+        streamed = False
+        if self.peek() == "}":
+            self.pos += 1
+            return obj, streamed
+        while True:
+            key, _ = self.value()
+            self.expect(":")
+            if key in array_keys and self.peek() == "[":
+                obj[key] = self.array(predicate, [])
+                streamed = True
+            else:
+                obj[key], size = self.value()
+                self.kept_bytes += size
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return obj, streamed
+            if separator != ",":
+                raise ValueError(f"Expected ',' or '}}' at offset {self.pos - 1} of JSON stream")
+
+
+def parse_json_stream(chunks, predicate=None, budget_bytes=STREAM_MEMORY_BUDGET_BYTES, array_keys=ROW_ARRAY_KEYS):
+    """Parse JSON from byte chunks as they arrive, keeping only rows that match predicate.
+
+    Accepts a top-level array of rows, an object wrapping its rows in one of
+    array_keys, or NDJSON (one row object per line). Returns the same shape
+    json.loads would (a list, or the wrapper dict), with non-matching rows
+    dropped as soon as they are decoded. Raises StreamBudgetExceeded if the
+    parse buffer plus the kept rows grow past budget_bytes.
+    """
+    reader = _Reader(chunks, budget_bytes)
+    first = reader.peek()
+    if first == "[":
+        result = reader.array(predicate, [])
+    elif first == "{":
+        objects = []
+        obj, streamed = reader.object(predicate, array_keys)
+        if streamed:
+            # Wrapper object: its row array was already filtered
+            objects = obj
+        else:
+            # NDJSON: the first object was a plain row, decode the rest whole
+            while obj is not None:
+                if predicate is None or predicate(obj):
+                    objects.append(obj)
+                obj = reader.value()[0] if reader.peek() == "{" else None
+        # A lone object that isn't a row wrapper comes back as-is, like json.loads
+        result = objects[0] if isinstance(objects, list) and len(objects) == 1 and reader.peek() is None and predicate is None else objects
+    else:
+        result, _ = reader.value()
+    if reader.peek() is not None:
+        raise ValueError(f"Unexpected data at offset {reader.pos} of JSON stream")
+    return result
@@ -1,51 +1,67 @@
 import logging
 import azure.functions as func
 import os
-from azure.storage.blob import BlobServiceClient
 import json
-from datetime import datetime
+import time
+from interaction_log import get_append_logger
+
+# Events waiting to be appended before new posts are rejected with 429
+LOG_EVENT_MAX_QUEUE = int(os.environ.get("LOG_EVENT_MAX_QUEUE", "5000"))
+LOG_EVENT_FLUSH_ENTRIES = int(os.environ.get("LOG_EVENT_FLUSH_ENTRIES", "500"))
+LOG_EVENT_FLUSH_SECONDS = float(os.environ.get("LOG_EVENT_FLUSH_SECONDS", "1"))
+
+def get_event_logger():
+    # One queue per worker; events land in copilot-logs/YYYY/MM/DD/HH.jsonl append blobs.
+    # Registered with interaction_log so events already answered with 202 are flushed at exit.
+    return get_append_logger(
+        'copilot-logs.json',
+        connection_string=os.getenv('AzureWebJobsStorage'),
+        flush_entries=LOG_EVENT_FLUSH_ENTRIES,
+        flush_seconds=LOG_EVENT_FLUSH_SECONDS,
+        max_buffer=LOG_EVENT_MAX_QUEUE,
+    )
+
+def parse_events(body):
+    """Accept a single JSON event, a JSON array of events, or NDJSON (one event per line)."""
+    text = body.decode('utf-8')
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # Not a single JSON document; fall back to NDJSON (raises ValueError on a bad line)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request for logging.')
+    started = time.perf_counter()
 
     try:
-        log_data = req.get_json()
+        events = parse_events(req.get_body())
     except ValueError:
         return func.HttpResponse(
             'Invalid JSON in request body.',
             status_code=400
         )
+    if not events:
+        return func.HttpResponse('No events in request body.', status_code=400)
 
-    # Azure Blob Storage setup
-    connect_str = os.getenv('AzureWebJobsStorage')
-    container_name = 'telemetry'
-    blob_name = 'copilot-logs.json'  # Changed from .jsonl to .json
-    blob_service_client = BlobServiceClient.from_connection_string(connect_str)
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-
-    # Download existing log file (if it exists)
-    try:
-        existing_data = blob_client.download_blob().readall().decode('utf-8')
-    except Exception:
-        existing_data = ''  # File may not exist yet
-
-    # Prepare new log entry (as a JSON array)
-    try:
-        logs = json.loads(existing_data) if existing_data else []
-    except Exception:
-        logs = []
-    logs.append(log_data)
-    updated_data = json.dumps(logs, indent=2)
-
-    # Upload the updated log file (overwrite)
-    try:
-        blob_client.upload_blob(updated_data, overwrite=True)
-        logging.info('Successfully wrote log to blob.')
-    except Exception as e:
-        logging.error(f'Failed to write log to blob: {e}')
+    event_logger = get_event_logger()
+    if not event_logger.offer(events):
+        logging.warning(f'log_event queue full ({event_logger.pending()} pending), rejecting batch of {len(events)}')
         return func.HttpResponse(
-            f'Failed to write log to blob: {e}\nLogs attempted: {updated_data[:500]}',
-            status_code=500
+            json.dumps({"error": "Ingest queue is full, retry later.", "pending": event_logger.pending()}),
+            status_code=429,
+            headers={"Retry-After": "1"},
+            mimetype="application/json"
         )
 
-    return func.HttpResponse('Log appended to copilot-logs.json.', status_code=200)
+    ingest_ms = round((time.perf_counter() - started) * 1000, 2)
+    stats = event_logger.stats()
+    logging.info(f'Queued {len(events)} events in {ingest_ms} ms ({stats["pending"]} pending)')
+    response = {
+        "accepted": len(events),
+        "ingestLatencyMs": ingest_ms,
+        "pending": stats["pending"],
+        "lastFlushMs": stats["last_flush_ms"],
+    }
+    return func.HttpResponse(json.dumps(response), status_code=202, mimetype="application/json")
@@ -0,0 +1,405 @@
+"""Columnar segments of the interaction logs, and usage analytics over them.
+
+interaction_log appends one JSON record per request to hourly JSON Lines
+blobs (interactions-log/2025/05/25/12.jsonl, and copilot-logs/... for
+log_event); older deployments wrote the same records to a single growing JSON
+array (interactions-log.json). compact() turns every closed hour, and the
+legacy array split by the hour of each record's timestamp, into segments:
+
+    interactions-log-segments/2025/05/25/12.seg
+    interactions-log-segments/legacy/2025/05/25/12.seg
+
+A segment holds its records' timestamps, endpoints, parameters, response
+sizes and error flags as compressed columns sorted by time, and carries its
+min/max timestamp in blob metadata. usage_stats() lists the segments, skips
+every one whose range misses the requested one without downloading it, and
+aggregates the rest. The hourly blobs are left in place; an hour that changes
+after it was compacted (a late flush) is compacted again.
+
+    python log_segments.py compact
+    python log_segments.py stats --start-date 2025-05-01 --end-date 2025-05-02
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+import tracing
+from blob_clients import get_blob_client, get_container_client
+from interaction_log import partition_blob_name
+from json_stream import parse_json_stream
+from rollups import DAY_MS, HOUR_MS
+from sketches import DDSketch
+from telemetry_query import MAX_TS, MISSING_TS, TimeRange, date_filter, format_timestamp_ms, parse_timestamp_ms
+
+MAGIC = b"AZOBLOG1"
+FORMAT_VERSION = 1
+# Logs usage_stats can query (log=), and the blobs compact() reads them from
+USAGE_LOGS = {"interactions": "interactions-log.json", "copilot": "copilot-logs.json"}
+# An hourly blob is compacted once its hour ended this long ago (writers pick the hour by their own clock)
+LOG_COMPACT_MIN_AGE_SECONDS = float(os.environ.get("LOG_COMPACT_MIN_AGE_SECONDS", "600"))
+# Parameter values are cut to this many characters before they are counted
+LOG_PARAM_MAX_CHARS = int(os.environ.get("LOG_PARAM_MAX_CHARS", "200"))
+# Decoded segments kept in memory per worker
+LOG_SEGMENT_CACHE_ENTRIES = int(os.environ.get("LOG_SEGMENT_CACHE_ENTRIES", "256"))
+# Most common parameters usage_stats returns, by default and at most
+USAGE_DEFAULT_TOP = int(os.environ.get("USAGE_DEFAULT_TOP", "10"))
+USAGE_MAX_TOP = int(os.environ.get("USAGE_MAX_TOP", "100"))
+USAGE_BUCKETS = {"hour": HOUR_MS, "day": DAY_MS}
+
+_SECTIONS = (("timestamps", "q"), ("endpoints", "i"), ("sizes", "q"), ("errors", "B"), ("param_offsets", "i"), ("param_codes", "i"))
+
+
+def segment_prefix(log_file):
+    stem = log_file[:-5] if log_file.endswith(".json") else log_file
+    return f"{stem}-segments/"
+
+
+def segment_blob_name(log_file, source):
+    """e.g. interactions-log/2025/05/25/12.jsonl -> interactions-log-segments/2025/05/25/12.seg"""
+    stem = log_file[:-5] if log_file.endswith(".json") else log_file
+    return f"{segment_prefix(log_file)}{source[len(stem) + 1:-len('.jsonl')]}.seg"
+
+
+def _row(record):
+    # (timestamp ms, endpoint, ["name=value", ...], response bytes, error) of one log record
+    if not isinstance(record, dict):
+        return None
+    endpoint = record.get("query") or record.get("event") or record.get("type") or "unknown"
+    parameters = record.get("parameters")
+    pairs = []
+    if isinstance(parameters, dict):
+        for name, value in parameters.items():
+            value = value if isinstance(value, str) else json.dumps(value)
+            pairs.append(f"{name}={value[:LOG_PARAM_MAX_CHARS]}")
+    # log_event records have no response; their size is the event's own
+    response = record.get("response", record)
+    size = len(json.dumps(response, separators=(",", ":")))
+    error = isinstance(response, dict) and "error" in response
+    return parse_timestamp_ms(record.get("timestamp")), str(endpoint), pairs, size, error
+
+
+def encode_segment(records):
+    """(segment bytes, min timestamp, max timestamp, rows) for an iterable of log records."""
+    rows = sorted(filter(None, map(_row, records)), key=lambda row: row[0])
+    endpoints, parameters = {}, {}
+    columns = {name: array(typecode) for name, typecode in _SECTIONS}
+    columns["param_offsets"].append(0)
+    for ts, endpoint, pairs, size, error in rows:
+        columns["timestamps"].append(ts)
+        columns["endpoints"].append(endpoints.setdefault(endpoint, len(endpoints)))
+        columns["sizes"].append(size)
+        columns["errors"].append(1 if error else 0)
+        columns["param_codes"].extend(parameters.setdefault(pair, len(parameters)) for pair in pairs)
+        columns["param_offsets"].append(len(columns["param_codes"]))
+
+    # Layout: MAGIC | uint32 header length | header JSON | zlib-compressed sections
+    payloads, layout, offset = [], {}, 0
+    for name, typecode in _SECTIONS:
+        payload = zlib.compress(columns[name].tobytes(), 6)
+        layout[name] = {"offset": offset, "length": len(payload), "typecode": typecode}
+        payloads.append(payload)
+        offset += len(payload)
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "rows": len(rows),
+        "byteorder": sys.byteorder,
+        "endpoints": list(endpoints),
+        "parameters": list(parameters),
+        "sections": layout,
+    }).encode("utf-8")
+    dated = [ts for ts in columns["timestamps"] if ts != MISSING_TS]
+    data = MAGIC + struct.pack("<I", len(header)) + header + b"".join(payloads)
+    return data, min(dated, default=MISSING_TS), max(dated, default=MISSING_TS), len(rows)
+
+
+class Segment:
+    """Decoded columns of one segment; rows are sorted by timestamp."""
+
+    def __init__(self, data):
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a log segment")
+        (length,) = struct.unpack_from("<I", data, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(data[start:start + length])
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported log segment version {header.get('version')}")
+        start += length
+        self.endpoint_names = header["endpoints"]
+        self.parameter_names = header["parameters"]
+        for name, info in header["sections"].items():
+            column = array(info["typecode"], zlib.decompress(data[start + info["offset"]:start + info["offset"] + info["length"]]))
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            setattr(self, name, column)
+
+
+def _client(name):
+    # The loggers write with the Functions storage account when it is configured
+    return get_blob_client(name, connection_string=os.environ.get("AzureWebJobsStorage"))
+
+
+def _container():
+    return get_container_client(connection_string=os.environ.get("AzureWebJobsStorage"))
+
+
+def _tag(etag):
+    return (etag or "").strip('"')
+
+
+def _upload(name, records, source, source_etag):
+    data, min_ts, max_ts, rows = encode_segment(records)
+    metadata = {"min_ts": str(min_ts), "max_ts": str(max_ts), "rows": str(rows), "source": source, "source_etag": _tag(source_etag)}
+    _client(name).upload_blob(data, overwrite=True, metadata=metadata)
+    return rows
+
+
+def _read_jsonl(name):
+    raw = _client(name).download_blob()
+    records = []
+    for line in raw.readall().decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            logging.warning(f"Skipping malformed line in {name}")
+    return records, raw.properties.etag
+
+
+def compact(log_file, min_age_seconds=LOG_COMPACT_MIN_AGE_SECONDS):
+    """Write segments for log_file's closed hours and legacy array that changed since they were compacted.
+
+    Returns how many segments were written.
+    """
+    container = _container()
+    stem = log_file[:-5] if log_file.endswith(".json") else log_file
+    segments = {blob.name: blob.metadata or {} for blob in container.list_blobs(name_starts_with=segment_prefix(log_file), include=["metadata"])}
+    cutoff = partition_blob_name(log_file, datetime.datetime.utcnow() - datetime.timedelta(seconds=min_age_seconds))
+    written = 0
+    for blob in container.list_blobs(name_starts_with=f"{stem}/"):
+        if not blob.name.endswith(".jsonl") or blob.name >= cutoff:
+            continue
+        name = segment_blob_name(log_file, blob.name)
+        if segments.get(name, {}).get("source_etag") == _tag(blob.etag):
+            continue
+        records, etag = _read_jsonl(blob.name)
+        rows = _upload(name, records, blob.name, etag)
+        logging.info(f"Compacted {blob.name} ({rows} records) into {name}")
+        written += 1
+    return written + _compact_legacy(log_file, segments)
+
+
+def _compact_legacy(log_file, segments):
+    from azure.core.exceptions import ResourceNotFoundError
+    client = _client(log_file)
+    prefix = f"{segment_prefix(log_file)}legacy/"
+    existing = [name for name in segments if name.startswith(prefix)]
+    try:
+        # Compare ETags before downloading what may be a large array
+        etag = _tag(client.get_blob_properties().etag)
+        if existing and all(segments[name].get("source_etag") == etag for name in existing):
+            return 0
+        stream = client.download_blob()
+    except ResourceNotFoundError:
+        return 0
+
+    hours = {}
+    data = parse_json_stream(stream.chunks())
+    for record in data if isinstance(data, list) else []:
+        ts = parse_timestamp_ms(record.get("timestamp")) if isinstance(record, dict) else MISSING_TS
+        hour = "undated" if ts == MISSING_TS else format_timestamp_ms(ts - ts % HOUR_MS)[:13].replace("-", "/").replace("T", "/")
+        hours.setdefault(hour, []).append(record)
+    # An array without records still gets a (rowless) segment, which records the ETag it was compacted at
+    names = set()
+    for hour, records in sorted(hours.items()) or [("empty", [])]:
+        names.add(f"{prefix}{hour}.seg")
+        _upload(f"{prefix}{hour}.seg", records, log_file, stream.properties.etag)
+    # Hours the legacy array no longer has
+    for name in existing:
+        if name not in names:
+            try:
+                _client(name).delete_blob()
+            except ResourceNotFoundError:
+                pass
+    logging.info(f"Compacted {log_file} ({sum(map(len, hours.values()))} records) into {len(names)} segments")
+    return len(names)
+
+
+def compact_all(**kwargs):
+    """compact() every log in USAGE_LOGS; returns {log_file: segments written}."""
+    written = {}
+    for log_file in USAGE_LOGS.values():
+        try:
+            written[log_file] = compact(log_file, **kwargs)
+        except Exception as e:
+            logging.error(f"Compaction of {log_file} failed: {e}")
+    return written
+
+
+_segment_cache = OrderedDict()
+_segment_cache_lock = threading.Lock()
+
+
+def load_segment(name, etag):
+    # Segments are rewritten, never modified in place, so (name, ETag) identifies the content
+    key = (name, etag)
+    with _segment_cache_lock:
+        segment = _segment_cache.get(key)
+        if segment is not None:
+            _segment_cache.move_to_end(key)
+            return segment
+    data = _client(name).download_blob().readall()
+    tracing.count("bytes", len(data))
+    segment = Segment(data)
+    with _segment_cache_lock:
+        _segment_cache[key] = segment
+        while len(_segment_cache) > LOG_SEGMENT_CACHE_ENTRIES:
+            _segment_cache.popitem(last=False)
+    return segment
+
+
+def _overlaps(metadata, lo, hi):
+    # Segments without a recorded range can't be pruned; undated-only segments only match unbounded queries
+    try:
+        min_ts, max_ts = int(metadata["min_ts"]), int(metadata["max_ts"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    if min_ts == MISSING_TS:
+        return lo <= MISSING_TS
+    return min_ts < hi and max_ts >= lo
+
+
+def usage_stats(params):
+    """Requests per endpoint per hour or day, the most common parameters and the response-size distribution.
+
+    Returns (status_code, response) like the telemetry_api handlers.
+    """
+    log_name = (params.get("log") or "interactions").lower()
+    bucket = (params.get("bucket") or "hour").lower()
+    endpoint = params.get("endpoint")
+    top = params.get("top")
+    if log_name not in USAGE_LOGS:
+        return 400, {"error": f"Invalid log. Use one of {', '.join(USAGE_LOGS)}."}
+    if bucket not in USAGE_BUCKETS:
+        return 400, {"error": f"Invalid bucket. Use one of {', '.join(USAGE_BUCKETS)}."}
+    if top is not None and (not top.isdigit() or not 1 <= int(top) <= USAGE_MAX_TOP):
+        return 400, {"error": f"Invalid top. Use an integer between 1 and {USAGE_MAX_TOP}."}
+    top = int(top) if top is not None else USAGE_DEFAULT_TOP
+    time_filter = date_filter(params.get("date"), params.get("start_date"), params.get("end_date"))
+    if time_filter is not None and not isinstance(time_filter, TimeRange):
+        return 400, {"error": "Invalid date. Use YYYY, YYYY-MM or YYYY-MM-DD."}
+    lo, hi = (time_filter.lo, time_filter.hi) if time_filter is not None else (MISSING_TS, MAX_TS)
+
+    with tracing.stage("list"):
+        listed = [blob for blob in _container().list_blobs(name_starts_with=segment_prefix(USAGE_LOGS[log_name]), include=["metadata"])
+                  if blob.name.endswith(".seg")]
+    selected = [blob for blob in listed if _overlaps(blob.metadata or {}, lo, hi)]
+
+    bucket_ms = USAGE_BUCKETS[bucket]
+    endpoints, parameters, sizes = {}, {}, DDSketch()
+    requests = errors = total_bytes = 0
+    with tracing.stage("scan"):
+        for blob in selected:
+            segment = load_segment(blob.name, blob.etag)
+            timestamps = segment.timestamps
+            start, end = bisect_left(timestamps, lo), bisect_left(timestamps, hi)
+            wanted = None
+            if endpoint is not None:
+                wanted = segment.endpoint_names.index(endpoint) if endpoint in segment.endpoint_names else -1
+            param_counts = {}
+            for i in range(start, end):
+                code = segment.endpoints[i]
+                if wanted is not None and code != wanted:
+                    continue
+                entry = endpoints.get(segment.endpoint_names[code])
+                if entry is None:
+                    entry = endpoints[segment.endpoint_names[code]] = {"requests": 0, "errors": 0, "series": {}}
+                entry["requests"] += 1
+                entry["errors"] += segment.errors[i]
+                ts = timestamps[i]
+                if ts != MISSING_TS:
+                    series = entry["series"]
+                    series[ts - ts % bucket_ms] = series.get(ts - ts % bucket_ms, 0) + 1
+                for p in segment.param_codes[segment.param_offsets[i]:segment.param_offsets[i + 1]]:
+                    param_counts[p] = param_counts.get(p, 0) + 1
+                requests += 1
+                errors += segment.errors[i]
+                total_bytes += segment.sizes[i]
+                sizes.add(max(segment.sizes[i], 1))
+            for p, count in param_counts.items():
+                pair = segment.parameter_names[p]
+                parameters[pair] = parameters.get(pair, 0) + count
+    tracing.count("rows", requests)
+
+    top_parameters = []
+    for pair, count in sorted(parameters.items(), key=lambda item: (-item[1], item[0]))[:top]:
+        name, _, value = pair.partition("=")
+        top_parameters.append({"parameter": name, "value": value, "requests": count, "share": round(count / requests, 4)})
+    quantile = lambda q: int(round(sizes.quantile(q))) if requests else None
+    response = {
+        "log": log_name,
+        "bucket": bucket,
+        "segments": {"listed": len(listed), "scanned": len(selected)},
+        "requests": requests,
+        "errors": errors,
+        "endpoints": {
+            name: {
+                "requests": entry["requests"],
+                "errors": entry["errors"],
+                "series": [{"start": format_timestamp_ms(start), "requests": count} for start, count in sorted(entry["series"].items())],
+            }
+            for name, entry in sorted(endpoints.items(), key=lambda item: -item[1]["requests"])
+        },
+        "topParameters": top_parameters,
+        "responseBytes": {
+            "total": total_bytes,
+            "mean": round(total_bytes / requests, 1) if requests else None,
+            "p50": quantile(0.5),
+            "p90": quantile(0.9),
+            "p99": quantile(0.99),
+            "histogram": [{"le": int(round(b["le"])), "count": b["count"]} for b in sizes.histogram()] if requests else [],
+        },
+    }
+    return 200, response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact interaction logs into columnar segments, or query them.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compaction = sub.add_parser("compact", help="write segments for closed hours and legacy arrays")
+    compaction.add_argument("log_file", nargs="?", help="log blob, e.g. interactions-log.json (default: every log)")
+    compaction.add_argument("--min-age-seconds", type=float, default=LOG_COMPACT_MIN_AGE_SECONDS)
+    stats = sub.add_parser("stats", help="print usage_stats for a time range")
+    stats.add_argument("--log", default="interactions", choices=list(USAGE_LOGS))
+    stats.add_argument("--date")
+    stats.add_argument("--start-date")
+    stats.add_argument("--end-date")
+    stats.add_argument("--endpoint")
+    stats.add_argument("--bucket", default="hour", choices=list(USAGE_BUCKETS))
+    stats.add_argument("--top")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        options = {"min_age_seconds": args.min_age_seconds}
+        written = {args.log_file: compact(args.log_file, **options)} if args.log_file else compact_all(**options)
+        for log_file, count in written.items():
+            print(f"{log_file}: wrote {count} segments")
+    else:
+        params = {"log": args.log, "date": args.date, "start_date": args.start_date, "end_date": args.end_date,
+                  "endpoint": args.endpoint, "bucket": args.bucket, "top": args.top}
+        status, response = usage_stats({k: v for k, v in params.items() if v is not None})
+        print(json.dumps(response, indent=2))
+        sys.exit(0 if status == 200 else 1)
+
+
+if __name__ == "__main__":
+    main()
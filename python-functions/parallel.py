@@ -0,0 +1,198 @@
+"""Sharded aggregation over a process pool for tables too big for one core.
+
+A table's time-sorted order, timestamps, measure and dimension codes are
+copied once into shared memory; each worker process attaches to them, scans
+one contiguous time shard and returns per-(group, bucket) partials
+(count/sum/min/max and optionally a DDSketch), which the caller merges.
+Below PARALLEL_MIN_ROWS rows, or when the pool can't be used, the same scan
+runs in-process, so results never depend on which path ran.
+"""
+import logging
+import os
+import threading
+import weakref
+from bisect import bisect_left
+
+import tracing
+from telemetry_query import MISSING_TS
+
+PARALLEL_AGGREGATION = os.environ.get("PARALLEL_AGGREGATION", "true").lower() == "true"
+# Scans smaller than this many rows stay in-process; the pool only pays off on big tables
+PARALLEL_MIN_ROWS = int(os.environ.get("PARALLEL_MIN_ROWS", "500000"))
+PARALLEL_WORKERS = int(os.environ.get("PARALLEL_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+_export_lock = threading.Lock()
+
+
+def partials(columns, start, end, group_dims=(), bucket_ms=None, filters=(), sketch=False):
+    """Scan rows start..end of the time order; {(group codes, bucket start): [count, sum, min, max, sketch]}.
+
+    columns maps "timestamps" (sorted), "order", "values" and "codes.<dim>" to
+    int/float sequences. filters is [(dim, codes to keep)]. The bucket is
+    None without bucket_ms, and for rows without a usable timestamp.
+    """
+    if sketch:
+        from sketches import DDSketch
+    timestamps, order, values = columns["timestamps"], columns["order"], columns["values"]
+    group_columns = [columns[f"codes.{dim}"] for dim in group_dims]
+    checks = [(columns[f"codes.{dim}"], set(codes)) for dim, codes in filters]
+    out = {}
+    for k in range(start, end):
+        i = order[k]
+        if checks and any(column[i] not in codes for column, codes in checks):
+            continue
+        ts = timestamps[k]
+        bucket = ts - ts % bucket_ms if bucket_ms is not None and ts != MISSING_TS else None
+        key = (tuple(column[i] for column in group_columns), bucket)
+        value = values[i]
+        acc = out.get(key)
+        if acc is None:
+            acc = out[key] = [0, 0, value, value, DDSketch() if sketch else None]
+        acc[0] += 1
+        acc[1] += value
+        if value < acc[2]:
+            acc[2] = value
+        if value > acc[3]:
+            acc[3] = value
+        if sketch:
+            acc[4].add(value)
+    return out
+
+
+def merge(results):
+    """Combine partials() results from several shards."""
+    merged = {}
+    for result in results:
+        for key, acc in result.items():
+            total = merged.get(key)
+            if total is None:
+                merged[key] = acc
+                continue
+            total[0] += acc[0]
+            total[1] += acc[1]
+            total[2] = min(total[2], acc[2])
+            total[3] = max(total[3], acc[3])
+            if total[4] is not None:
+                total[4].merge(acc[4])
+    return merged
+
+
+def should_shard(table, lo, hi):
+    """Whether scan(table, lo, hi) would be split across the process pool."""
+    if not PARALLEL_AGGREGATION or PARALLEL_WORKERS < 2 or table.size < PARALLEL_MIN_ROWS:
+        return False
+    sorted_ts = table.partitions[None][0]
+    return bisect_left(sorted_ts, hi) - bisect_left(sorted_ts, lo) >= PARALLEL_MIN_ROWS
+
+
+def scan(table, lo, hi, **options):
+    """merge(partials(...)) over the rows with lo <= timestamp < hi, sharded across processes when it pays off."""
+    sorted_ts = table.partitions[None][0]
+    start, end = bisect_left(sorted_ts, lo), bisect_left(sorted_ts, hi)
+    # At least PARALLEL_MIN_ROWS / 2 rows per shard, so process overhead stays small next to the scan
+    workers = min(PARALLEL_WORKERS, (end - start) // max(1, PARALLEL_MIN_ROWS // 2))
+    if should_shard(table, lo, hi) and workers > 1:
+        try:
+            with tracing.stage("parallel"):
+                return _scan_parallel(table, start, end, workers, options)
+        except Exception as e:
+            logging.warning(f"Parallel aggregation failed, scanning in-process: {e}")
+    return partials(_local_columns(table), start, end, **options)
+
+
+def _local_columns(table):
+    columns = {"timestamps": table.partitions[None][0], "order": table.partitions[None][1], "values": table.values}
+    for dim, codes in table.codes.items():
+        columns[f"codes.{dim}"] = codes
+    return columns
+
+
+def _scan_parallel(table, start, end, workers, options):
+    from concurrent.futures.process import BrokenProcessPool
+    exported = _export(table)
+    bounds = [start + (end - start) * n // workers for n in range(workers + 1)]
+    specs = [(exported.layout, bounds[n], bounds[n + 1], options) for n in range(workers)]
+    tracing.count("shards", workers)
+    try:
+        results = list(_get_pool().map(_run_shard, specs))
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+    return merge(results)
+
+
+class SharedColumns:
+    """A table's scan columns copied into shared memory blocks, unlinked when the table goes away."""
+
+    def __init__(self, table):
+        from multiprocessing import shared_memory
+        self.blocks = []
+        self.layout = {}
+        try:
+            for name, column in _local_columns(table).items():
+                data = memoryview(column).cast("B")
+                block = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+                self.blocks.append(block)
+                block.buf[:data.nbytes] = data
+                self.layout[name] = (block.name, column.typecode if hasattr(column, "typecode") else column.format, data.nbytes)
+        except Exception:
+            _release(self.blocks)
+            raise
+        weakref.finalize(self, _release, list(self.blocks))
+
+
+def _release(blocks):
+    for block in blocks:
+        try:
+            block.close()
+            block.unlink()
+        except (FileNotFoundError, BufferError):
+            pass
+
+
+def _export(table):
+    # Once per table, like the other derived structures
+    if "shared_columns" not in table.derived:
+        with _export_lock:
+            if "shared_columns" not in table.derived:
+                table.derived["shared_columns"] = SharedColumns(table)
+    return table.derived["shared_columns"]
+
+
+def _run_shard(spec):
+    # Worker process entry point
+    from multiprocessing import shared_memory
+    layout, start, end, options = spec
+    blocks, views = [], {}
+    try:
+        for name, (block_name, typecode, nbytes) in layout.items():
+            # Workers share the parent's resource tracker, so attaching doesn't hand over ownership
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            views[name] = block.buf[:nbytes].cast(typecode)
+        return partials(views, start, end, **options)
+    finally:
+        for view in views.values():
+            view.release()
+        views.clear()
+        for block in blocks:
+            block.close()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn: forking a process that runs the Functions host's threads isn't safe
+            _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from telemetry_query import MISSING_TS, TimeRange, date_filter, parse_timestamp_ms
+
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+# Budget for the JSON size of cached responses
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Query parameters each endpoint reads; anything else (trace=, ...) doesn't change the answer
+QUERY_PARAMS = {
+    "get_latency": ("region", "regions", "date", "start_date", "end_date", "compare", "update_timestamp", "stat",
+                    "interval", "points", "downsample"),
+    "check_errors": ("region", "code", "date", "start_date", "end_date", "interval", "points", "downsample", "group_by", "top"),
+    "list_incidents": ("region", "status", "date", "start_date", "end_date", "limit", "cursor", "fields", "sort", "format", "q"),
+    "detect_anomalies": ("metric", "region", "bucket", "window", "threshold", "date", "start_date", "end_date"),
+}
+
+
+def cache_key(function, params):
+    """Normalized form of a query: equivalent parameter spellings map to the same key.
+
+    Regions and statuses are case-folded, region lists are stripped and
+    lower-cased, date/start_date/end_date are replaced by the time range they
+    resolve to and update_timestamp by its epoch ms. Responses that echo the
+    region back (update_timestamp, date=recent) keep it as given.
+    """
+    raw = {name: params.get(name) for name in QUERY_PARAMS[function] if params.get(name) not in (None, "")}
+    key = {}
+    for name, value in raw.items():
+        if name in ("date", "start_date", "end_date"):
+            continue
+        if name == "region" and not (function == "get_latency" and ("update_timestamp" in raw or raw.get("date") == "recent")):
+            value = value.lower()
+        elif name == "regions":
+            value = tuple(r.strip().lower() for r in value.split(",") if r.strip())
+        elif name in ("status", "stat", "metric", "bucket", "interval", "downsample", "group_by"):
+            value = value.lower()
+        elif name == "update_timestamp":
+            value = parse_timestamp_ms(value)
+            if value == MISSING_TS:
+                return None
+        key[name] = value
+    time_filter = date_filter(raw.get("date"), raw.get("start_date"), raw.get("end_date"))
+    if isinstance(time_filter, TimeRange):
+        key["time"] = (time_filter.lo, time_filter.hi)
+    elif time_filter is not None:
+        key["time"] = (raw.get("date"), raw.get("start_date"), raw.get("end_date"))
+    return (function, tuple(sorted(key.items())))
+
+
+def etag_for(key, version):
+    # Responses are a pure function of the normalized query and the snapshot they were computed from
+    digest = hashlib.blake2b(repr((key, version)).encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+class ResponseCache:
+    """LRU of endpoint responses keyed on (normalized query, blob, blob version).
+
+    Entries expire after ttl_seconds and are evicted beyond max_entries or
+    max_bytes of response JSON. Seeing a new version of a blob drops every
+    entry computed from its previous version.
+    """
+
+    def __init__(self, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key, blob_name, version):
+        with self._lock:
+            entry = self._entries.get((key, blob_name, version))
+            if entry is None or time.monotonic() - entry["stored_at"] >= self.ttl_seconds:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end((key, blob_name, version))
+            self._counters["hits"] += 1
+            return entry
+
+    def put(self, key, blob_name, version, response, logged):
+        size = len(json.dumps(response))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._versions.get(blob_name) != version:
+                self._drop(lambda k: k[1] == blob_name)
+                self._counters["invalidations"] += 1 if blob_name in self._versions else 0
+                self._versions[blob_name] = version
+            previous = self._entries.pop((key, blob_name, version), None)
+            if previous is not None:
+                self._total_bytes -= previous["size"]
+            self._entries[(key, blob_name, version)] = {"response": response, "logged": logged, "size": size, "stored_at": time.monotonic()}
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted["size"]
+                self._counters["evictions"] += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self._counters["not_modified"] += 1
+
+    def invalidate(self, blob_name=None):
+        with self._lock:
+            self._drop(lambda k: blob_name is None or k[1] == blob_name)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._total_bytes
+        return stats
+
+    def _drop(self, match):
+        # Called with _lock held
+        for k in [k for k in self._entries if match(k)]:
+            self._total_bytes -= self._entries.pop(k)["size"]
+
+
+response_cache = ResponseCache()
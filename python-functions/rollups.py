@@ -0,0 +1,253 @@
+import copy
+import threading
+from array import array
+from bisect import bisect_left
+
+import parallel
+import tracing
+from telemetry_query import MAX_TS, MISSING_TS, TimeRange
+
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
+
+_build_lock = threading.Lock()
+
+
+class BucketSeries:
+    """Populated time buckets of one group with per-bucket count/sum/min/max.
+
+    prefix_count/prefix_sum hold cumulative totals (one extra leading zero), so
+    the count or sum over any run of buckets is a subtraction.
+    """
+
+    def __init__(self, integral):
+        self.starts = array("q")
+        self.counts = array("q")
+        self.sums = array("q" if integral else "d")
+        self.mins = array("d")
+        self.maxs = array("d")
+        self.prefix_count = array("q", [0])
+        self.prefix_sum = array("q" if integral else "d", [0])
+        # Rows without a usable timestamp: only part of unbounded queries
+        self.missing_count = 0
+        self.missing_sum = 0
+
+    def add(self, bucket_start, value):
+        if not self.starts or self.starts[-1] != bucket_start:
+            self.starts.append(bucket_start)
+            self.counts.append(0)
+            self.sums.append(0)
+            self.mins.append(value)
+            self.maxs.append(value)
+        self.counts[-1] += 1
+        self.sums[-1] += value
+        if value < self.mins[-1]:
+            self.mins[-1] = value
+        if value > self.maxs[-1]:
+            self.maxs[-1] = value
+
+    def insert(self, bucket_start, value):
+        # add() for rows arriving out of time order (delta segments)
+        i = bisect_left(self.starts, bucket_start)
+        if i == len(self.starts) or self.starts[i] != bucket_start:
+            self.starts.insert(i, bucket_start)
+            self.counts.insert(i, 0)
+            self.sums.insert(i, 0)
+            self.mins.insert(i, value)
+            self.maxs.insert(i, value)
+        self.counts[i] += 1
+        self.sums[i] += value
+        if value < self.mins[i]:
+            self.mins[i] = value
+        if value > self.maxs[i]:
+            self.maxs[i] = value
+
+    def copy(self):
+        series = copy.copy(self)
+        series.starts = array("q", self.starts)
+        series.counts = array("q", self.counts)
+        series.sums = array(self.sums.typecode, self.sums)
+        series.mins = array("d", self.mins)
+        series.maxs = array("d", self.maxs)
+        return series
+
+    def add_bucket(self, bucket_start, count, total, low, high):
+        # A whole bucket aggregated elsewhere (see parallel.py); buckets must arrive in time order
+        self.starts.append(bucket_start)
+        self.counts.append(count)
+        self.sums.append(total)
+        self.mins.append(low)
+        self.maxs.append(high)
+
+    def finish(self):
+        self.prefix_count = array("q", [0])
+        self.prefix_sum = array(self.sums.typecode, [0])
+        for count, total in zip(self.counts, self.sums):
+            self.prefix_count.append(self.prefix_count[-1] + count)
+            self.prefix_sum.append(self.prefix_sum[-1] + total)
+
+    def totals(self, lo, hi, include_missing):
+        # lo/hi are bucket-aligned epoch ms (or MISSING_TS/MAX_TS for open ends)
+        a = bisect_left(self.starts, lo)
+        b = bisect_left(self.starts, hi)
+        count = self.prefix_count[b] - self.prefix_count[a]
+        total = self.prefix_sum[b] - self.prefix_sum[a]
+        if include_missing:
+            count += self.missing_count
+            total += self.missing_sum
+        return count, total
+
+
+class Rollup:
+    """Per-group (every dimension of the table) bucketed aggregates for one bucket width."""
+
+    def __init__(self, table, bucket_ms):
+        self.table = table
+        self.bucket_ms = bucket_ms
+        self.dims = list(table.codes)
+        self.groups = {}
+        columns = [table.codes[dim] for dim in self.dims]
+        integral = self.integral = table.measure_is_int
+        if parallel.should_shard(table, MISSING_TS, MAX_TS):
+            self._from_partials(parallel.scan(table, MISSING_TS, MAX_TS, group_dims=self.dims, bucket_ms=bucket_ms))
+            return
+        sorted_ts, order = table.partitions[None]
+        for ts, i in zip(sorted_ts, order):
+            key = tuple(column[i] for column in columns)
+            series = self.groups.get(key)
+            if series is None:
+                series = self.groups[key] = BucketSeries(integral)
+            value = int(table.values[i]) if integral else table.values[i]
+            if ts == MISSING_TS:
+                series.missing_count += 1
+                series.missing_sum += value
+            else:
+                series.add(ts - ts % bucket_ms, value)
+        for series in self.groups.values():
+            series.finish()
+        # Dictionary codes follow first appearance in the dataset, which keeps group order stable
+        self.keys = sorted(self.groups)
+
+    def _from_partials(self, partials):
+        integral = self.integral
+        for (key, bucket), (count, total, low, high, _) in sorted(partials.items(), key=lambda item: (item[0][0], MISSING_TS if item[0][1] is None else item[0][1])):
+            series = self.groups.get(key)
+            if series is None:
+                series = self.groups[key] = BucketSeries(integral)
+            total = int(total) if integral else total
+            if bucket is None:
+                series.missing_count += count
+                series.missing_sum += total
+            else:
+                series.add_bucket(bucket, count, total, low, high)
+        for series in self.groups.values():
+            series.finish()
+        self.keys = sorted(self.groups)
+
+    def extended(self, table, new_ids):
+        """This rollup for table (an extension of self.table) built by folding in only rows new_ids."""
+        if table.measure_is_int != self.integral:
+            return Rollup(table, self.bucket_ms)
+        rollup = copy.copy(self)
+        rollup.table = table
+        rollup.groups = dict(self.groups)
+        columns = [table.codes[dim] for dim in self.dims]
+        touched = {}
+        for i in new_ids:
+            key = tuple(column[i] for column in columns)
+            series = touched.get(key)
+            if series is None:
+                previous = self.groups.get(key)
+                series = touched[key] = previous.copy() if previous is not None else BucketSeries(self.integral)
+            value = int(table.values[i]) if self.integral else table.values[i]
+            ts = table.timestamps[i]
+            if ts == MISSING_TS:
+                series.missing_count += 1
+                series.missing_sum += value
+            else:
+                series.insert(ts - ts % self.bucket_ms, value)
+        for key, series in touched.items():
+            series.finish()
+            rollup.groups[key] = series
+        rollup.keys = sorted(rollup.groups)
+        return rollup
+
+    @tracing.timed("aggregate")
+    def aggregate(self, lo, hi, by=None, **dims):
+        """Same shape as Table.aggregate over the rows in [lo, hi) matching dims."""
+        table = self.table
+        wanted = []
+        for dim, values in dims.items():
+            if values is None:
+                continue
+            lookup = table.lookups[dim]
+            wanted.append((self.dims.index(dim), {lookup[v] for v in values if v in lookup}))
+        by_pos = self.dims.index(by) if by is not None else None
+        include_missing = lo <= MISSING_TS
+
+        groups = {}
+        for key in self.keys:
+            if any(key[pos] not in codes for pos, codes in wanted):
+                continue
+            count, total = self.groups[key].totals(lo, hi, include_missing)
+            if not count and by is not None:
+                continue
+            acc = groups.setdefault(key[by_pos] if by is not None else None, [0, 0])
+            acc[0] += count
+            acc[1] += total
+        if by is None:
+            acc = groups.get(None, [0, 0])
+            return {None: [acc[0], table.number(acc[1])]}
+        names = table.dictionaries[by]
+        return {names[code]: [count, table.number(total)] for code, (count, total) in groups.items()}
+
+
+def aligned(lo, hi, bucket_ms):
+    # Open ends (MISSING_TS/MISSING_TS + 1 below, MAX_TS above) count as aligned
+    return (lo <= MISSING_TS + 1 or lo % bucket_ms == 0) and (hi >= MAX_TS or hi % bucket_ms == 0)
+
+
+def get_rollup(table, bucket_ms):
+    # Built once per table, i.e. once per telemetry snapshot
+    key = ("rollup", bucket_ms)
+    if key not in table.derived:
+        with _build_lock:
+            if key not in table.derived:
+                table.derived[key] = Rollup(table, bucket_ms)
+    return table.derived[key]
+
+
+def summarize(table, time_filter=None, by=None, **dims):
+    """table.aggregate(table.select(time_filter, **dims), by), answered from rollups when possible.
+
+    Day- or hour-aligned ranges (and no range at all) read the daily or hourly
+    prefix sums; anything finer, or a text-based date filter, scans raw rows.
+    """
+    if time_filter is None:
+        lo, hi = MISSING_TS, MAX_TS
+    elif isinstance(time_filter, TimeRange):
+        lo, hi = time_filter.lo, time_filter.hi
+    else:
+        lo = hi = None
+    if lo is not None and table.measure is not None:
+        for bucket_ms in (DAY_MS, HOUR_MS):
+            if aligned(lo, hi, bucket_ms):
+                return get_rollup(table, bucket_ms).aggregate(lo, hi, by=by, **dims)
+        if parallel.should_shard(table, lo, hi):
+            return _sharded_summary(table, lo, hi, by, dims)
+    return table.aggregate(table.select(time_filter, ordered=False, **dims), by=by)
+
+
+def _sharded_summary(table, lo, hi, by, dims):
+    # Same result as the raw scan below, computed by parallel.scan
+    filters = []
+    for dim, values in dims.items():
+        if values is not None:
+            lookup = table.lookups[dim]
+            filters.append((dim, [lookup[v] for v in values if v in lookup]))
+    partials = parallel.scan(table, lo, hi, group_dims=(by,) if by is not None else (), filters=filters)
+    if by is None:
+        count, total = sum(acc[0] for acc in partials.values()), sum(acc[1] for acc in partials.values())
+        return {None: [count, table.number(total)]}
+    names = table.dictionaries[by]
+    return {names[key[0]]: [acc[0], table.number(acc[1])] for (key, _), acc in sorted(partials.items())}
@@ -0,0 +1,204 @@
+import copy
+import heapq
+import math
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+import tracing
+
+# BM25 term-frequency saturation and document-length normalization
+SEARCH_BM25_K1 = float(os.environ.get("SEARCH_BM25_K1", "1.2"))
+SEARCH_BM25_B = float(os.environ.get("SEARCH_BM25_B", "0.75"))
+# Most terms a prefix query (e.g. time*) expands to; the most frequent are kept
+SEARCH_MAX_EXPANSIONS = int(os.environ.get("SEARCH_MAX_EXPANSIONS", "64"))
+
+# Free-text fields, tokenized into the ranked bag of words
+TEXT_FIELDS = ("title", "description")
+# Categorical fields, also searchable exactly as field:value (e.g. severity:high)
+KEYWORD_FIELDS = ("region", "status", "severity")
+
+_TOKEN = re.compile(r"\w+")
+_build_lock = threading.Lock()
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower()) if isinstance(text, str) else []
+
+
+def _keyword(value):
+    return str(value).strip().lower() if isinstance(value, (str, int)) and not isinstance(value, bool) else ""
+
+
+class Query:
+    """A parsed q= string: field:value keywords (exact) and words (ranked, optionally prefixes).
+
+    Every part must match. A word ending in * matches any term starting with it.
+    """
+
+    def __init__(self, keywords, terms):
+        self.keywords = keywords
+        self.terms = terms
+
+
+def parse_query(q):
+    """Query for q, or None when q has nothing to search for."""
+    keywords, terms = [], []
+    for part in (q or "").split():
+        field, sep, value = part.partition(":")
+        if sep and field.lower() in KEYWORD_FIELDS and value:
+            keywords.append(f"{field.lower()}:{value.lower()}")
+            continue
+        tokens = tokenize(part)
+        for n, token in enumerate(tokens):
+            terms.append((token, part.endswith("*") and n == len(tokens) - 1))
+    if not keywords and not terms:
+        return None
+    return Query(keywords, terms)
+
+
+class InvertedIndex:
+    """Postings for a table's rows: term -> (row ids ascending, term frequencies).
+
+    Text terms come from TEXT_FIELDS plus the values of KEYWORD_FIELDS, and are
+    scored with BM25; KEYWORD_FIELDS are also indexed as field:value terms,
+    which only filter. extended() folds in appended rows, copying only the
+    posting lists they touch.
+    """
+
+    def __init__(self, table):
+        self.postings = {}
+        self.lengths = array("i")
+        self.total_length = 0
+        self.terms = []
+        self._add(table, range(table.size), set())
+        self.terms = sorted(term for term in self.postings if ":" not in term)
+
+    def _add(self, table, ids, touched):
+        # touched: terms whose posting lists this index already owns (safe to append to)
+        postings, rows = self.postings, table.rows
+        new_terms = []
+        for i in ids:
+            row = rows[i]
+            if not isinstance(row, dict):
+                row = {}
+            counts = {}
+            length = 0
+            for field in TEXT_FIELDS + KEYWORD_FIELDS:
+                for token in tokenize(row.get(field)):
+                    counts[token] = counts.get(token, 0) + 1
+                    length += 1
+            for field in KEYWORD_FIELDS:
+                value = _keyword(row.get(field))
+                if value:
+                    counts[f"{field}:{value}"] = 1
+            self.lengths.append(length)
+            self.total_length += length
+            for term, tf in counts.items():
+                posting = postings.get(term)
+                if posting is None:
+                    posting = postings[term] = (array("i"), array("i"))
+                    new_terms.append(term)
+                    touched.add(term)
+                elif term not in touched:
+                    posting = postings[term] = (array("i", posting[0]), array("i", posting[1]))
+                    touched.add(term)
+                posting[0].append(i)
+                posting[1].append(tf)
+        return new_terms
+
+    def extended(self, table, new_ids):
+        index = copy.copy(self)
+        index.postings = dict(self.postings)
+        index.lengths = array("i", self.lengths)
+        new_terms = index._add(table, new_ids, set())
+        new_terms = sorted(term for term in new_terms if ":" not in term)
+        if new_terms:
+            index.terms = list(heapq.merge(self.terms, new_terms))
+        return index
+
+    def expand(self, token, prefix):
+        """Indexed terms a query word stands for."""
+        if not prefix:
+            return [token] if token in self.postings else []
+        start = bisect_left(self.terms, token)
+        end = bisect_left(self.terms, token + "\U0010ffff")
+        matches = self.terms[start:end]
+        if len(matches) > SEARCH_MAX_EXPANSIONS:
+            matches = heapq.nlargest(SEARCH_MAX_EXPANSIONS, matches, key=lambda term: len(self.postings[term][0]))
+        return matches
+
+    def search(self, query):
+        """{row id: BM25 score} for the rows matching every part of query."""
+        n = len(self.lengths)
+        avg_length = self.total_length / n if n else 0.0
+        k1, b = SEARCH_BM25_K1, SEARCH_BM25_B
+
+        allowed = None
+        # Shortest posting lists first, so later intersections touch fewer rows
+        for term in sorted(query.keywords, key=lambda term: len(self.postings.get(term, ((),))[0])):
+            posting = self.postings.get(term)
+            if posting is None:
+                return {}
+            allowed = set(posting[0]) if allowed is None else allowed.intersection(posting[0])
+            if not allowed:
+                return {}
+
+        scores = None
+        for token, prefix in query.terms:
+            term_scores = {}
+            for term in self.expand(token, prefix):
+                ids, tfs = self.postings[term]
+                idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+                for i, tf in zip(ids, tfs):
+                    if allowed is not None and i not in allowed:
+                        continue
+                    if scores is not None and i not in scores:
+                        continue
+                    norm = k1 * (1 - b + b * self.lengths[i] / avg_length) if avg_length else k1
+                    score = idf * tf * (k1 + 1) / (tf + norm)
+                    # A prefix counts once per row, by its best-matching expansion
+                    if score > term_scores.get(i, -1.0):
+                        term_scores[i] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {i: scores[i] + score for i, score in term_scores.items()}
+            if not scores:
+                return {}
+        if scores is None:
+            scores = dict.fromkeys(allowed, 0.0)
+        tracing.count("postings", len(scores))
+        return scores
+
+
+def get_search_index(table):
+    # Built once per table, then extended as delta segments arrive
+    if "search" not in table.derived:
+        with _build_lock:
+            if "search" not in table.derived:
+                table.derived["search"] = InvertedIndex(table)
+    return table.derived["search"]
+
+
+@tracing.timed("filter")
+def search(table, query, time_filter=None, **dims):
+    """{row id: score} for the rows matching query, time_filter and dims (as in Table.select).
+
+    The filters are checked against the columns of the rows the postings
+    matched, which are usually far fewer than the rows the filters select.
+    """
+    scores = get_search_index(table).search(query)
+    wanted = [(dim, values) for dim, values in dims.items() if values is not None]
+    if not scores or (not wanted and time_filter is None):
+        return scores
+    ids = list(scores)
+    for dim, values in wanted:
+        lookup, column = table.lookups[dim], table.codes[dim]
+        codes = {lookup[v] for v in values if v in lookup}
+        ids = [i for i in ids if column[i] in codes]
+    if time_filter is not None:
+        ids = time_filter.apply(table, ids)
+    return {i: scores[i] for i in ids}
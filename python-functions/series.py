@@ -0,0 +1,148 @@
+from bisect import bisect_left
+
+import tracing
+from rollups import DAY_MS, HOUR_MS, aligned, get_rollup
+from telemetry_query import MAX_TS, MISSING_TS, TimeRange
+
+INTERVALS = {"1m": 60 * 1000, "5m": 5 * 60 * 1000, "1h": HOUR_MS, "1d": DAY_MS}
+
+
+class Buckets:
+    """One region's populated buckets in time order: start, row count, measure sum and max."""
+
+    def __init__(self):
+        self.starts = []
+        self.counts = []
+        self.sums = []
+        self.maxs = []
+
+    def __len__(self):
+        return len(self.starts)
+
+
+@tracing.timed("aggregate")
+def bucketed(table, time_filter, bucket_ms, **dims):
+    """{region: Buckets} for the rows matching time_filter and dims, grouped by bucket_ms.
+
+    Hour and day buckets over aligned ranges are read from the rollups;
+    anything else is one grouping pass over the selected rows' columns.
+    Rows without a usable timestamp belong to no bucket.
+    """
+    if time_filter is None:
+        lo, hi = MISSING_TS + 1, MAX_TS
+    elif isinstance(time_filter, TimeRange):
+        lo, hi = max(time_filter.lo, MISSING_TS + 1), time_filter.hi
+    else:
+        lo = hi = None
+    if lo is not None and bucket_ms in (HOUR_MS, DAY_MS) and aligned(lo, hi, bucket_ms):
+        return _from_rollup(table, get_rollup(table, bucket_ms), lo, hi, dims)
+
+    region_column = table.codes[table.partition_by]
+    timestamps, values = table.timestamps, table.values
+    groups = {}
+    for i in table.select(time_filter, ordered=False, **dims):
+        ts = timestamps[i]
+        if ts == MISSING_TS:
+            continue
+        key = (region_column[i], ts - ts % bucket_ms)
+        acc = groups.get(key)
+        value = values[i]
+        if acc is None:
+            groups[key] = [1, value, value]
+        else:
+            acc[0] += 1
+            acc[1] += value
+            if value > acc[2]:
+                acc[2] = value
+    return _collect(table, ((code, start, acc) for (code, start), acc in groups.items()))
+
+
+def _from_rollup(table, rollup, lo, hi, dims):
+    wanted = []
+    for dim, values in dims.items():
+        if values is None:
+            continue
+        lookup = table.lookups[dim]
+        wanted.append((rollup.dims.index(dim), {lookup[v] for v in values if v in lookup}))
+    pos = rollup.dims.index(table.partition_by)
+    merged = {}
+    for key in rollup.keys:
+        if any(key[p] not in codes for p, codes in wanted):
+            continue
+        group = rollup.groups[key]
+        for b in range(bisect_left(group.starts, lo), bisect_left(group.starts, hi)):
+            acc = merged.get((key[pos], group.starts[b]))
+            if acc is None:
+                merged[(key[pos], group.starts[b])] = [group.counts[b], group.sums[b], group.maxs[b]]
+            else:
+                acc[0] += group.counts[b]
+                acc[1] += group.sums[b]
+                acc[2] = max(acc[2], group.maxs[b])
+    return _collect(table, ((code, start, acc) for (code, start), acc in merged.items()))
+
+
+def _collect(table, entries):
+    names = table.dictionaries[table.partition_by]
+    result = {}
+    for code, start, (count, total, peak) in sorted(entries, key=lambda e: (e[0], e[1])):
+        buckets = result.get(names[code])
+        if buckets is None:
+            buckets = result[names[code]] = Buckets()
+        buckets.starts.append(start)
+        buckets.counts.append(count)
+        buckets.sums.append(table.number(total))
+        buckets.maxs.append(table.number(peak))
+    return result
+
+
+def lttb(xs, ys, budget):
+    """Indices of at most budget points that keep the shape of ys (Largest-Triangle-Three-Buckets).
+
+    The first and last points are always kept; every point in between is the
+    one forming the largest triangle with the previously kept point and the
+    average of the next bucket.
+    """
+    n = len(xs)
+    if budget >= n or budget < 3:
+        return list(range(n))
+    every = (n - 2) / (budget - 2)
+    picked = [0]
+    a = 0
+    for i in range(budget - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        if avg_start >= avg_end:
+            avg_start, avg_end = n - 1, n
+        span = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / span
+        avg_y = sum(ys[avg_start:avg_end]) / span
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        picked.append(best)
+        a = best
+    picked.append(n - 1)
+    return picked
+
+
+def minmax(ys, budget):
+    """Indices of the lowest and highest point in each of budget // 2 equal runs, in order."""
+    n = len(ys)
+    chunks = budget // 2
+    if budget >= n or chunks < 1:
+        return list(range(n))
+    picked = []
+    for c in range(chunks):
+        run = range(c * n // chunks, (c + 1) * n // chunks)
+        low = min(run, key=ys.__getitem__)
+        high = max(run, key=ys.__getitem__)
+        picked.extend(sorted({low, high}))
+    return picked
+
+
+DOWNSAMPLERS = {
+    "lttb": lambda xs, ys, budget: lttb(xs, ys, budget),
+    "minmax": lambda xs, ys, budget: minmax(ys, budget),
+}
@@ -0,0 +1,269 @@
+import copy
+import math
+import os
+import threading
+from bisect import bisect_left
+
+import parallel
+import tracing
+from rollups import DAY_MS, HOUR_MS
+from telemetry_query import MAX_TS, MISSING_TS, TimeRange
+
+# Relative accuracy of quantiles returned by the sketches (0.01 = within 1%)
+SKETCH_RELATIVE_ACCURACY = float(os.environ.get("SKETCH_RELATIVE_ACCURACY", "0.01"))
+# Cap on bins per sketch; the lowest bins are collapsed beyond this
+SKETCH_MAX_BINS = int(os.environ.get("SKETCH_MAX_BINS", "2048"))
+
+_build_lock = threading.Lock()
+
+
+class DDSketch:
+    """Mergeable quantile sketch with relative-error guarantees (DDSketch).
+
+    Values are counted in logarithmic bins of ratio gamma, so any quantile is
+    within relative_accuracy of the true value, two sketches merge by adding
+    bin counts, and memory is bounded by max_bins regardless of how many values
+    were added. Values <= 0 share a single zero bin.
+    """
+
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY, max_bins=SKETCH_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        else:
+            self.zero_count += weight
+        self.count += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def copy(self):
+        sketch = copy.copy(self)
+        sketch.bins = dict(self.bins)
+        return sketch
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0)
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def histogram(self, buckets=10):
+        """Counts per value range, at most `buckets` ranges of equal log width between min and max."""
+        if not self.count:
+            return []
+        result = []
+        if self.zero_count:
+            result.append({"le": 0, "count": self.zero_count})
+        if self.bins:
+            lo, hi = min(self.bins), max(self.bins)
+            span = max(1, math.ceil((hi - lo + 1) / buckets))
+            grouped = {}
+            for index, count in self.bins.items():
+                group = (index - lo) // span
+                grouped[group] = grouped.get(group, 0) + count
+            for group in sorted(grouped):
+                upper = self.gamma ** (lo + (group + 1) * span - 1)
+                result.append({"le": min(upper, self.max), "count": grouped[group]})
+        return result
+
+    def _value(self, index):
+        # Midpoint (in relative terms) of bin (gamma^(index-1), gamma^index]
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def _collapse(self):
+        # Fold the lowest bins into one; keeps accuracy on the upper quantiles we care about
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins + 1
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.bins[target] += self.bins.pop(index)
+
+
+class SketchIndex:
+    """Per-region DDSketches for every populated hour and day of a latency table.
+
+    Range queries merge whole-day sketches, then whole-hour sketches at the
+    edges, and only add raw rows for partial hours.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.levels = {DAY_MS: {}, HOUR_MS: {}}
+        self.missing = {}
+        self.min_ts = MAX_TS
+        self.max_ts = MISSING_TS
+        if parallel.should_shard(table, MISSING_TS, MAX_TS):
+            self._from_partials(table)
+            return
+        column = table.codes[table.partition_by]
+        sorted_ts, order = table.partitions[None]
+        for ts, i in zip(sorted_ts, order):
+            value = table.values[i]
+            if ts == MISSING_TS:
+                self.missing.setdefault(column[i], DDSketch()).add(value)
+                continue
+            self.min_ts = min(self.min_ts, ts)
+            self.max_ts = max(self.max_ts, ts)
+            for bucket_ms, buckets in self.levels.items():
+                key = (column[i], ts - ts % bucket_ms)
+                sketch = buckets.get(key)
+                if sketch is None:
+                    sketch = buckets[key] = DDSketch()
+                sketch.add(value)
+
+    def _from_partials(self, table):
+        # Hour sketches from parallel.scan; day sketches are merges of their hours
+        partials = parallel.scan(table, MISSING_TS, MAX_TS, group_dims=(table.partition_by,), bucket_ms=HOUR_MS, sketch=True)
+        hours, days = self.levels[HOUR_MS], self.levels[DAY_MS]
+        for ((code,), start), acc in sorted(partials.items(), key=lambda item: (item[0][0], MISSING_TS if item[0][1] is None else item[0][1])):
+            sketch = acc[4]
+            if start is None:
+                self.missing[code] = sketch
+                continue
+            hours[(code, start)] = sketch
+            day = days.get((code, start - start % DAY_MS))
+            if day is None:
+                days[(code, start - start % DAY_MS)] = sketch.copy()
+            else:
+                day.merge(sketch)
+        sorted_ts = table.partitions[None][0]
+        first = bisect_left(sorted_ts, MISSING_TS + 1)
+        if first < len(sorted_ts):
+            self.min_ts, self.max_ts = sorted_ts[first], sorted_ts[-1]
+
+    def extended(self, table, new_ids):
+        """This index for table (an extension of self.table) with only rows new_ids added."""
+        index = copy.copy(self)
+        index.table = table
+        index.levels = {bucket_ms: dict(buckets) for bucket_ms, buckets in self.levels.items()}
+        index.missing = dict(self.missing)
+        column = table.codes[table.partition_by]
+        copied = set()
+
+        def writable(buckets, key):
+            # Sketches shared with self are copied before the first add
+            sketch = buckets.get(key)
+            if sketch is None:
+                sketch = buckets[key] = DDSketch()
+                copied.add(id(sketch))
+            elif id(sketch) not in copied:
+                sketch = buckets[key] = sketch.copy()
+                copied.add(id(sketch))
+            return sketch
+
+        for i in new_ids:
+            ts, value = table.timestamps[i], table.values[i]
+            if ts == MISSING_TS:
+                writable(index.missing, column[i]).add(value)
+                continue
+            index.min_ts = min(index.min_ts, ts)
+            index.max_ts = max(index.max_ts, ts)
+            for bucket_ms, buckets in index.levels.items():
+                writable(buckets, (column[i], ts - ts % bucket_ms)).add(value)
+        return index
+
+    def sketch(self, region_code, lo, hi):
+        """Merged sketch of region_code's values in [lo, hi); lo <= MISSING_TS also includes undated rows."""
+        merged = DDSketch()
+        if lo <= MISSING_TS and region_code in self.missing:
+            merged.merge(self.missing[region_code])
+        lo = max(lo, self.min_ts - self.min_ts % DAY_MS)
+        hi = min(hi, self.max_ts - self.max_ts % DAY_MS + DAY_MS)
+        if lo < hi:
+            self._cover(merged, region_code, lo, hi, [DAY_MS, HOUR_MS])
+        return merged
+
+    def _cover(self, merged, region_code, lo, hi, levels):
+        if not levels:
+            table = self.table
+            for i in table.select(TimeRange(lo, hi), ordered=False, **{table.partition_by: [table.dictionaries[table.partition_by][region_code]]}):
+                merged.add(table.values[i])
+            return
+        bucket_ms = levels[0]
+        first = -(-lo // bucket_ms) * bucket_ms
+        last = hi - hi % bucket_ms
+        if first >= last:
+            self._cover(merged, region_code, lo, hi, levels[1:])
+            return
+        self._cover(merged, region_code, lo, first, levels[1:])
+        buckets = self.levels[bucket_ms]
+        for start in range(first, last, bucket_ms):
+            sketch = buckets.get((region_code, start))
+            if sketch is not None:
+                merged.merge(sketch)
+        self._cover(merged, region_code, last, hi, levels[1:])
+
+
+def get_sketch_index(table):
+    # Built once per table, i.e. once per telemetry snapshot
+    if "sketches" not in table.derived:
+        with _build_lock:
+            if "sketches" not in table.derived:
+                table.derived["sketches"] = SketchIndex(table)
+    return table.derived["sketches"]
+
+
+@tracing.timed("aggregate")
+def region_sketches(table, time_filter=None, regions=None):
+    """{region: merged DDSketch} over time_filter, for the given normalized regions (None = all with data)."""
+    dim = table.partition_by
+    names = table.dictionaries[dim]
+    if regions is None:
+        codes = list(range(len(names)))
+    else:
+        codes = [table.lookups[dim][r] for r in regions if r in table.lookups[dim]]
+
+    if time_filter is not None and not isinstance(time_filter, TimeRange):
+        # Text-based date filter: sketch the matching raw rows directly
+        result = {}
+        for i in table.select(time_filter, ordered=False, **{dim: [names[c] for c in codes]}):
+            result.setdefault(names[table.codes[dim][i]], DDSketch()).add(table.values[i])
+        return result
+
+    lo, hi = (time_filter.lo, time_filter.hi) if time_filter is not None else (MISSING_TS, MAX_TS)
+    index = get_sketch_index(table)
+    result = {}
+    for code in codes:
+        sketch = index.sketch(code, lo, hi)
+        if sketch.count:
+            result[names[code]] = sketch
+    return result
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import tracing
+from json_stream import parse_json_stream
+
+# How long a cached snapshot is served without asking storage whether it changed
+SNAPSHOT_CACHE_TTL_SECONDS = float(os.environ.get("SNAPSHOT_CACHE_TTL_SECONDS", "30"))
+# Upper bound on the raw blob bytes held by the cache before LRU eviction kicks in
+SNAPSHOT_CACHE_MAX_BYTES = int(os.environ.get("SNAPSHOT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class SnapshotTooLarge(Exception):
+    """Raised instead of parsing a blob bigger than the cache budget; carries the open download (sync path only)."""
+
+    def __init__(self, blob_name, stream=None, size=None):
+        super().__init__(f"{blob_name} ({stream.size if stream is not None else size} bytes) exceeds the snapshot cache budget")
+        self.stream = stream
+
+
+class SnapshotCache:
+    """Process-wide cache of parsed telemetry blobs, keyed by blob name.
+
+    Entries live for the lifetime of a warm worker. Once an entry is older than
+    the TTL it is revalidated with a conditional download on its ETag, so an
+    unchanged blob costs one round trip and no parse.
+
+    Blobs are parsed incrementally from the download's chunks, so the raw
+    bytes are never held alongside the parsed snapshot. Blobs larger than
+    max_bytes are not cached: get() raises SnapshotTooLarge with the open
+    download so the caller can stream just the rows it needs.
+    """
+
+    def __init__(self, ttl_seconds=SNAPSHOT_CACHE_TTL_SECONDS, max_bytes=SNAPSHOT_CACHE_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._async_load_locks = {}
+        self._counters = {"hits": 0, "misses": 0, "revalidations": 0, "refreshes": 0, "evictions": 0, "stale_served": 0}
+
+    def get(self, blob_name, blob_client, parse=parse_json_stream):
+        entry = self._lookup(blob_name)
+        if entry is not None and time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+            self._count("hits")
+            return entry["data"]
+
+        # One loader per blob so a burst of cold requests triggers a single download
+        with self._load_lock(blob_name):
+            entry = self._lookup(blob_name)
+            if entry is not None and time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+                self._count("hits")
+                return entry["data"]
+            return self._load(blob_name, blob_client, parse, entry)
+
+    def get_derived(self, blob_name, blob_client, name, build, prefilter=None):
+        """Return build(data) for the current snapshot, computed once per blob version.
+
+        Derived views (columnar tables, indexes, ...) are stored on the cache entry,
+        so they are dropped together with the snapshot they were built from. When
+        the blob is too large to cache, only the rows matching prefilter are
+        streamed in and the result is built for this call alone.
+        """
+        try:
+            data = self.get(blob_name, blob_client)
+        except SnapshotTooLarge as e:
+            tracing.count("bytes", e.stream.size)
+            with tracing.stage("parse"):
+                data = parse_json_stream(e.stream.chunks(), predicate=prefilter)
+            with tracing.stage("build"):
+                return build(data)
+        entry = self._lookup(blob_name)
+        if entry is None or entry["data"] is not data:
+            # Replaced concurrently
+            return build(data)
+        derived = entry.setdefault("derived", {})
+        if name not in derived:
+            with self._load_lock(blob_name):
+                if name not in derived:
+                    with tracing.stage("build"):
+                        derived[name] = self._versioned(build(data), entry)
+        return derived[name]
+
+    async def aget(self, blob_name, blob_client, parse=parse_json_stream):
+        """get() for an azure.storage.blob.aio BlobClient; parsing runs in a worker thread."""
+        entry = self._lookup(blob_name)
+        if entry is not None and time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+            self._count("hits")
+            return entry["data"]
+
+        async with self._async_load_lock(blob_name):
+            entry = self._lookup(blob_name)
+            if entry is not None and time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+                self._count("hits")
+                return entry["data"]
+            if entry is not None:
+                from azure.core import MatchConditions
+                from azure.core.exceptions import ResourceNotModifiedError
+                try:
+                    with tracing.stage("download"):
+                        stream = await blob_client.download_blob(etag=entry["etag"], match_condition=MatchConditions.IfModified)
+                except ResourceNotModifiedError:
+                    self._count("revalidations")
+                    entry["checked_at"] = time.monotonic()
+                    return entry["data"]
+                except Exception as e:
+                    logging.warning(f"Revalidation of {blob_name} failed, serving cached snapshot: {e}")
+                    self._count("stale_served")
+                    return entry["data"]
+                self._count("refreshes")
+            else:
+                self._count("misses")
+                # Size first: a blob too big to cache is streamed on the sync path, so don't start downloading it here
+                with tracing.stage("download"):
+                    properties = await blob_client.get_blob_properties()
+                    if properties.size > self.max_bytes:
+                        raise SnapshotTooLarge(blob_name, size=properties.size)
+                    stream = await blob_client.download_blob()
+
+            if stream.size > self.max_bytes:
+                self.invalidate(blob_name)
+                raise SnapshotTooLarge(blob_name, stream)
+            # The aio downloader's chunks are an async iterator, so read the body and parse it off the event loop
+            tracing.count("bytes", stream.size)
+            with tracing.stage("download"):
+                raw = await stream.readall()
+            with tracing.stage("parse"):
+                data = await asyncio.to_thread(parse, [raw])
+            self._store(blob_name, {
+                "data": data,
+                "etag": stream.properties.etag,
+                "last_modified": stream.properties.last_modified,
+                "size": stream.size,
+                "metadata": getattr(stream.properties, "metadata", None) or {},
+                "checked_at": time.monotonic(),
+            })
+            return data
+
+    async def aget_derived(self, blob_name, blob_client, name, build):
+        """get_derived() for an aio BlobClient. Raises SnapshotTooLarge rather than streaming a filtered copy."""
+        data = await self.aget(blob_name, blob_client)
+        entry = self._lookup(blob_name)
+        if entry is None or entry["data"] is not data:
+            return await asyncio.to_thread(build, data)
+        derived = entry.setdefault("derived", {})
+        if name not in derived:
+            async with self._async_load_lock(blob_name):
+                if name not in derived:
+                    with tracing.stage("build"):
+                        derived[name] = self._versioned(await asyncio.to_thread(build, data), entry)
+        return derived[name]
+
+    def fresh_etag(self, blob_name):
+        """ETag of the entry get() would return without a storage round trip, else None."""
+        entry = self._lookup(blob_name)
+        if entry is not None and time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+            return entry["etag"]
+        return None
+
+    def invalidate(self, blob_name=None):
+        with self._lock:
+            names = [blob_name] if blob_name is not None else list(self._entries)
+            for name in names:
+                entry = self._entries.pop(name, None)
+                if entry is not None:
+                    self._total_bytes -= entry["size"]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._total_bytes
+        return stats
+
+    def _load(self, blob_name, blob_client, parse, entry):
+        if entry is not None:
+            from azure.core import MatchConditions
+            from azure.core.exceptions import ResourceNotModifiedError
+            try:
+                with tracing.stage("download"):
+                    stream = blob_client.download_blob(etag=entry["etag"], match_condition=MatchConditions.IfModified)
+            except ResourceNotModifiedError:
+                self._count("revalidations")
+                entry["checked_at"] = time.monotonic()
+                return entry["data"]
+            except Exception as e:
+                # Storage hiccup: keep serving the last good snapshot rather than an empty dataset
+                logging.warning(f"Revalidation of {blob_name} failed, serving cached snapshot: {e}")
+                self._count("stale_served")
+                return entry["data"]
+            self._count("refreshes")
+        else:
+            self._count("misses")
+            with tracing.stage("download"):
+                stream = blob_client.download_blob()
+
+        if stream.size > self.max_bytes:
+            self.invalidate(blob_name)
+            raise SnapshotTooLarge(blob_name, stream)
+        tracing.count("bytes", stream.size)
+        # The body is streamed while parsing, so this stage includes most of the transfer
+        with tracing.stage("parse"):
+            data = parse(stream.chunks())
+        self._store(blob_name, {
+            "data": data,
+            "etag": stream.properties.etag,
+            "last_modified": stream.properties.last_modified,
+            "size": stream.size,
+            "metadata": getattr(stream.properties, "metadata", None) or {},
+            "checked_at": time.monotonic(),
+        })
+        return data
+
+    @staticmethod
+    def _versioned(derived, entry):
+        # Tables record which blob version they were built from (used to key cached responses)
+        # and the last delta segment compaction folded into it
+        if hasattr(derived, "version"):
+            derived.version = entry["etag"]
+            derived.watermark = entry["metadata"].get("delta_watermark")
+        return derived
+
+    def _lookup(self, blob_name):
+        with self._lock:
+            entry = self._entries.get(blob_name)
+            if entry is not None:
+                self._entries.move_to_end(blob_name)
+            return entry
+
+    def _store(self, blob_name, entry):
+        with self._lock:
+            previous = self._entries.pop(blob_name, None)
+            if previous is not None:
+                self._total_bytes -= previous["size"]
+            self._entries[blob_name] = entry
+            self._total_bytes += entry["size"]
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted["size"]
+                self._counters["evictions"] += 1
+
+    def _load_lock(self, blob_name):
+        with self._lock:
+            return self._load_locks.setdefault(blob_name, threading.Lock())
+
+    def _async_load_lock(self, blob_name):
+        # asyncio locks belong to the event loop that created them; keyed by the loop itself (not its
+        # id, which a later loop may reuse) and dropped once it has closed
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for closed in [other for other in self._async_load_locks if other.is_closed()]:
+                del self._async_load_locks[closed]
+            return self._async_load_locks.setdefault(loop, {}).setdefault(blob_name, asyncio.Lock())
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+snapshot_cache = SnapshotCache()
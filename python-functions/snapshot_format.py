@@ -0,0 +1,349 @@
+"""Compact columnar binary snapshots of the telemetry blobs.
+
+A snapshot holds a telemetry_query.Table as fixed-width columns (int64 epoch-ms
+timestamps, float64 measure, int32 dictionary codes, the time-sorted row order)
+plus each row's original JSON for responses that return whole rows. Workers
+download it once to local disk and mmap it, so a cold start skips the JSON
+download and decode entirely.
+
+Convert a JSON blob with:
+
+    python snapshot_format.py latency.json --compression zlib --upload
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+
+import telemetry_query
+import tracing
+from blob_clients import get_blob_client
+from snapshot_cache import SNAPSHOT_CACHE_TTL_SECONDS
+
+MAGIC = b"AZOBSNP1"
+FORMAT_VERSION = 1
+# Prefer a fresh <name>.snap blob over <name>.json when loading tables
+BINARY_SNAPSHOTS = os.environ.get("BINARY_SNAPSHOTS", "true").lower() == "true"
+# Where workers keep downloaded snapshots (uncompressed, ready to mmap)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "telemetry-snapshots"))
+
+BUILDERS = {
+    "latency": telemetry_query.latency_table,
+    "errors": telemetry_query.errors_table,
+    "incidents": telemetry_query.incidents_table,
+}
+
+COMPRESSORS = {
+    "none": (lambda data: data, lambda data: data),
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+}
+try:
+    import lz4.frame
+    COMPRESSORS["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+try:
+    import zstandard
+    COMPRESSORS["zstd"] = (lambda data: zstandard.ZstdCompressor().compress(data), lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+
+
+def snapshot_blob_name(blob_name):
+    return (blob_name[:-5] if blob_name.endswith(".json") else blob_name) + ".snap"
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _write(out, meta, sections, compression):
+    # Layout: MAGIC | uint32 header length | header JSON | sections, each 8-byte aligned
+    compress = COMPRESSORS[compression][0]
+    payloads = {}
+    offset = 0
+    layout = {}
+    for name, (typecode, data) in sections.items():
+        stored = compress(bytes(data))
+        payloads[name] = stored
+        layout[name] = {"offset": offset, "length": len(stored), "typecode": typecode}
+        offset = _align(offset + len(stored))
+    header = json.dumps({**meta, "compression": compression, "byteorder": sys.byteorder, "sections": layout}).encode("utf-8")
+    prefix = MAGIC + struct.pack("<I", len(header)) + header
+    out.write(prefix + b"\0" * (_align(len(prefix)) - len(prefix)))
+    for name in sections:
+        payload = payloads[name]
+        out.write(payload + b"\0" * (_align(len(payload)) - len(payload)))
+
+
+def write_snapshot(table, builder_name, out, compression="none", source_etag=None):
+    """Serialize table (built by BUILDERS[builder_name]) to the binary file object out.
+
+    The table's delta watermark is kept so readers don't re-apply merged segments.
+    """
+    row_data = bytearray()
+    row_offsets = array("q", [0])
+    for row in table.rows:
+        row_data += json.dumps(row, separators=(",", ":")).encode("utf-8")
+        row_offsets.append(len(row_data))
+    sections = {
+        "timestamps": ("q", array("q", table.timestamps)),
+        "values": ("d", array("d", table.values)),
+        "order": ("i", array("i", table.partitions[None][1])),
+        "row_offsets": ("q", row_offsets),
+        "row_data": ("B", row_data),
+    }
+    for dim, codes in table.codes.items():
+        sections[f"codes.{dim}"] = ("i", array("i", codes))
+    meta = {
+        "version": FORMAT_VERSION,
+        "builder": builder_name,
+        "rows": table.size,
+        "measure": table.measure,
+        "measure_is_int": table.measure_is_int,
+        "partition_by": table.partition_by,
+        "dictionaries": table.dictionaries,
+        "source_etag": source_etag,
+        "delta_watermark": table.watermark,
+    }
+    _write(out, meta, sections, compression)
+
+
+def _read_header(buf):
+    if bytes(buf[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a telemetry snapshot")
+    (length,) = struct.unpack_from("<I", buf, len(MAGIC))
+    start = len(MAGIC) + 4
+    header = json.loads(bytes(buf[start:start + length]))
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header.get('version')}")
+    return header, _align(start + length)
+
+
+class _Rows:
+    """Row dicts decoded on demand from the snapshot's per-row JSON, each at most once."""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+        self._decoded = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        row = self._decoded[i]
+        if row is None:
+            row = self._decoded[i] = json.loads(bytes(self._data[self._offsets[i]:self._offsets[i + 1]]))
+        return row
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class _Field:
+    """One field of every row, e.g. the raw timestamp text used by text date filters."""
+
+    def __init__(self, rows, field):
+        self._rows = rows
+        self._field = field
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, i):
+        return self._rows[i].get(self._field, "")
+
+
+def read_snapshot(path):
+    """Open a snapshot file and return (builder name, Table).
+
+    Uncompressed native-byte-order snapshots are memory-mapped and their columns
+    are memoryviews straight into the mapping; otherwise sections are decoded
+    into memory.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buf = memoryview(mapped)
+    header, data_start = _read_header(buf)
+    decompress = COMPRESSORS[header["compression"]][1]
+    zero_copy = header["compression"] == "none" and header["byteorder"] == sys.byteorder
+
+    def section(name):
+        info = header["sections"][name]
+        start = data_start + info["offset"]
+        raw = buf[start:start + info["length"]]
+        if zero_copy:
+            return raw.cast(info["typecode"]) if info["typecode"] != "B" else raw
+        column = array(info["typecode"], decompress(bytes(raw)))
+        if header["byteorder"] != sys.byteorder:
+            column.byteswap()
+        return column
+
+    rows = _Rows(section("row_offsets"), section("row_data"))
+    dimensions, measure_default = telemetry_query.TABLE_SCHEMAS.get(header["builder"], (None, 0))
+    table = telemetry_query.Table.from_columns(
+        rows,
+        header["dictionaries"],
+        {dim: section(f"codes.{dim}") for dim in header["dictionaries"]},
+        section("timestamps"),
+        _Field(rows, "timestamp"),
+        header["measure"],
+        section("values"),
+        header["measure_is_int"],
+        partition_by=header["partition_by"] or "region",
+        order=section("order"),
+        dimensions=dimensions,
+        measure_default=measure_default,
+    )
+    table.watermark = header.get("delta_watermark")
+    # Keep the mapping alive for as long as the table's memoryviews are in use
+    table.derived["mmap"] = mapped
+    return header["builder"], table
+
+
+def _localize(path):
+    # Rewrite a downloaded snapshot uncompressed in native byte order so it can be mmapped zero-copy
+    builder, table = read_snapshot(path)
+    if isinstance(table.timestamps, memoryview):
+        return builder, table
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        write_snapshot(table, builder, out)
+    os.replace(tmp, path)
+    return read_snapshot(path)
+
+
+class BinarySnapshotLoader:
+    """Serves Tables from <name>.snap blobs when they are at least as new as <name>.json.
+
+    Freshness is rechecked with two HEAD requests once per TTL; a changed
+    snapshot is downloaded once to SNAPSHOT_DIR and memory-mapped from there.
+    Finding no usable snapshot is cached for the TTL as well, so blobs without
+    one cost a HEAD per TTL rather than per request.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, ttl_seconds=SNAPSHOT_CACHE_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def load(self, blob_name, builder_name=None):
+        """Return the snapshot Table for blob_name, or None if there is no fresh snapshot."""
+        entry = self._entries.get(blob_name)
+        if entry is not None and time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+            return entry["table"] if builder_name in (None, entry["builder"]) else None
+        with self._load_lock(blob_name):
+            entry = self._entries.get(blob_name)
+            if entry is None or time.monotonic() - entry["checked_at"] >= self.ttl_seconds:
+                try:
+                    entry = self._refresh(blob_name, entry)
+                except Exception as e:
+                    logging.warning(f"Could not load binary snapshot for {blob_name}, using JSON: {e}")
+                    entry = None
+                if entry is None:
+                    entry = {"table": None, "builder": None, "etag": None, "checked_at": time.monotonic()}
+                self._entries[blob_name] = entry
+        return entry["table"] if builder_name in (None, entry["builder"]) else None
+
+    def fresh_etag(self, blob_name):
+        """ETag of the snapshot load() would serve without a storage round trip, else None."""
+        entry = self._entries.get(blob_name)
+        if entry is not None and time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+            return entry["etag"]
+        return None
+
+    def _refresh(self, blob_name, entry):
+        from azure.core.exceptions import ResourceNotFoundError
+        snap_client = get_blob_client(snapshot_blob_name(blob_name))
+        try:
+            snap_props = snap_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        try:
+            json_props = get_blob_client(blob_name).get_blob_properties()
+        except ResourceNotFoundError:
+            json_props = None
+        if json_props is not None and json_props.last_modified > snap_props.last_modified:
+            logging.info(f"{snapshot_blob_name(blob_name)} is older than {blob_name}; using JSON")
+            return None
+        if entry is not None and entry["etag"] == snap_props.etag:
+            entry["checked_at"] = time.monotonic()
+            return entry
+
+        os.makedirs(self.directory, exist_ok=True)
+        stem = snapshot_blob_name(blob_name)[:-5]
+        tag = "".join(c for c in snap_props.etag if c.isalnum())
+        path = os.path.join(self.directory, f"{stem}.{tag}.snap")
+        if not os.path.exists(path):
+            tmp = path + ".download"
+            with open(tmp, "wb") as out:
+                tracing.count("bytes", snap_client.download_blob().readinto(out))
+            os.replace(tmp, path)
+        builder, table = _localize(path)
+        for name in os.listdir(self.directory):
+            if name.startswith(stem + ".") and name.endswith(".snap") and os.path.join(self.directory, name) != path:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        table.version = snap_props.etag
+        return {"table": table, "builder": builder, "etag": snap_props.etag, "checked_at": time.monotonic()}
+
+    def _load_lock(self, blob_name):
+        with self._lock:
+            return self._load_locks.setdefault(blob_name, threading.Lock())
+
+
+binary_snapshots = BinarySnapshotLoader()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a telemetry JSON file or blob into a binary snapshot.")
+    parser.add_argument("source", help="latency.json, errors.json or incidents.json (local path, or blob name with --from-blob)")
+    parser.add_argument("--kind", choices=sorted(BUILDERS), help="dataset kind (default: inferred from the file name)")
+    parser.add_argument("--compression", choices=sorted(COMPRESSORS), default="none")
+    parser.add_argument("-o", "--output", help="output path (default: <source>.snap next to the source)")
+    parser.add_argument("--from-blob", action="store_true", help="read the source from the telemetry container")
+    parser.add_argument("--upload", action="store_true", help="upload the snapshot next to the source blob")
+    args = parser.parse_args(argv)
+
+    name = os.path.basename(args.source)
+    kind = args.kind or next((k for k in BUILDERS if name.startswith(k)), None)
+    if kind is None:
+        parser.error("cannot infer --kind from the file name")
+    source_etag = watermark = None
+    if args.from_blob:
+        stream = get_blob_client(args.source).download_blob()
+        source_etag = stream.properties.etag
+        watermark = (stream.properties.metadata or {}).get("delta_watermark")
+        data = json.loads(stream.readall())
+    else:
+        with open(args.source, "rb") as f:
+            data = json.load(f)
+    table = BUILDERS[kind](data)
+    table.watermark = watermark
+    output = args.output or snapshot_blob_name(args.source if not args.from_blob else name)
+    with open(output, "wb") as out:
+        write_snapshot(table, BUILDERS[kind].__name__, out, compression=args.compression, source_etag=source_etag)
+    print(f"Wrote {table.size} rows to {output} ({os.path.getsize(output)} bytes, {args.compression})")
+    if args.upload:
+        with open(output, "rb") as f:
+            get_blob_client(snapshot_blob_name(name)).upload_blob(f, overwrite=True)
+        print(f"Uploaded {snapshot_blob_name(name)}")
+
+
+if __name__ == "__main__":
+    main()
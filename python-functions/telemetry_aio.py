@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+import coldstart
+import telemetry_api
+import tracing
+from blob_clients import get_async_blob_client
+from common import load_table, log_interaction
+from deltas import delta_tables
+from snapshot_cache import SnapshotTooLarge, snapshot_cache
+from snapshot_format import BINARY_SNAPSHOTS, binary_snapshots
+
+# Async entry points for the telemetry endpoints. Blob I/O goes through the
+# aio storage client so the worker's thread pool isn't held during downloads;
+# the (short) query evaluation itself runs in a thread. Interaction logging
+# stays fire-and-forget: log_interaction only enqueues onto the append logger.
+
+
+async def aload_table(blob_name, build):
+    """Async load_table(); returns None when the blob is too large to cache (callers fall back to streaming)."""
+    with tracing.stage("load"):
+        table = await _aload_table(blob_name, build)
+        return await asyncio.to_thread(delta_tables.apply, blob_name, build, table)
+
+
+async def _aload_table(blob_name, build):
+    if BINARY_SNAPSHOTS:
+        table = await asyncio.to_thread(binary_snapshots.load, blob_name, build.__name__)
+        if table is not None:
+            return table
+    try:
+        return await snapshot_cache.aget_derived(blob_name, get_async_blob_client(blob_name), build.__name__, build)
+    except SnapshotTooLarge as e:
+        logging.warning(f"{e}; streaming it on the sync path")
+        return None
+    except Exception as e:
+        logging.error(f"Failed to load {blob_name} from blob: {e}")
+        return build([])
+
+
+async def load_tables(datasets):
+    """{(blob_name, build): table} for every dataset, downloaded concurrently."""
+    datasets = list(dict.fromkeys(datasets))
+    tables = await asyncio.gather(*(aload_table(blob_name, build) for blob_name, build in datasets))
+    return {dataset: table for dataset, table in zip(datasets, tables) if table is not None}
+
+
+def _shared(tables):
+    # load= hook for the telemetry_api handlers; anything not preloaded takes the sync (streaming) path
+    def load(blob_name, build, prefilter=None):
+        table = tables.get((blob_name, build))
+        return table if table is not None else load_table(blob_name, build, prefilter=prefilter)
+    return load
+
+
+async def run(function, params, log=log_interaction, if_none_match=None):
+    """Async telemetry_api.run_cached(function, params); returns (status_code, response, etag)."""
+    started = time.perf_counter()
+    # A 304 or cached response for the snapshot already in memory needs no load (or delta check)
+    result, checked = telemetry_api.cached_result(function, params, log=log, if_none_match=if_none_match)
+    if result is None:
+        tables = await load_tables([telemetry_api.query_dataset(function, params)])
+        result = await asyncio.to_thread(telemetry_api.run_cached, function, dict(params), log=log, load=_shared(tables),
+                                         if_none_match=if_none_match, checked=checked)
+    coldstart.request_finished(function, started)
+    return result
+
+
+async def batch(queries, log=log_interaction):
+    """Async telemetry_api.batch(); every dataset the batch touches is downloaded concurrently up front."""
+    started = time.perf_counter()
+    datasets = []
+    if isinstance(queries, (list, dict)):
+        items = queries.get("queries") if isinstance(queries, dict) else queries
+        if isinstance(items, list):
+            datasets = [telemetry_api.query_dataset(q["function"], q.get("params") if isinstance(q.get("params"), dict) else {}) for q in items
+                        if isinstance(q, dict) and q.get("function") in telemetry_api.QUERY_DATASETS]
+    tables = await load_tables(datasets)
+    result = await asyncio.to_thread(telemetry_api.batch, queries, log=log, load=_shared(tables))
+    coldstart.request_finished("batch", started)
+    return result
+
+
+# Every HTTP function in both app layouts imports this module, so this runs once as the worker loads the app
+coldstart.mark("app_imported")
+coldstart.start_prewarm()
@@ -0,0 +1,680 @@
+import base64
+import binascii
+import datetime
+import heapq
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from anomalies import ANOMALY_THRESHOLD, ANOMALY_WINDOW, detect
+from common import build_params_dict, load_table, log_interaction, snapshot_version
+from heavy_hitters import HEAVY_HITTERS_CAPACITY, top_keys
+from response_cache import QUERY_PARAMS, RESPONSE_CACHE, cache_key, etag_for, response_cache
+from rollups import DAY_MS, HOUR_MS, summarize
+from search import parse_query, search
+from series import DOWNSAMPLERS, INTERVALS, bucketed
+from sketches import DDSketch, region_sketches
+from telemetry_query import (
+    ERROR_DIMENSIONS, INCIDENT_DIMENSIONS, LATENCY_DIMENSIONS, MAX_TS, MISSING_TS, TextFilter, TimeRange,
+    date_filter, errors_table, format_timestamp_ms, incidents_table, latency_table, parse_timestamp_ms, row_predicate,
+)
+import tracing
+
+# Endpoint logic shared by function_app.py and the python-functions handlers.
+# Each function takes the request's query parameters and returns (status_code, response);
+# log records the interaction and load(blob_name, build, prefilter) supplies the table.
+
+def format_float(val):
+    # Format average latency to integer (no decimals)
+    return int(round(val)) if isinstance(val, float) else val
+
+def mean(count_total):
+    count, total = count_total or (0, 0)
+    return total / count if count else 0
+
+# stat= values for get_latency besides the default average
+LATENCY_QUANTILES = {"p50": 0.5, "p90": 0.9, "p95": 0.95, "p99": 0.99, "max": 1.0}
+
+def sketch_stat(sketch, stat):
+    if stat == "histogram":
+        return [{"le": format_float(float(b["le"])), "count": b["count"]} for b in sketch.histogram()]
+    value = sketch.quantile(LATENCY_QUANTILES[stat])
+    return format_float(float(value)) if value is not None else None
+
+# Points per region an interval= series is downsampled to, by default and at most
+SERIES_DEFAULT_POINTS = int(os.environ.get("SERIES_DEFAULT_POINTS", "500"))
+SERIES_MAX_POINTS = int(os.environ.get("SERIES_MAX_POINTS", "5000"))
+
+def series_options(params):
+    """Validated (interval, points, downsample) for an interval= query, or (None, error response)."""
+    interval = params.get("interval").lower()
+    points = params.get("points")
+    method = (params.get("downsample") or "lttb").lower()
+    if interval not in INTERVALS:
+        return None, {"error": f"Invalid interval. Use one of {', '.join(INTERVALS)}."}
+    if points is not None:
+        if not points.isdigit() or not 3 <= int(points) <= SERIES_MAX_POINTS:
+            return None, {"error": f"Invalid points. Use an integer between 3 and {SERIES_MAX_POINTS}."}
+        points = int(points)
+    if method not in DOWNSAMPLERS:
+        return None, {"error": f"Invalid downsample. Use one of {', '.join(DOWNSAMPLERS)}."}
+    return (interval, points or SERIES_DEFAULT_POINTS, method), None
+
+def series_response(buckets_by_region, interval, points, method, point, value):
+    """{region: Buckets} -> response with per-region point lists of at most `points` points.
+
+    point(buckets, i) renders bucket i and value(buckets, i) is what the
+    downsampler preserves the shape of.
+    """
+    series, downsampled = {}, {}
+    for region, buckets in buckets_by_region.items():
+        picked = range(len(buckets))
+        if len(buckets) > points:
+            ys = [value(buckets, i) for i in picked]
+            picked = DOWNSAMPLERS[method](buckets.starts, ys, points)
+            downsampled[region] = len(buckets)
+        series[region] = [{"timestamp": format_timestamp_ms(buckets.starts[i]), **point(buckets, i)} for i in picked]
+    response = {"interval": interval, "series": series}
+    if downsampled:
+        # Bucket counts before downsampling, for regions that were downsampled
+        response["downsample"] = {"method": method, "buckets": downsampled}
+    return response
+
+def _latency_point(buckets, i):
+    return {"count": buckets.counts[i], "avg": format_float(buckets.sums[i] / buckets.counts[i]), "max": format_float(buckets.maxs[i])}
+
+def _highest_region(table, time_filter, region_latencies):
+    # Ties (common, latencies are rounded) go to the region seen first among the matching rows
+    highest = max(region_latencies.values())
+    tied = [reg for reg, value in region_latencies.items() if value == highest]
+    if len(tied) == 1:
+        return tied[0]
+    return min(tied, key=lambda reg: min(table.select(time_filter, ordered=False, region=[reg]), default=table.size))
+
+
+def get_latency(params, log=log_interaction, load=load_table):
+    region = params.get("region")
+    regions = params.get("regions")  # comma-separated list for comparison
+    date = params.get("date")
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+    compare = params.get("compare")  # if 'true', compare regions
+    update_timestamp = params.get("update_timestamp")
+    stat = (params.get("stat") or "").lower() or None  # p50|p90|p95|p99|max|histogram, default average
+    interval = params.get("interval")  # 1m|5m|1h|1d: bucketed series per region instead of a scalar
+
+    if stat not in (None, "avg") and stat not in LATENCY_QUANTILES and stat != "histogram":
+        response = {"error": "Invalid stat. Use one of avg, p50, p90, p95, p99, max, histogram."}
+        return 400, response
+    if stat == "avg":
+        stat = None
+    if interval:
+        options, error = series_options(params)
+        if error:
+            return 400, error
+
+    time_filter = date_filter(date, start_date, end_date)
+    region_filter = [region.lower()] if region else None
+    region_list = [r.strip().lower() for r in regions.split(",") if r.strip()] if regions else None
+    # Rows the branch below can use; only applied when latency.json is too big to cache
+    if interval:
+        prefilter = row_predicate(LATENCY_DIMENSIONS, time_filter, region=region_list or region_filter)
+    elif regions:
+        prefilter = row_predicate(LATENCY_DIMENSIONS, time_filter, region=region_list)
+    elif compare == "true":
+        prefilter = row_predicate(LATENCY_DIMENSIONS, time_filter)
+    elif update_timestamp or (date == "recent" and region):
+        prefilter = row_predicate(LATENCY_DIMENSIONS, region=region_filter)
+    else:
+        prefilter = row_predicate(LATENCY_DIMENSIONS, time_filter, region=region_filter)
+    table = load("latency.json", latency_table, prefilter=prefilter)
+
+    # Time series: count/avg/max per bucket and region, downsampled to a point budget
+    if interval:
+        interval, points, method = options
+        buckets = bucketed(table, time_filter, INTERVALS[interval], region=region_list or region_filter)
+        response = series_response(buckets, interval, points, method, _latency_point, lambda b, i: b.sums[i] / b.counts[i])
+        log_params = build_params_dict(region=region, regions=regions, date=date, start_date=start_date, end_date=end_date,
+                                       interval=interval, points=params.get("points"), downsample=params.get("downsample"))
+        # Series can be large; log just the points per region
+        _logged(log, "get-latency", log_params, {"points": {region: len(p) for region, p in response["series"].items()}})
+        return 200, response
+
+    # If comparing multiple regions: one pass over the selected rows, grouped by region
+    if regions:
+        if stat:
+            # Percentiles come from merged per-hour/per-day sketches, not from sorting raw samples
+            sketches = region_sketches(table, time_filter, region_list)
+            region_latencies = {reg: sketch_stat(sketches.get(reg, DDSketch()), stat) for reg in region_list}
+            response = {"stat": stat, "regionLatencies": region_latencies}
+        else:
+            groups = summarize(table, time_filter, by="region", region=region_list)
+            region_latencies = {reg: format_float(mean(groups.get(reg))) for reg in region_list}
+            response = {"regionLatencies": region_latencies}
+        log_params = build_params_dict(regions=regions, date=date, start_date=start_date, end_date=end_date, compare=compare, stat=stat)
+        return _logged(log, "get-latency", log_params, response)
+
+    # If compare is true, return all region averages and the highest
+    if compare == "true":
+        if stat:
+            sketches = region_sketches(table, time_filter)
+            region_latencies = {reg: sketch_stat(sketch, stat) for reg, sketch in sketches.items()}
+        else:
+            groups = summarize(table, time_filter, by="region")
+            region_latencies = {reg: format_float(mean(acc)) for reg, acc in groups.items()}
+        if stat == "histogram":
+            response = {"stat": stat, "regionLatencies": region_latencies}
+        elif region_latencies:
+            highest_region = _highest_region(table, time_filter, region_latencies)
+            response = {"regionLatencies": region_latencies, "highestLatencyRegion": highest_region, "highestLatencyMs": format_float(region_latencies[highest_region])}
+        else:
+            response = {"regionLatencies": {}, "highestLatencyRegion": None, "highestLatencyMs": 0}
+        if stat and stat != "histogram":
+            response = {"stat": stat, **response}
+        log_params = build_params_dict(date=date, start_date=start_date, end_date=end_date, compare=compare, stat=stat)
+        return _logged(log, "get-latency", log_params, response)
+
+    # If update_timestamp is provided, compare latency before and after update (optionally for a region)
+    if update_timestamp:
+        update_ms = parse_timestamp_ms(update_timestamp)
+        if update_ms == MISSING_TS:
+            response = {"error": "Invalid update_timestamp format. Use ISO format (e.g., 2025-05-25T12:00:00Z)"}
+            return 400, response
+
+        before = summarize(table, TimeRange(MISSING_TS + 1, update_ms), region=region_filter)[None]
+        after = summarize(table, TimeRange(update_ms, MAX_TS), region=region_filter)[None]
+        avg_before = mean(before)
+        avg_after = mean(after)
+        went_up = avg_after > avg_before
+        where = f" in {region}" if region else ""
+        response = {
+            "averageLatencyBefore": format_float(avg_before),
+            "averageLatencyAfter": format_float(avg_after),
+            "latencyWentUp": went_up,
+            "message": (
+                f"Latency increased after the update{where}." if went_up else (
+                    f"Latency decreased after the update{where}." if avg_after < avg_before else f"Latency stayed the same after the update{where}."
+                )
+            )
+        }
+        log_params = build_params_dict(update_timestamp=update_timestamp, region=region)
+        return _logged(log, "get-latency", log_params, response)
+
+    # Handle 'recent' date: return the most recent entry for the region
+    if date == "recent" and region:
+        latest = table.latest(region.lower())
+        if latest is not None:
+            most_recent = table.rows[latest]
+            response = {
+                "region": region,
+                "timestamp": most_recent.get("timestamp", ""),
+                "latencyMs": format_float(most_recent.get("latencyMs", 0))
+            }
+        else:
+            response = {"region": region, "message": "No data found for region."}
+        log_params = build_params_dict(region=region, date=date)
+        return _logged(log, "get-latency", log_params, response)
+
+    # Default: filter by single region or all
+    if stat:
+        merged = DDSketch()
+        for sketch in region_sketches(table, time_filter, region_filter).values():
+            merged.merge(sketch)
+        key = "histogram" if stat == "histogram" else "latencyMs"
+        response = {"stat": stat, key: sketch_stat(merged, stat), "count": merged.count}
+        log_params = build_params_dict(region=region, date=date, start_date=start_date, end_date=end_date, stat=stat)
+        return _logged(log, "get-latency", log_params, response)
+
+    totals = summarize(table, time_filter, region=region_filter)[None]
+    response = {"averageLatencyMs": format_float(mean(totals))}
+    log_params = build_params_dict(region=region, date=date, start_date=start_date, end_date=end_date)
+    return _logged(log, "get-latency", log_params, response)
+
+# group_by= values for check_errors -> dimensions, in the order they label each contributor
+ERROR_GROUPS = {"code": ("errorCode",), "region": ("region",), "code,region": ("errorCode", "region"), "region,code": ("errorCode", "region")}
+ERROR_GROUP_LABELS = {"errorCode": "code", "region": "region"}
+CHECK_ERRORS_DEFAULT_TOP = int(os.environ.get("CHECK_ERRORS_DEFAULT_TOP", "10"))
+
+def error_breakdown(table, time_filter, filters, dims, top):
+    """[(labels, errors, max overcount)] for the top contributors by dims, largest first.
+
+    Breakdowns by code come from the per-bucket heavy-hitter summaries, so they
+    stay cheap with any number of distinct codes; with a code= filter, or by
+    region alone, exact per-region totals come from the rollups.
+    """
+    if "errorCode" in dims and filters["errorCode"] is None:
+        ranked = top_keys(table, "errorCode", time_filter, filters["region"], by_region="region" in dims).top(top)
+        return [(key if isinstance(key, tuple) else (key,), count, error) for key, count, error in ranked]
+    code = filters["errorCode"][0] if filters["errorCode"] else None
+    totals = summarize(table, time_filter, by="region", **filters)
+    if dims == ("errorCode",):
+        entries = [((code,), sum(total for _, total in totals.values()))]
+    else:
+        entries = [((code, region) if "errorCode" in dims else (region,), total) for region, (_, total) in totals.items()]
+    return [(labels, total, 0) for labels, total in heapq.nlargest(top, (e for e in entries if e[1]), key=lambda e: e[1])]
+
+def check_errors(params, log=log_interaction, load=load_table):
+    region = params.get("region")
+    code = params.get("code")
+    date = params.get("date")
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+    interval = params.get("interval")  # 1m|5m|1h|1d: bucketed series per region instead of a total
+    group_by = params.get("group_by")  # code|region|code,region: top contributors instead of a total
+    top = params.get("top")
+
+    if group_by is not None:
+        if interval:
+            return 400, {"error": "group_by can't be combined with interval."}
+        group_by = group_by.replace(" ", "").lower()
+        if group_by not in ERROR_GROUPS:
+            return 400, {"error": f"Invalid group_by. Use one of {', '.join(g for g in ERROR_GROUPS if g != 'region,code')}."}
+        if top is not None and (not top.isdigit() or not 1 <= int(top) <= HEAVY_HITTERS_CAPACITY):
+            return 400, {"error": f"Invalid top. Use an integer between 1 and {HEAVY_HITTERS_CAPACITY}."}
+        top = int(top) if top is not None else CHECK_ERRORS_DEFAULT_TOP
+    if interval:
+        options, error = series_options(params)
+        if error:
+            return 400, error
+
+    time_filter = date_filter(date, start_date, end_date)
+    filters = {"region": [region.lower()] if region else None, "errorCode": [str(code)] if code else None}
+    table = load("errors.json", errors_table, prefilter=row_predicate(ERROR_DIMENSIONS, time_filter, **filters))
+
+    # Time series: error entries and errors per bucket and region, downsampled to a point budget
+    if interval:
+        interval, points, method = options
+        point = lambda b, i: {"count": b.counts[i], "errors": b.sums[i]}
+        response = series_response(bucketed(table, time_filter, INTERVALS[interval], **filters), interval, points, method, point, lambda b, i: b.sums[i])
+        log_params = build_params_dict(region=region, code=code, date=date, start_date=start_date, end_date=end_date,
+                                       interval=interval, points=params.get("points"), downsample=params.get("downsample"))
+        # Series can be large; log just the points per region
+        _logged(log, "check-errors", log_params, {"points": {region: len(p) for region, p in response["series"].items()}})
+        return 200, response
+    totals = summarize(table, time_filter, **filters)[None]
+    response = {"totalErrors": totals[1]}
+
+    # Top contributors and their share of the total
+    if group_by:
+        dims = ERROR_GROUPS[group_by]
+        ranked = error_breakdown(table, time_filter, filters, dims, top)
+        total = totals[1]
+        contributors = []
+        for labels, errors, overcount in ranked:
+            item = {ERROR_GROUP_LABELS[dim]: label for dim, label in zip(dims, labels)}
+            item["errors"] = table.number(errors)
+            item["share"] = round(errors / total, 4) if total else 0.0
+            if overcount:
+                item["maxOvercount"] = table.number(overcount)
+            contributors.append(item)
+        response["groupBy"] = ",".join(ERROR_GROUP_LABELS[dim] for dim in dims)
+        response["top"] = contributors
+        response["otherErrors"] = table.number(max(0, total - sum(errors for _, errors, _ in ranked)))
+        # Counts are upper bounds (within maxOvercount) once a range has more distinct keys than the summaries track
+        response["approximate"] = any(overcount for _, _, overcount in ranked)
+    log_params = build_params_dict(region=region, code=code, date=date, start_date=start_date, end_date=end_date,
+                                   group_by=group_by, top=top if group_by else None)
+    return _logged(log, "check-errors", log_params, response)
+
+# Largest page list_incidents will return when limit= is given
+INCIDENTS_MAX_LIMIT = int(os.environ.get("INCIDENTS_MAX_LIMIT", "1000"))
+# Page size of q= searches ranked by relevance when no limit= is given
+INCIDENTS_SEARCH_LIMIT = int(os.environ.get("INCIDENTS_SEARCH_LIMIT", "50"))
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    # Inverse of encode_cursor; raises ValueError on anything that isn't a cursor we issued
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(str(e))
+    if not (isinstance(key, list) and len(key) == 3 and isinstance(key[0], int) and isinstance(key[1], str) and isinstance(key[2], int)):
+        raise ValueError("malformed cursor")
+    return tuple(key)
+
+def incident_ids(table):
+    # Paging tie-breaker of every row, read from the row dicts once per table rather than per request
+    ids = table.derived.get("incident_ids")
+    if ids is None:
+        ids = table.derived["incident_ids"] = ["" if row.get("id") is None else str(row.get("id")) for row in table.rows]
+    return ids
+
+def incidents_ndjson(response):
+    """Render a list_incidents response as NDJSON: one incident per line, then a nextCursor line if paginated."""
+    for incident in response.get("incidents", []):
+        yield json.dumps(incident) + "\n"
+    if response.get("nextCursor"):
+        yield json.dumps({"nextCursor": response["nextCursor"]}) + "\n"
+
+def list_incidents(params, log=log_interaction, load=load_table):
+    region = params.get("region")
+    status = params.get("status")
+    date = params.get("date")
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+    limit = params.get("limit")
+    cursor = params.get("cursor")
+    fields = params.get("fields")  # comma-separated projection, e.g. id,status
+    sort = (params.get("sort") or "").lower() or None  # asc|desc by timestamp, default dataset order (relevance with q=)
+    response_format = params.get("format")
+    q = params.get("q")  # keywords, prefix* words and region:/status:/severity: terms, ranked by BM25
+
+    if sort not in (None, "asc", "desc"):
+        return 400, {"error": "Invalid sort. Use asc or desc."}
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= INCIDENTS_MAX_LIMIT:
+            return 400, {"error": f"Invalid limit. Use an integer between 1 and {INCIDENTS_MAX_LIMIT}."}
+        limit = int(limit)
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            return 400, {"error": "Invalid cursor."}
+    query = None
+    if q is not None:
+        query = parse_query(q)
+        if query is None:
+            return 400, {"error": "Invalid q. Give at least one keyword."}
+        if sort is None and not limit:
+            limit = INCIDENTS_SEARCH_LIMIT
+    # Paging needs a stable order: (timestamp, id, row) ascending unless sort=desc; searches rank by (score, id, row)
+    order = sort or ("relevance" if query else "asc" if limit or cursor else None)
+
+    time_filter = date_filter(date, start_date, end_date)
+    filters = {"region": [region.lower()] if region else None, "status": [status.lower()] if status else None}
+    table = load("incidents.json", incidents_table, prefilter=row_predicate(INCIDENT_DIMENSIONS, time_filter, **filters))
+    if query is not None:
+        scores = search(table, query, time_filter, **filters)
+        selection = list(scores)
+    else:
+        selection = table.select(time_filter, ordered=order is None, **filters)
+
+    next_cursor = None
+    if order is not None:
+        timestamps, ids = table.timestamps, incident_ids(table)
+
+        def key(i):
+            if order == "relevance":
+                # Integral, so the cursor round-trips exactly
+                return (round(scores[i] * 1e6), ids[i], i)
+            return (timestamps[i], ids[i], i)
+
+        descending = order in ("desc", "relevance")
+        if cursor:
+            selection = [i for i in selection if (key(i) < after if descending else key(i) > after)]
+        if limit:
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            selection = pick(limit + 1, selection, key=key)
+            if len(selection) > limit:
+                selection = selection[:limit]
+                next_cursor = encode_cursor(key(selection[-1]))
+        else:
+            selection.sort(key=key, reverse=descending)
+
+    incidents = [table.rows[i] for i in selection]
+    if fields:
+        wanted = [f.strip() for f in fields.split(",") if f.strip()]
+        incidents = [{f: row[f] for f in wanted if f in row} for row in incidents]
+    response = {"incidents": incidents}
+    if limit:
+        response["nextCursor"] = next_cursor
+
+    # Only a summary goes to the interaction log; full pages can run to megabytes
+    if response_format == "ndjson":
+        size = sum(len(line) for line in incidents_ndjson(response))
+    else:
+        size = len(json.dumps(response))
+    summary = {"count": len(incidents), "bytes": size}
+    log_params = build_params_dict(region=region, status=status, date=date, start_date=start_date, end_date=end_date,
+                                   limit=limit, cursor=cursor, fields=fields, sort=sort, format=response_format, q=q)
+    _logged(log, "list-incidents", log_params, summary)
+    return 200, response
+
+# Most recent anomalies returned per region
+ANOMALIES_MAX_PER_REGION = int(os.environ.get("ANOMALIES_MAX_PER_REGION", "100"))
+ANOMALY_BUCKETS = {"hour": HOUR_MS, "day": DAY_MS}
+# metric= -> (blob, builder, whether empty buckets count as zero)
+ANOMALY_METRICS = {"latency": ("latency.json", latency_table, False), "errors": ("errors.json", errors_table, True)}
+
+def detect_anomalies(params, log=log_interaction, load=load_table):
+    metric = (params.get("metric") or "latency").lower()
+    region = params.get("region")
+    bucket = (params.get("bucket") or "hour").lower()
+    window = params.get("window")
+    threshold = params.get("threshold")
+    date = params.get("date")
+    start_date = params.get("start_date")
+    end_date = params.get("end_date")
+
+    if metric not in ANOMALY_METRICS:
+        return 400, {"error": "Invalid metric. Use latency or errors."}
+    if bucket not in ANOMALY_BUCKETS:
+        return 400, {"error": "Invalid bucket. Use hour or day."}
+    if window is not None:
+        if not window.isdigit() or not 4 <= int(window) <= 720:
+            return 400, {"error": "Invalid window. Use an integer between 4 and 720 buckets."}
+        window = int(window)
+    if threshold is not None:
+        try:
+            threshold = float(threshold)
+        except ValueError:
+            threshold = None
+        if threshold is None or not 1 <= threshold <= 20:
+            return 400, {"error": "Invalid threshold. Use a number between 1 and 20."}
+
+    # Baselines need the history before the requested range, so only the region narrows the load
+    blob_name, build, fill_gaps = ANOMALY_METRICS[metric]
+    region_filter = [region.lower()] if region else None
+    dimensions = LATENCY_DIMENSIONS if metric == "latency" else ERROR_DIMENSIONS
+    table = load(blob_name, build, prefilter=row_predicate(dimensions, region=region_filter))
+    detectors = detect(table, ANOMALY_BUCKETS[bucket], region_filter, window or ANOMALY_WINDOW, threshold or ANOMALY_THRESHOLD, fill_gaps)
+
+    time_filter = date_filter(date, start_date, end_date)
+    if isinstance(time_filter, TimeRange):
+        in_range = lambda point: time_filter.lo <= point["bucketStart"] < time_filter.hi
+    elif isinstance(time_filter, TextFilter):
+        in_range = lambda point: time_filter.predicate(point["timestamp"])
+    else:
+        in_range = lambda point: True
+
+    regions = {}
+    for name, detector in detectors.items():
+        anomalies = [{k: v for k, v in a.items() if k != "bucketStart"} for a in detector.anomalies if in_range(a)]
+        latest = {k: v for k, v in detector.latest.items() if k != "bucketStart"}
+        regions[name] = {"anomalies": anomalies[-ANOMALIES_MAX_PER_REGION:], "latest": latest}
+    response = {"metric": metric, "bucket": bucket, "regions": regions}
+
+    summary = {"regions": len(regions), "anomalies": sum(len(r["anomalies"]) for r in regions.values())}
+    log_params = build_params_dict(metric=metric, region=region, bucket=bucket, window=window, threshold=threshold,
+                                   date=date, start_date=start_date, end_date=end_date)
+    _logged(log, "detect-anomalies", log_params, summary)
+    return 200, response
+
+# Sub-queries per /api/batch request, and threads evaluating them
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "50"))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "8"))
+
+QUERY_HANDLERS = {"get_latency": get_latency, "check_errors": check_errors, "list_incidents": list_incidents, "detect_anomalies": detect_anomalies}
+QUERY_DATASETS = {
+    "get_latency": ("latency.json", latency_table),
+    "check_errors": ("errors.json", errors_table),
+    "list_incidents": ("incidents.json", incidents_table),
+    "detect_anomalies": ("latency.json", latency_table),
+}
+
+def query_dataset(function, params):
+    """(blob_name, build) the query reads; detect_anomalies picks it by metric=."""
+    if function == "detect_anomalies":
+        metric = ANOMALY_METRICS.get(str(params.get("metric") or "latency").lower())
+        if metric is not None:
+            return metric[:2]
+    return QUERY_DATASETS[function]
+
+def run_cached(function, params, log=log_interaction, load=load_table, if_none_match=None, checked=None):
+    """QUERY_HANDLERS[function] behind the response cache; returns (status_code, response, etag).
+
+    A query whose normalized form was already answered from the current
+    snapshot is served from the cache. When if_none_match (the request's
+    If-None-Match header) names the current ETag, returns (304, None, etag)
+    without evaluating anything. Only 200 responses carry an ETag. checked is
+    the version an earlier cached_result() call found no answer for; the
+    lookup isn't repeated while the snapshot is still at that version.
+    """
+    key = cache_key(function, params) if RESPONSE_CACHE else None
+    if key is None:
+        status_code, response = QUERY_HANDLERS[function](params, log=log, load=load)
+        return status_code, response, None
+    blob_name = query_dataset(function, params)[0]
+    if checked is None or snapshot_version(blob_name) != checked:
+        cached, _ = cached_result(function, params, log=log, if_none_match=if_none_match)
+        if cached is not None:
+            return cached
+
+    # Evaluate, noting which snapshot version the handler read and what it logged
+    seen = {}
+
+    def tracking_load(name, build, prefilter=None):
+        table = load(name, build, prefilter=prefilter)
+        seen["version"] = getattr(table, "version", None)
+        return table
+
+    def tracking_log(name, parameters, response, timestamp):
+        seen["logged"] = response
+        log(name, parameters, response, timestamp)
+
+    status_code, response = QUERY_HANDLERS[function](params, log=tracking_log, load=tracking_load)
+    version = seen.get("version")
+    if status_code != 200 or version is None:
+        return status_code, response, None
+    response_cache.put(key, blob_name, version, response, seen.get("logged", response))
+    return status_code, response, etag_for(key, version)
+
+def cached_result(function, params, log=log_interaction, if_none_match=None):
+    """(answer, version): run_cached()'s answer if it needs no table (a 304 or a cached 200), else None,
+    and the snapshot version that was checked (None when it isn't known without a storage round trip).
+    """
+    key = cache_key(function, params) if RESPONSE_CACHE else None
+    if key is None:
+        return None, None
+    blob_name = query_dataset(function, params)[0]
+    version = snapshot_version(blob_name)
+    if version is None:
+        return None, None
+    etag = etag_for(key, version)
+    query = function.replace("_", "-")
+    asked = build_params_dict(**{name: params.get(name) for name in QUERY_PARAMS[function]})
+    if if_none_match and (if_none_match.strip() == "*" or etag in if_none_match):
+        response_cache.count_not_modified()
+        tracing.count("not_modified")
+        _logged(log, query, asked, {"notModified": True})
+        return (304, None, etag), version
+    entry = response_cache.get(key, blob_name, version)
+    if entry is not None:
+        tracing.count("cache_hits")
+        _logged(log, query, asked, entry["logged"])
+        return (200, entry["response"], etag), version
+    return None, version
+
+def http_response(trace, status_code, response, etag=None, ndjson=False):
+    """The HTTP response for a handler's result, with the trace headers and ETag; 304s have no body.
+
+    Shared by function_app.py and the python-functions handlers so the two apps answer alike.
+    ndjson renders a list_incidents page with incidents_ndjson().
+    """
+    # Imported here so the query code (and the benchmarks) load without the Functions library
+    import azure.functions as func
+    headers = {**tracing.headers(trace), **({"ETag": etag} if etag else {})}
+    if status_code == 304:
+        return func.HttpResponse(status_code=304, headers=headers)
+    if status_code == 200 and ndjson:
+        return func.HttpResponse("".join(incidents_ndjson(response)), status_code=status_code, mimetype="application/x-ndjson", headers=headers)
+    return func.HttpResponse(json.dumps(response), status_code=status_code, mimetype="application/json", headers=headers)
+
+def _query_param(value):
+    # JSON bodies may carry true/5 where query strings carry "true"/"5"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+def _param_error(params):
+    # Query strings only carry scalars; a list or object would be stringified into a filter matching nothing
+    bad = sorted(name for name, value in params.items() if value is not None and not isinstance(value, (str, int, float, bool)))
+    if bad:
+        return {"error": f"Invalid params: {', '.join(bad)} must be strings, numbers or booleans."}
+    return None
+
+def batch(queries, log=log_interaction, load=load_table):
+    """Answer several get_latency/check_errors/list_incidents queries in one call.
+
+    queries is a list of {"function": ..., "params": {...}, "id": optional}. Each
+    dataset is loaded once, the sub-queries run concurrently against those
+    tables, and a single "batch" entry is written to the interaction log.
+    A sub-query whose params aren't scalars gets a 400 result of its own.
+    """
+    if isinstance(queries, dict):
+        queries = queries.get("queries")
+    if not isinstance(queries, list) or not queries:
+        return 400, {"error": "Body must be a non-empty array of queries (or {\"queries\": [...]})."}
+    if len(queries) > BATCH_MAX_QUERIES:
+        return 400, {"error": f"Too many queries; at most {BATCH_MAX_QUERIES} per batch."}
+    for index, query in enumerate(queries):
+        if not isinstance(query, dict) or query.get("function") not in QUERY_HANDLERS or not isinstance(query.get("params", {}), dict):
+            return 400, {"error": f"Query {index} must be an object with function in {sorted(QUERY_HANDLERS)} and an optional params object."}
+
+    started = time.perf_counter()
+    # Sub-queries with bad params get their own 400 and load nothing
+    errors = {}
+    for index, query in enumerate(queries):
+        error = _param_error(query.get("params") or {})
+        if error:
+            errors[index] = error
+    datasets = list(dict.fromkeys(query_dataset(q["function"], q.get("params") or {}) for index, q in enumerate(queries) if index not in errors))
+    # One slot per sub-query so the consolidated log entry keeps request order
+    entries = [None] * len(queries)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(queries)))) as pool:
+        tables = dict(zip(datasets, pool.map(tracing.bind(lambda dataset: load(*dataset)), datasets)))
+
+        def shared(blob_name, build, prefilter=None):
+            return tables[(blob_name, build)]
+
+        def run(indexed):
+            index, query = indexed
+            query_started = time.perf_counter()
+            params = {k: _query_param(v) for k, v in query.get("params", {}).items() if v is not None}
+
+            def collect(name, parameters, response, timestamp):
+                entries[index] = {"query": name, "parameters": parameters, "response": response}
+
+            try:
+                if index in errors:
+                    status_code, response = 400, errors[index]
+                else:
+                    status_code, response = QUERY_HANDLERS[query["function"]](params, log=collect, load=shared)
+            except Exception as e:
+                logging.error(f"Batch query {index} ({query['function']}) failed: {e}")
+                status_code, response = 500, {"error": "Query failed."}
+            return {
+                "id": query.get("id", index),
+                "function": query["function"],
+                "status": status_code,
+                "response": response,
+                "elapsedMs": round((time.perf_counter() - query_started) * 1000, 2),
+            }
+
+        results = list(pool.map(tracing.bind(run), enumerate(queries)))
+
+    response = {"results": results, "elapsedMs": round((time.perf_counter() - started) * 1000, 2)}
+    _logged(log, "batch", {"queries": len(queries)}, [entry for entry in entries if entry is not None])
+    return 200, response
+
+def _logged(log, query, log_params, response):
+    try:
+        with tracing.stage("log"):
+            log(query, log_params, response, datetime.datetime.utcnow().isoformat() + "Z")
+    except Exception as e:
+        logging.error(f"Failed to log {query} interaction: {e}")
+    return 200, response
@@ -0,0 +1,425 @@
+import copy
+import datetime
+import heapq
+import re
+from array import array
+from bisect import bisect_left
+
+import tracing
+
+# Epoch-ms stand-in for rows whose timestamp is missing or unparseable; sorts before everything
+MISSING_TS = -(2 ** 62)
+# Upper bound for open-ended time ranges
+MAX_TS = 2 ** 62
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def parse_timestamp_ms(value):
+    """Parse an ISO-8601 timestamp (naive values are UTC) into epoch milliseconds, or MISSING_TS."""
+    if not value or not isinstance(value, str):
+        return MISSING_TS
+    try:
+        dt = datetime.datetime.fromisoformat(value.replace("Z", ""))
+    except ValueError:
+        return MISSING_TS
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def format_timestamp_ms(ms):
+    """Inverse of parse_timestamp_ms for valid timestamps: epoch ms -> "YYYY-MM-DDTHH:MM:SSZ"."""
+    return (_EPOCH + datetime.timedelta(milliseconds=ms)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else ""
+
+
+class Concat:
+    """Read-only sequence of head followed by tail, without copying head."""
+
+    def __init__(self, head, tail):
+        if isinstance(head, Concat):
+            head, tail = head.head, head.tail + list(tail)
+        self.head = head
+        self.tail = list(tail)
+
+    def __len__(self):
+        return len(self.head) + len(self.tail)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        n = len(self.head)
+        return self.head[i] if i < n else self.tail[i - n]
+
+    def __iter__(self):
+        yield from self.head
+        yield from self.tail
+
+
+class Table:
+    """Column-oriented view of a telemetry dataset.
+
+    Each dimension (region, status, errorCode, ...) is dictionary-encoded into an
+    int array, timestamps are parsed once into epoch milliseconds and the numeric
+    measure is kept in a double array. Queries narrow a selection vector of row
+    ids one column at a time instead of re-walking the row dicts.
+
+    Row ids are also indexed by timestamp, globally and per partition_by value
+    (region), so time-range queries bisect straight to the matching rows.
+    """
+
+    def __init__(self, rows, dimensions, measure=None, measure_default=0, partition_by="region"):
+        self.rows = rows
+        self.size = 0
+        # Per-snapshot structures built on top of the table (rollups, sketches, ...)
+        self.derived = {}
+        # ETag of the blob the table was built from, set by the loader (None = uncached/unknown)
+        self.version = None
+        # Last delta segment merged into the table (see deltas.py)
+        self.watermark = None
+        self.dimensions = dimensions
+        self.dictionaries = {dim: [] for dim in dimensions}
+        self.lookups = {dim: {} for dim in dimensions}
+        self.codes = {dim: array("i") for dim in dimensions}
+        self.timestamp_text = []
+        self.timestamps = array("q")
+        self.measure = measure
+        self.measure_default = measure_default
+        self.values = array("d")
+        # Keep integer totals integral in responses (e.g. totalErrors)
+        self.measure_is_int = True
+        self._encode(rows)
+        self._build_index(partition_by)
+
+    @classmethod
+    def from_columns(cls, rows, dictionaries, codes, timestamps, timestamp_text, measure, values, measure_is_int,
+                     partition_by="region", order=None, dimensions=None, measure_default=0):
+        """Rebuild a table from already-encoded columns (e.g. a binary snapshot).
+
+        Columns may be any int/float sequences supporting len() and indexing,
+        such as memoryviews over an mmap; order is the stored time-sorted row ids.
+        """
+        table = cls.__new__(cls)
+        table.rows = rows
+        table.size = len(timestamps)
+        table.derived = {}
+        table.version = None
+        table.watermark = None
+        table.dimensions = dimensions
+        table.dictionaries = dictionaries
+        table.lookups = {dim: {value: code for code, value in enumerate(values)} for dim, values in dictionaries.items()}
+        table.codes = codes
+        table.timestamp_text = timestamp_text
+        table.timestamps = timestamps
+        table.measure = measure
+        table.measure_default = measure_default
+        table.values = values
+        table.measure_is_int = measure_is_int
+        table._build_index(partition_by, order)
+        return table
+
+    def extended(self, rows):
+        """A new table with rows appended; this one is left untouched.
+
+        Columns are copied and extended rather than re-encoded, the time index
+        is merged instead of re-sorted, and derived structures that know how
+        (rollups, sketches) fold in just the new rows. Readers holding this
+        table keep a consistent view while the new one is built.
+        """
+        if self.dimensions is None:
+            raise ValueError("Table has no dimension normalizers to encode new rows with")
+        table = copy.copy(self)
+        table.rows = Concat(self.rows, rows)
+        table.timestamp_text = Concat(self.timestamp_text, [])
+        table.dictionaries = {dim: list(values) for dim, values in self.dictionaries.items()}
+        table.lookups = {dim: dict(lookup) for dim, lookup in self.lookups.items()}
+        table.codes = {dim: array("i", codes) for dim, codes in self.codes.items()}
+        table.timestamps = array("q", self.timestamps)
+        table.values = array("d", self.values)
+        start = self.size
+        table._encode(rows)
+        new_ids = range(start, table.size)
+        table._merge_index(new_ids)
+        table.derived = {}
+        for key, derived in self.derived.items():
+            extend = getattr(derived, "extended", None)
+            if extend is not None:
+                table.derived[key] = extend(table, new_ids)
+            elif key == "mmap":
+                # Still backing the columns the new table shares
+                table.derived[key] = derived
+        return table
+
+    def _encode(self, rows):
+        # Append rows to the columns (dictionaries grow as new values appear)
+        for dim, normalize in self.dimensions.items():
+            values, lookup, codes = self.dictionaries[dim], self.lookups[dim], self.codes[dim]
+            for row in rows:
+                key = normalize(row.get(dim, ""))
+                code = lookup.get(key)
+                if code is None:
+                    code = lookup[key] = len(values)
+                    values.append(key)
+                codes.append(code)
+
+        text = [row.get("timestamp", "") for row in rows]
+        if isinstance(self.timestamp_text, Concat):
+            self.timestamp_text.tail.extend(text)
+        else:
+            self.timestamp_text.extend(text)
+        self.timestamps.extend(parse_timestamp_ms(ts) for ts in text)
+
+        if self.measure is not None:
+            for row in rows:
+                value = row.get(self.measure, self.measure_default)
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    value = self.measure_default
+                if isinstance(value, float):
+                    self.measure_is_int = False
+                self.values.append(value)
+        self.size += len(rows)
+
+    def _build_index(self, partition_by, order=None):
+        # Time index: {partition code (None = all rows): (sorted timestamps, row ids)}.
+        # The sort is stable, so rows with equal timestamps keep their original order.
+        self.partition_by = partition_by if partition_by in self.codes else None
+        if order is None:
+            order = sorted(range(self.size), key=self.timestamps.__getitem__)
+        self.partitions = {None: (array("q", (self.timestamps[i] for i in order)), array("i", order))}
+        if self.partition_by is not None:
+            column = self.codes[self.partition_by]
+            grouped = {}
+            for i in order:
+                grouped.setdefault(column[i], []).append(i)
+            for code, ids in grouped.items():
+                self.partitions[code] = (array("q", (self.timestamps[i] for i in ids)), array("i", ids))
+
+    def _merge_index(self, new_ids):
+        # Merge new row ids into each (sorted timestamps, ids) partition; ties keep row order
+        ts = self.timestamps
+        new_order = sorted(new_ids, key=ts.__getitem__)
+        grouped = {None: new_order}
+        if self.partition_by is not None:
+            column = self.codes[self.partition_by]
+            for i in new_order:
+                grouped.setdefault(column[i], []).append(i)
+        partitions = dict(self.partitions)
+        for code, ids in grouped.items():
+            old_ts, old_ids = partitions.get(code, (array("q"), array("i")))
+            if not len(old_ts) or ts[ids[0]] >= old_ts[-1]:
+                # Common case: the new rows are all newer than what we had
+                merged_ts = array("q", old_ts)
+                merged_ts.extend(ts[i] for i in ids)
+                merged_ids = array("i", old_ids)
+                merged_ids.extend(ids)
+            else:
+                merged = list(heapq.merge(zip(old_ts, old_ids), ((ts[i], i) for i in ids)))
+                merged_ts = array("q", (t for t, _ in merged))
+                merged_ids = array("i", (i for _, i in merged))
+            partitions[code] = (merged_ts, merged_ids)
+        self.partitions = partitions
+
+    @tracing.timed("filter")
+    def select(self, time_filter=None, ordered=True, **dims):
+        """Return the ids of rows matching every filter.
+
+        dims maps a dimension to an iterable of normalized values to keep (None
+        means no filter on that dimension). Filters on partition_by and TimeRange
+        filters are answered from the time index in O(log N + k); ids come back in
+        row order unless ordered is False.
+        """
+        wanted_codes = {}
+        for dim, wanted in dims.items():
+            if wanted is None:
+                continue
+            lookup = self.lookups[dim]
+            codes = {lookup[v] for v in wanted if v in lookup}
+            if not codes:
+                return []
+            wanted_codes[dim] = codes
+
+        selection = None
+        partition_codes = wanted_codes.pop(self.partition_by, None) if self.partition_by else None
+        if partition_codes is not None or isinstance(time_filter, TimeRange):
+            lo, hi = (time_filter.lo, time_filter.hi) if isinstance(time_filter, TimeRange) else (MISSING_TS, MAX_TS)
+            if isinstance(time_filter, TimeRange):
+                time_filter = None
+            selection = []
+            for code in (partition_codes if partition_codes is not None else [None]):
+                selection.extend(self._time_slice(code, lo, hi))
+            if ordered:
+                selection.sort()
+
+        for dim, codes in wanted_codes.items():
+            column = self.codes[dim]
+            candidates = range(self.size) if selection is None else selection
+            if len(codes) == 1:
+                code = next(iter(codes))
+                selection = [i for i in candidates if column[i] == code]
+            else:
+                selection = [i for i in candidates if column[i] in codes]
+        if selection is None:
+            selection = range(self.size)
+        if time_filter is not None:
+            selection = time_filter.apply(self, selection)
+        selection = list(selection)
+        tracing.count("rows", len(selection))
+        return selection
+
+    def latest(self, value):
+        """Row id of the newest row whose partition_by value is value (earliest row on ties), or None."""
+        code = self.lookups[self.partition_by].get(value) if self.partition_by else None
+        if code is None:
+            return None
+        ts, ids = self.partitions[code]
+        return ids[bisect_left(ts, ts[-1])]
+
+    def _time_slice(self, code, lo, hi):
+        ts, ids = self.partitions[code]
+        if lo <= MISSING_TS and hi >= MAX_TS:
+            return ids
+        return ids[bisect_left(ts, lo):bisect_left(ts, hi)]
+
+    @tracing.timed("aggregate")
+    def aggregate(self, selection, by=None):
+        """Count and sum the measure over selection, optionally grouped by a dimension.
+
+        Returns {group value: [count, total]} in first-seen order, keyed by None
+        when ungrouped.
+        """
+        values = self.values
+        if by is None:
+            total = sum(values[i] for i in selection) if self.measure is not None else 0
+            return {None: [len(selection), self.number(total)]}
+        names = self.dictionaries[by]
+        column = self.codes[by]
+        groups = {}
+        for i in selection:
+            acc = groups.get(column[i])
+            if acc is None:
+                acc = groups[column[i]] = [0, 0]
+            acc[0] += 1
+            acc[1] += values[i]
+        return {names[code]: [count, self.number(total)] for code, (count, total) in groups.items()}
+
+    def number(self, total):
+        """A measure total as the API reports it: int for integral measures (e.g. errorCount), else float."""
+        return int(total) if self.measure_is_int else total
+
+
+class TimeRange:
+    """Half-open [lo, hi) epoch-ms range filter."""
+
+    def __init__(self, lo, hi):
+        self.lo = lo
+        self.hi = hi
+
+    def apply(self, table, selection):
+        ts, lo, hi = table.timestamps, self.lo, self.hi
+        return [i for i in selection if lo <= ts[i] < hi]
+
+
+class TextFilter:
+    """Fallback filter on the raw timestamp text for date strings we can't turn into a range."""
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def apply(self, table, selection):
+        text, predicate = table.timestamp_text, self.predicate
+        return [i for i in selection if predicate(text[i] if isinstance(text[i], str) else "")]
+
+
+_DATE_PREFIX = re.compile(r"^(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?$")
+
+
+def _prefix_range(prefix):
+    # "2025", "2025-05" or "2025-05-25" -> [start, end) in epoch ms
+    match = _DATE_PREFIX.match(prefix or "")
+    if not match:
+        return None
+    year, month, day = match.groups()
+    try:
+        start = datetime.datetime(int(year), int(month or 1), int(day or 1))
+    except ValueError:
+        return None
+    if day:
+        end = start + datetime.timedelta(days=1)
+    elif month:
+        end = datetime.datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    else:
+        end = datetime.datetime(start.year + 1, 1, 1)
+    to_ms = lambda dt: (dt - _EPOCH) // datetime.timedelta(milliseconds=1)
+    return to_ms(start), to_ms(end)
+
+
+def date_filter(date=None, start_date=None, end_date=None):
+    """Build the time filter shared by every endpoint.
+
+    start_date/end_date (inclusive calendar days) win over date, which matches
+    timestamps starting with the given prefix. Returns None when no date filter applies.
+    """
+    if start_date and end_date:
+        lo = _prefix_range(start_date) if len(start_date) == 10 else None
+        hi = _prefix_range(end_date) if len(end_date) == 10 else None
+        if lo and hi:
+            return TimeRange(lo[0], hi[1])
+        return TextFilter(lambda ts: start_date <= ts[:10] <= end_date)
+    if date:
+        bounds = _prefix_range(date)
+        if bounds:
+            return TimeRange(*bounds)
+        return TextFilter(lambda ts: ts.startswith(date))
+    return None
+
+
+def row_predicate(dimensions, time_filter=None, **dims):
+    """Predicate on raw row dicts equivalent to Table.select(time_filter, **dims).
+
+    Used to drop rows while streaming a blob that is too big to cache.
+    """
+    checks = [(dim, dimensions[dim], set(wanted)) for dim, wanted in dims.items() if wanted is not None]
+
+    def keep(row):
+        if not isinstance(row, dict):
+            return False
+        for dim, normalize, wanted in checks:
+            if normalize(row.get(dim, "")) not in wanted:
+                return False
+        if isinstance(time_filter, TimeRange):
+            return time_filter.lo <= parse_timestamp_ms(row.get("timestamp", "")) < time_filter.hi
+        if time_filter is not None:
+            text = row.get("timestamp", "")
+            return time_filter.predicate(text if isinstance(text, str) else "")
+        return True
+    return keep
+
+
+LATENCY_DIMENSIONS = {"region": _lower}
+ERROR_DIMENSIONS = {"region": _lower, "errorCode": str}
+INCIDENT_DIMENSIONS = {"region": _lower, "status": _lower}
+
+
+def latency_table(data):
+    return Table(data if isinstance(data, list) else [], LATENCY_DIMENSIONS, measure="latencyMs")
+
+
+def errors_table(data):
+    errors = data.get("errorEntries", []) if isinstance(data, dict) else data
+    return Table(errors if isinstance(errors, list) else [], ERROR_DIMENSIONS, measure="errorCount", measure_default=1)
+
+
+def incidents_table(data):
+    return Table(data if isinstance(data, list) else [], INCIDENT_DIMENSIONS)
+
+
+# Builder name -> (dimensions, measure_default), for tables rebuilt from encoded columns
+TABLE_SCHEMAS = {
+    "latency_table": (LATENCY_DIMENSIONS, 0),
+    "errors_table": (ERROR_DIMENSIONS, 1),
+    "incidents_table": (INCIDENT_DIMENSIONS, 0),
+}
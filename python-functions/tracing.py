@@ -0,0 +1,195 @@
+"""Per-request stage timings for the telemetry routes.
+
+A route opens a trace with request(); code on the hot path wraps its work in
+stage("download"), stage("filter"), ... and bumps counters with count(). The
+finished trace becomes a Server-Timing header, one structured log line and,
+optionally, OpenTelemetry spans. With no active trace stage() returns a shared
+no-op context manager, so the instrumentation costs one ContextVar lookup.
+
+Tracing is on for a request when TRACING_ENABLED is true, or when the caller
+passes ?trace=true or an x-trace: true header. Stage timings may nest (a filter
+inside an aggregate), so they need not add up to the total.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "false").lower() == "true"
+# "" (off), "console" or "otlp"; needs the opentelemetry-sdk (and exporter) packages
+TRACING_OTEL_EXPORTER = os.environ.get("TRACING_OTEL_EXPORTER", "").lower()
+
+_current = contextvars.ContextVar("telemetry_trace", default=None)
+_noop = contextlib.nullcontext()
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self.stages = {}
+        self.counters = {}
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name, started, elapsed):
+        with self._lock:
+            total, calls = self.stages.get(name, (0.0, 0))
+            self.stages[name] = (total + elapsed, calls + 1)
+            if _tracer is not None:
+                self.spans.append((name, started, elapsed))
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        parts = [f"{name};dur={total * 1000:.2f}" for name, (total, _) in self.stages.items()]
+        parts.extend(f'{name};desc="{value}"' for name, value in self.counters.items())
+        parts.append(f"total;dur={self.elapsed_ms():.2f}")
+        return ", ".join(parts)
+
+    def fields(self):
+        return {
+            "route": self.name,
+            "totalMs": round(self.elapsed_ms(), 2),
+            "stages": {name: {"ms": round(total * 1000, 2), "calls": calls} for name, (total, calls) in self.stages.items()},
+            **self.counters,
+        }
+
+
+def _requested(req):
+    if TRACING_ENABLED:
+        return True
+    flag = req.params.get("trace") or req.headers.get("x-trace") or ""
+    return flag.lower() in ("1", "true")
+
+
+@contextlib.contextmanager
+def request(name, req):
+    """Trace one request if enabled for it; yields the Trace or None."""
+    if not _requested(req):
+        yield None
+        return
+    _get_tracer()
+    trace = Trace(name)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        fields = trace.fields()
+        logging.info(f"Trace {name}: {json.dumps(fields)}", extra={"custom_dimensions": fields})
+        _export(trace)
+
+
+def headers(trace):
+    # Response headers for a finished (or finishing) trace; {} when tracing is off
+    return {"Server-Timing": trace.server_timing()} if trace is not None else {}
+
+
+def stage(name):
+    """Context manager timing one stage of the current request (no-op when untraced)."""
+    trace = _current.get()
+    if trace is None:
+        return _noop
+    return _Stage(trace, name)
+
+
+class _Stage:
+    __slots__ = ("trace", "name", "started", "start_ns")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.record(self.name, self.start_ns, time.perf_counter() - self.started)
+        return False
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def bind(fn):
+    """Wrap fn so it records into the caller's trace when run on another thread (e.g. a thread pool)."""
+    trace = _current.get()
+    if trace is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _current.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def _get_tracer():
+    global _tracer, TRACING_OTEL_EXPORTER
+    if not TRACING_OTEL_EXPORTER or _tracer is not None:
+        return _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            try:
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+                if TRACING_OTEL_EXPORTER == "otlp":
+                    # Endpoint from OTEL_EXPORTER_OTLP_ENDPOINT (default localhost:4317)
+                    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+                    exporter = OTLPSpanExporter()
+                else:
+                    exporter = ConsoleSpanExporter()
+            except ImportError as e:
+                logging.warning(f"OpenTelemetry export disabled: {e}")
+                TRACING_OTEL_EXPORTER = ""
+                return None
+            provider = TracerProvider()
+            provider.add_span_processor(BatchSpanProcessor(exporter))
+            _tracer = provider.get_tracer("telemetry")
+    return _tracer
+
+
+def _export(trace):
+    # Spans are created after the fact from the recorded timings, so stages stay cheap
+    tracer = _get_tracer()
+    if tracer is None:
+        return
+    from opentelemetry.trace import set_span_in_context
+    root = tracer.start_span(trace.name, start_time=trace.start_ns, attributes={k: v for k, v in trace.counters.items()})
+    parent = set_span_in_context(root)
+    for name, start_ns, elapsed in trace.spans:
+        tracer.start_span(name, context=parent, start_time=start_ns).end(end_time=start_ns + int(elapsed * 1e9))
+    root.end(end_time=trace.start_ns + int(trace.elapsed_ms() * 1e6))
@@ -0,0 +1,11 @@
+import azure.functions as func
+import logging
+import log_segments
+import telemetry_api
+import tracing
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info("Processing usage_stats request")
+    with tracing.request("usage_stats", req) as trace:
+        status_code, response = log_segments.usage_stats(req.params)
+    return telemetry_api.http_response(trace, status_code, response)
@@ -0,0 +1,302 @@
+"""Background processing of GitHub webhook deliveries.
+
+The github/callback route checks the signature, hands the raw body to
+WebhookQueue.offer() and returns 202. Deliveries wait in a bounded in-memory
+queue; during bursts that overflow it they spill to files under
+WEBHOOK_SPILL_DIR (picked up again after a worker restart). A few worker
+threads parse the payloads, drop redeliveries by X-GitHub-Delivery id and
+append one summary record per event to the github-events/YYYY/MM/DD/HH.jsonl
+append blobs in batches; a delivery counts as seen only once it is recorded.
+stats() reports queue depth and processing lag (github/stats, function key).
+"""
+import collections
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from interaction_log import get_append_logger
+
+# Shared secret configured on the GitHub webhook; unsigned deliveries are rejected when unset...
+GITHUB_WEBHOOK_SECRET = os.environ.get("GITHUB_WEBHOOK_SECRET", "")
+# ...unless this is set to accept them anyway (local testing)
+GITHUB_WEBHOOK_ALLOW_UNSIGNED = os.environ.get("GITHUB_WEBHOOK_ALLOW_UNSIGNED", "false").lower() == "true"
+# Deliveries held in memory before new ones spill to disk...
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+# ...and bytes spilled before new ones are rejected with 503
+WEBHOOK_SPILL_MAX_BYTES = int(os.environ.get("WEBHOOK_SPILL_MAX_BYTES", str(512 * 1024 * 1024)))
+WEBHOOK_SPILL_DIR = os.environ.get("WEBHOOK_SPILL_DIR", os.path.join(tempfile.gettempdir(), "github-webhooks"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "2"))
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", "100"))
+# Delivery ids remembered for deduplication (GitHub redeliveries reuse the id)
+WEBHOOK_DEDUPE_SIZE = int(os.environ.get("WEBHOOK_DEDUPE_SIZE", "10000"))
+
+_SPILL_SUFFIX = ".delivery"
+
+if not GITHUB_WEBHOOK_SECRET:
+    logging.warning("GITHUB_WEBHOOK_SECRET is not set: GitHub deliveries "
+                    + ("are accepted without verification." if GITHUB_WEBHOOK_ALLOW_UNSIGNED else "will be rejected."))
+
+
+def verify_signature(body, signature, secret=None, allow_unsigned=None):
+    """Whether signature (the X-Hub-Signature-256 header, "sha256=<hex>") is the HMAC of body.
+
+    Without a secret (argument or GITHUB_WEBHOOK_SECRET) every delivery fails,
+    or passes when allow_unsigned (default GITHUB_WEBHOOK_ALLOW_UNSIGNED).
+    """
+    secret = GITHUB_WEBHOOK_SECRET if secret is None else secret
+    if not secret:
+        return GITHUB_WEBHOOK_ALLOW_UNSIGNED if allow_unsigned is None else allow_unsigned
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature[len("sha256="):], expected)
+
+
+def summarize(event, delivery, payload, received_at):
+    """The record kept for one delivery: who did what where, not the whole payload."""
+    payload = payload if isinstance(payload, dict) else {}
+    record = {
+        "deliveryId": delivery,
+        "event": event,
+        "action": payload.get("action"),
+        "repository": (payload.get("repository") or {}).get("full_name"),
+        "sender": (payload.get("sender") or {}).get("login"),
+        "receivedAt": _iso(received_at),
+        "processedAt": _iso(time.time()),
+    }
+    if event == "push":
+        record.update(ref=payload.get("ref"), after=payload.get("after"), commits=len(payload.get("commits") or []))
+    elif event in ("workflow_run", "workflow_job", "check_run", "check_suite"):
+        run = payload.get(event) or {}
+        record.update(name=run.get("name"), status=run.get("status"), conclusion=run.get("conclusion"), url=run.get("html_url"))
+    return record
+
+
+def _iso(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class WebhookQueue:
+    """Bounded FIFO of raw deliveries, spilling to disk, drained by a pool of worker threads.
+
+    record(records) is called from the workers with each batch of summaries.
+    Once anything has spilled, new deliveries spill too until the files are
+    drained, so deliveries are processed in arrival order.
+    """
+
+    def __init__(self, record, max_items=WEBHOOK_QUEUE_SIZE, spill_dir=WEBHOOK_SPILL_DIR, spill_max_bytes=WEBHOOK_SPILL_MAX_BYTES,
+                 workers=WEBHOOK_WORKERS, batch_size=WEBHOOK_BATCH_SIZE, dedupe_size=WEBHOOK_DEDUPE_SIZE):
+        self.record = record
+        self.max_items = max_items
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.batch_size = batch_size
+        self.dedupe_size = dedupe_size
+        self._memory = collections.deque()
+        self._spilled = collections.deque()
+        self._spill_bytes = 0
+        self._seen = collections.OrderedDict()
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._stats = {"accepted": 0, "spilled": 0, "rejected": 0, "processed": 0, "duplicates": 0, "failed": 0,
+                       "last_lag_ms": 0.0, "max_lag_ms": 0.0}
+        self._recover()
+        self._threads = [threading.Thread(target=self._run, name=f"webhook-worker-{n}", daemon=True) for n in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def offer(self, body, delivery=None, event=None):
+        """Queue a raw delivery; returns False when memory and spill space are both full."""
+        received_at = time.time()
+        with self._cond:
+            if not self._spilled and len(self._memory) < self.max_items:
+                self._memory.append((received_at, delivery, event, body))
+                self._stats["accepted"] += 1
+                self._cond.notify()
+                return True
+            if self._spill_bytes + len(body) > self.spill_max_bytes:
+                self._stats["rejected"] += 1
+                return False
+            self._spill_bytes += len(body)
+        try:
+            path = self._spill(received_at, delivery, event, body)
+        except OSError as e:
+            logging.error(f"Could not spill webhook delivery {delivery}: {e}")
+            with self._cond:
+                self._spill_bytes -= len(body)
+                self._stats["rejected"] += 1
+            return False
+        with self._cond:
+            self._spilled.append((received_at, path, len(body)))
+            self._stats["accepted"] += 1
+            self._stats["spilled"] += 1
+            self._cond.notify()
+        return True
+
+    def depth(self):
+        with self._cond:
+            return len(self._memory) + len(self._spilled)
+
+    def stats(self):
+        with self._cond:
+            heads = [queue[0][0] for queue in (self._memory, self._spilled) if queue]
+            return {
+                **self._stats,
+                "queued": len(self._memory),
+                "spill_files": len(self._spilled),
+                "spill_bytes": self._spill_bytes,
+                "oldest_lag_ms": round((time.time() - min(heads)) * 1000, 1) if heads else 0.0,
+            }
+
+    def _spill(self, received_at, delivery, event, body):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        # Names sort by arrival, so a restarted worker drains them in order
+        path = os.path.join(self.spill_dir, f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{_SPILL_SUFFIX}")
+        header = json.dumps({"receivedAt": received_at, "delivery": delivery, "event": event}).encode("utf-8")
+        with open(path + ".tmp", "wb") as f:
+            f.write(header + b"\n" + body)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def _unspill(self, path):
+        # Rename first: if another worker process recovered the same file, only one of us gets it
+        claimed = f"{path}.{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+            with open(claimed, "rb") as f:
+                header, _, body = f.read().partition(b"\n")
+            os.remove(claimed)
+        except FileNotFoundError:
+            return None
+        meta = json.loads(header)
+        return meta["receivedAt"], meta["delivery"], meta["event"], body
+
+    def _recover(self):
+        try:
+            names = sorted(name for name in os.listdir(self.spill_dir) if name.endswith(_SPILL_SUFFIX))
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            self._spilled.append((int(name.split("-", 1)[0]) / 1e9, path, size))
+            self._spill_bytes += size
+        if names:
+            logging.info(f"Recovered {len(names)} spilled webhook deliveries from {self.spill_dir}")
+
+    def _take(self):
+        with self._cond:
+            while not self._memory and not self._spilled:
+                self._cond.wait()
+            items = []
+            while self._memory and len(items) < self.batch_size:
+                items.append(self._memory.popleft())
+            spilled = []
+            while self._spilled and len(items) + len(spilled) < self.batch_size:
+                spilled.append(self._spilled.popleft())
+        for _, path, size in spilled:
+            try:
+                item = self._unspill(path)
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"Dropping unreadable spilled webhook delivery {path}: {e}")
+                item = None
+                with self._cond:
+                    self._stats["failed"] += 1
+            with self._cond:
+                self._spill_bytes -= size
+            if item is not None:
+                items.append(item)
+        return items
+
+    def _claim(self, delivery):
+        # Called with _cond held; False for a delivery already recorded or being recorded
+        if delivery in self._seen:
+            self._seen.move_to_end(delivery)
+            return False
+        if delivery in self._in_flight:
+            return False
+        self._in_flight.add(delivery)
+        return True
+
+    def _release(self, deliveries, recorded):
+        # Only recorded deliveries count as seen, so GitHub's redelivery of a failed one is processed
+        with self._cond:
+            for delivery in deliveries:
+                self._in_flight.discard(delivery)
+                if recorded:
+                    self._seen[delivery] = None
+                    if len(self._seen) > self.dedupe_size:
+                        self._seen.popitem(last=False)
+
+    def _process(self, items):
+        records, claimed, duplicates, failed = [], [], 0, 0
+        for received_at, delivery, event, body in items:
+            if delivery:
+                with self._cond:
+                    duplicate = not self._claim(delivery)
+                if duplicate:
+                    duplicates += 1
+                    continue
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                logging.warning(f"Skipping GitHub {event} delivery {delivery}: body is not JSON")
+                failed += 1
+                if delivery:
+                    self._release([delivery], recorded=False)
+                continue
+            records.append(summarize(event, delivery, payload, received_at))
+            if delivery:
+                claimed.append(delivery)
+        recorded = True
+        if records:
+            try:
+                self.record(records)
+            except Exception as e:
+                logging.error(f"Failed to record {len(records)} GitHub events: {e}")
+                failed += len(records)
+                recorded = False
+        self._release(claimed, recorded)
+        now = time.time()
+        lag_ms = round((now - min(item[0] for item in items)) * 1000, 1)
+        with self._cond:
+            self._stats["processed"] += len(items) - duplicates - failed
+            self._stats["duplicates"] += duplicates
+            self._stats["failed"] += failed
+            self._stats["last_lag_ms"] = lag_ms
+            self._stats["max_lag_ms"] = max(self._stats["max_lag_ms"], lag_ms)
+
+    def _run(self):
+        while True:
+            items = self._take()
+            if items:
+                self._process(items)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_webhook_queue():
+    # One queue and worker pool per worker process, started by the first delivery
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WebhookQueue(_append_events)
+        return _queue
+
+
+def _append_events(records):
+    # Written before returning, so the queue only counts a delivery as seen once it is in storage
+    events = get_append_logger("github-events.json", connection_string=os.environ.get("AzureWebJobsStorage"))
+    events.write(records)
@@ -0,0 +1,115 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The backend modules import each other by name, as they do on a Functions worker
+sys.path[:0] = [os.path.join(ROOT, "python-functions"), os.path.join(ROOT, "benchmarks")]
+
+import localblob  # noqa: E402
+from rollups import DAY_MS, HOUR_MS  # noqa: E402
+from telemetry_query import MAX_TS, MISSING_TS, TimeRange, format_timestamp_ms, parse_timestamp_ms  # noqa: E402
+
+
+def no_log(*args, **kwargs):
+    pass
+
+
+@pytest.fixture
+def blobs(monkeypatch, tmp_path):
+    """An empty in-memory blob store behind every blob client, with fresh caches in front of it."""
+    import blob_clients
+    import common
+    import deltas
+    import snapshot_cache
+    import snapshot_format
+    import telemetry_aio
+
+    service = localblob.LocalBlobService()
+    async_service = localblob.AsyncLocalBlobService(service)
+    monkeypatch.setattr(blob_clients, "get_blob_service_client", lambda account_url=None, connection_string=None: service)
+    monkeypatch.setattr(blob_clients, "get_async_blob_service_client", lambda account_url=None, connection_string=None: async_service)
+    caches = {
+        "snapshot_cache": snapshot_cache.SnapshotCache(),
+        "delta_tables": deltas.DeltaTables(),
+        "binary_snapshots": snapshot_format.BinarySnapshotLoader(directory=str(tmp_path)),
+    }
+    for module in (common, telemetry_aio):
+        for name, cache in caches.items():
+            monkeypatch.setattr(module, name, cache)
+    return service
+
+
+def put_json(service, blob_name, data):
+    service.get_blob_client("telemetry", blob_name).upload_blob(json.dumps(data).encode("utf-8"), overwrite=True)
+
+
+# Shared test data for the index tests (rollups, sketches, heavy hitters, search): seeded rows over
+# three days from START, about 2% of them undated, and the kinds of ranges the indexes answer differently
+START = parse_timestamp_ms("2025-05-24T00:00:00Z")
+REGIONS = ["eastus", "westus", "westeurope", "japaneast"]
+RANGES = {
+    "unbounded": (MISSING_TS, MAX_TS),                                    # includes undated rows
+    "day": (START + DAY_MS, START + 2 * DAY_MS),                          # whole days
+    "hours": (START + 5 * HOUR_MS, START + DAY_MS + 7 * HOUR_MS),         # whole hours around a day
+    "ragged": (START + 5 * HOUR_MS + 123_456, START + 2 * DAY_MS - 999),  # partial hours, raw rows
+}
+
+
+def in_range(row, lo, hi):
+    return lo <= parse_timestamp_ms(row.get("timestamp")) < hi
+
+
+def _dated(rng, row):
+    if rng.random() > 0.02:
+        row["timestamp"] = format_timestamp_ms(START + rng.randrange(3 * DAY_MS))
+    return row
+
+
+@pytest.fixture(params=list(RANGES))
+def time_range(request):
+    """(lo, hi, time_filter) for each of RANGES; time_filter is None for the unbounded range."""
+    lo, hi = RANGES[request.param]
+    return lo, hi, None if lo == MISSING_TS else TimeRange(lo, hi)
+
+
+@pytest.fixture
+def latency_rows():
+    """rows(seed, n, latency=...) -> latency.json rows; latency(rng) draws each latencyMs."""
+    def rows(seed, n, latency=lambda rng: round(rng.uniform(5, 500), 2)):
+        rng = random.Random(seed)
+        return [_dated(rng, {"region": rng.choice(REGIONS), "latencyMs": latency(rng)}) for _ in range(n)]
+    return rows
+
+
+@pytest.fixture
+def error_rows():
+    """rows(seed, n, codes) -> errorEntries rows over `codes` error codes, a few of which carry most errors."""
+    def rows(seed, n, codes):
+        rng = random.Random(seed)
+        return [_dated(rng, {"region": rng.choice(REGIONS), "errorCode": str(int(rng.paretovariate(1.2)) % codes),
+                             "errorCount": rng.randint(1, 5)}) for _ in range(n)]
+    return rows
+
+
+INCIDENT_WORDS = ["timeout", "timeouts", "timer", "database", "latency", "spike", "dns", "failure", "gateway", "certificate",
+                  "expired", "queue", "backlog", "storage", "throttling", "login", "error", "retry", "node", "disk"]
+
+
+@pytest.fixture
+def incident_rows():
+    """rows(seed, n) -> incidents.json rows with INCIDENT_WORDS titles and descriptions."""
+    def rows(seed, n):
+        rng = random.Random(seed)
+        return [_dated(rng, {
+            "id": f"INC{i:04d}",
+            "title": " ".join(rng.choices(INCIDENT_WORDS, k=rng.randint(2, 6))).capitalize(),
+            "description": " ".join(rng.choices(INCIDENT_WORDS, k=rng.randint(0, 25))),
+            "region": rng.choice(REGIONS),
+            "status": rng.choice(["open", "resolved"]),
+            "severity": rng.choice(["low", "high", 3]),
+        }) for i in range(n)]
+    return rows
@@ -0,0 +1,41 @@
+import anomalies
+from rollups import HOUR_MS
+from telemetry_query import latency_table
+
+
+def hourly_latency():
+    rows = []
+    for hour in range(72):
+        ms = 500 if hour == 60 else 100 + hour % 3
+        rows.append({"region": "EastUS", "latencyMs": ms, "timestamp": f"2025-05-{1 + hour // 24:02d}T{hour % 24:02d}:00:00Z"})
+    return rows
+
+
+def test_client_thresholds_share_a_bounded_cache(monkeypatch):
+    monkeypatch.setattr(anomalies, "ANOMALY_CUSTOM_INDEXES", 4)
+    table = latency_table(hourly_latency())
+    default = anomalies.detect(table, HOUR_MS)["eastus"]
+    assert [a["kind"] for a in default.anomalies] == ["spike"]
+
+    for n in range(50):
+        detector = anomalies.detect(table, HOUR_MS, threshold=2 + n / 10)["eastus"]
+        expected = anomalies.AnomalyIndex(table, HOUR_MS, anomalies.ANOMALY_WINDOW, 2 + n / 10, False).detectors[0]
+        assert detector.anomalies == expected.anomalies
+
+    assert len(table.derived["anomalies_custom"]) == 4
+    assert sum(1 for key in table.derived if isinstance(key, tuple) and key[0] == "anomalies") == 1
+    assert anomalies.detect(table, HOUR_MS)["eastus"] is default
+
+
+def test_custom_indexes_are_built_outside_the_build_lock(monkeypatch):
+    table = latency_table(hourly_latency())
+    built, build = [], anomalies.AnomalyIndex
+
+    def index(*args):
+        built.append(anomalies._build_lock.locked())
+        return build(*args)
+
+    monkeypatch.setattr(anomalies, "AnomalyIndex", index)
+    first = anomalies.get_anomaly_index(table, HOUR_MS, threshold=2.5)
+    assert anomalies.get_anomaly_index(table, HOUR_MS, threshold=2.5) is first
+    assert built == [False]
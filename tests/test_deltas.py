@@ -0,0 +1,34 @@
+import common
+import deltas
+import telemetry_api
+from conftest import no_log, put_json
+
+
+def latency(region, ms):
+    return {"region": region, "latencyMs": ms, "timestamp": "2025-05-10T12:00:00Z"}
+
+
+def average(params):
+    status, response = telemetry_api.get_latency(params, log=no_log)
+    assert status == 200
+    return response["averageLatencyMs"]
+
+
+def test_delta_rows_reach_queries_with_other_region_filters(blobs):
+    put_json(blobs, "latency.json", [latency("EastUS", 100), latency("WestUS", 200)])
+    deltas.append_rows("latency.json", [latency("EastUS", 300), latency("WestUS", 400)])
+
+    assert average({"region": "eastus"}) == 200
+    assert average({"region": "westus"}) == 300
+    assert average({}) == 250
+
+
+def test_prefiltered_merge_of_an_uncached_blob_is_not_shared(blobs, monkeypatch):
+    # Too big for the snapshot cache: each request streams only its own rows
+    monkeypatch.setattr(common.snapshot_cache, "max_bytes", 1)
+    put_json(blobs, "latency.json", [latency("EastUS", 100), latency("WestUS", 200)])
+    deltas.append_rows("latency.json", [latency("EastUS", 300), latency("WestUS", 400)])
+
+    assert average({"region": "eastus"}) == 200
+    assert average({"region": "westus"}) == 300
+    assert average({}) == 250
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from conftest import in_range
+from heavy_hitters import HeavyHitterIndex, SpaceSaving, top_keys
+from telemetry_query import errors_table
+
+
+def exact_counts(rows, lo, hi, region=None, by_region=False):
+    counts = {}
+    for row in rows:
+        if region is not None and row["region"] != region or not in_range(row, lo, hi):
+            continue
+        key = (row["errorCode"], row["region"]) if by_region else row["errorCode"]
+        counts[key] = counts.get(key, 0) + row["errorCount"]
+    return counts
+
+
+def assert_bounds(summary, counts):
+    assert summary.total == sum(counts.values())
+    for key, (count, error) in summary.counts.items():
+        assert count - error <= counts.get(key, 0) <= count
+    for key, true in counts.items():
+        if key not in summary.counts:
+            assert true <= summary.floor
+
+
+@pytest.mark.parametrize("by_region", [False, True])
+def test_top_keys_are_exact_within_capacity(error_rows, time_range, by_region):
+    lo, hi, time_filter = time_range
+    rows = error_rows(4, 3000, codes=15)
+    table = errors_table({"errorEntries": rows[:2000]})
+    top_keys(table, "errorCode", time_filter)  # builds the index, then extends it
+    table = table.extended(rows[2000:])
+    summary = top_keys(table, "errorCode", time_filter, by_region=by_region)
+    counts = exact_counts(rows, lo, hi, by_region=by_region)
+    assert {key: count for key, count, error in summary.top(len(counts))} == counts
+    assert all(error == 0 for _, _, error in summary.top(len(counts)))
+
+
+def test_truncated_summaries_bound_the_exact_counts(error_rows, time_range):
+    lo, hi, _ = time_range
+    rows = error_rows(5, 5000, codes=200)
+    table = errors_table({"errorEntries": rows})
+    index = HeavyHitterIndex(table, "errorCode", capacity=8)
+    names = table.dictionaries["errorCode"]
+    for code, region in enumerate(table.dictionaries["region"]):
+        summary = index.summary(code, lo, hi).relabeled(names.__getitem__)
+        counts = exact_counts(rows, lo, hi, region=region)
+        assert_bounds(summary, counts)
+        # Anything heavier than the floor is tracked
+        assert {key for key, true in counts.items() if true > summary.floor} <= summary.counts.keys()
+
+
+def test_streamed_and_merged_summaries_bound_the_exact_counts():
+    rng = random.Random(6)
+    parts = [[(str(int(rng.paretovariate(1.1)) % 100), rng.randint(1, 3)) for _ in range(500)] for _ in range(6)]
+    merged, counts = SpaceSaving(10), {}
+    for part in parts:
+        summary = SpaceSaving(10)
+        for key, weight in part:
+            summary.add(key, weight)
+            counts[key] = counts.get(key, 0) + weight
+        merged.merge(summary)
+    assert_bounds(merged, counts)
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import azure.functions as func
+import interaction_log
+import list_incidents
+import tracing
+from conftest import put_json
+
+INCIDENTS = [{"id": "INC1", "region": "eastus", "status": "open", "timestamp": "2025-05-10T12:00:00Z"},
+             {"id": "INC2", "region": "westus", "status": "resolved", "timestamp": "2025-05-11T12:00:00Z"}]
+
+
+def get(params, headers=None):
+    req = func.HttpRequest("GET", "/api/list_incidents", params=params, headers=headers or {}, body=b"")
+    return asyncio.run(list_incidents.main(req))
+
+
+def test_json_ndjson_and_not_modified_responses(blobs, monkeypatch):
+    # The handler's interaction log goes to a throwaway logger on the in-memory store
+    monkeypatch.setattr(interaction_log, "_loggers", {})
+    put_json(blobs, "incidents.json", INCIDENTS)
+
+    response = get({"status": "open"})
+    assert response.status_code == 200 and response.mimetype == "application/json"
+    assert json.loads(response.get_body()) == {"incidents": INCIDENTS[:1]}
+    etag = response.headers["ETag"]
+
+    response = get({"status": "open"}, {"If-None-Match": etag})
+    assert response.status_code == 304 and response.get_body() == b"" and response.headers["ETag"] == etag
+
+    response = get({"limit": "1", "format": "ndjson"})
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_body().decode("utf-8").splitlines()]
+    assert lines[0] == INCIDENTS[0] and "nextCursor" in lines[1]
+
+    # Errors stay JSON whatever format= asked for
+    response = get({"sort": "sideways", "format": "ndjson"})
+    assert response.status_code == 400 and response.mimetype == "application/json"
+    assert "ETag" not in response.headers
+
+
+def test_server_timing_header_and_nested_stages(blobs, monkeypatch):
+    monkeypatch.setattr(interaction_log, "_loggers", {})
+    put_json(blobs, "incidents.json", INCIDENTS)
+    assert "Server-Timing" not in get({}).headers
+    parts = get({"trace": "1"}).headers["Server-Timing"].split(", ")
+    assert all(re.fullmatch(r'[\w-]+;(dur=\d+\.\d{2}|desc="[^"]*")', part) for part in parts)
+    assert parts[-1].startswith("total;dur=")
+
+    def download():
+        with tracing.stage("download"):
+            pass
+
+    req = func.HttpRequest("GET", "/api/x", params={}, headers={"x-trace": "true"}, body=b"")
+    with tracing.request("x", req) as trace:
+        with tracing.stage("aggregate"):
+            with tracing.stage("filter"):
+                tracing.count("rows", 3)
+            # Pool threads only see the trace through bind()
+            with ThreadPoolExecutor(1) as pool:
+                pool.submit(tracing.bind(download)).result()
+                pool.submit(lambda: tracing.count("lost")).result()
+        with tracing.stage("filter"):
+            pass
+    assert tracing._current.get() is None and tracing.stage("after") is tracing._noop
+    fields = trace.fields()
+    assert {name: stage["calls"] for name, stage in fields["stages"].items()} == {"filter": 2, "download": 1, "aggregate": 1}
+    assert fields["stages"]["aggregate"]["ms"] >= fields["stages"]["download"]["ms"]
+    assert fields["rows"] == 3 and "lost" not in fields
+    header = tracing.headers(trace)["Server-Timing"]
+    assert re.fullmatch(r'filter;dur=[\d.]+, download;dur=[\d.]+, aggregate;dur=[\d.]+, rows;desc="3", total;dur=[\d.]+', header)
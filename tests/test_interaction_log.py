@@ -0,0 +1,53 @@
+import datetime
+import json
+
+import interaction_log
+
+
+def blob_lines(blobs, prefix):
+    container = blobs.get_container_client("telemetry")
+    return {blob.name: [json.loads(line) for line in blobs.get_blob_client("telemetry", blob.name).download_blob().readall().splitlines()]
+            for blob in container.list_blobs(name_starts_with=prefix)}
+
+
+def test_records_land_in_the_hour_of_their_timestamp(blobs):
+    logger = interaction_log.AppendBlobLogger("interactions-log.json", flush_seconds=3600)
+    now = datetime.datetime.utcnow()
+    before = {"query": "a", "timestamp": "2025-05-25T11:59:59.900000Z"}
+    after = {"query": "b", "timestamp": "2025-05-25T12:00:00.100000Z"}
+    offset = {"query": "c", "timestamp": "2025-05-25T14:30:00+02:00"}
+    undated = {"query": "d"}
+    future = {"query": "e", "timestamp": "2999-01-01T00:00:00Z"}
+    for record in (before, after, offset, undated, future):
+        logger.append(record)
+    logger.flush()
+    current = interaction_log.partition_blob_name("interactions-log.json", now)
+    assert blob_lines(blobs, "interactions-log/") == {
+        "interactions-log/2025/05/25/11.jsonl": [before],
+        "interactions-log/2025/05/25/12.jsonl": [after, offset],
+        current: [undated, future],
+    }
+
+
+def test_failed_hours_are_retried_without_rewriting_the_others(blobs, monkeypatch):
+    logger = interaction_log.AppendBlobLogger("interactions-log.json", flush_seconds=3600)
+    first = {"query": "a", "timestamp": "2025-05-25T11:00:00Z"}
+    second = {"query": "b", "timestamp": "2025-05-25T12:00:00Z"}
+    logger.append(first)
+    logger.append(second)
+    real = interaction_log.get_blob_client
+
+    def flaky(blob_name, **kwargs):
+        if blob_name.endswith("12.jsonl"):
+            raise OSError("storage unavailable")
+        return real(blob_name, **kwargs)
+
+    monkeypatch.setattr(interaction_log, "get_blob_client", flaky)
+    logger.flush()
+    assert logger.pending() == 1
+    monkeypatch.setattr(interaction_log, "get_blob_client", real)
+    logger.flush()
+    assert blob_lines(blobs, "interactions-log/") == {
+        "interactions-log/2025/05/25/11.jsonl": [first],
+        "interactions-log/2025/05/25/12.jsonl": [second],
+    }
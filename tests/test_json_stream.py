@@ -0,0 +1,67 @@
+import json
+import random
+
+import pytest
+
+from json_stream import StreamBudgetExceeded, parse_json_stream
+
+DOCUMENTS = [
+    [],
+    {},
+    [{"region": "westeurope", "latency": 12.5, "timestamp": "2025-05-25T12:30:00Z"}] * 3,
+    {"errorEntries": [{"region": "eastus", "errorCode": 500, "errorCount": 2}, {"region": "ＷＥＳＴ", "errorCode": None}]},
+    {"meta": {"nested": [1, [2, [3, {"a": "b"}]]]}, "errorEntries": [], "tail": True},
+    [{"text": "quote \" backslash \\ tab \t newline \n unicode é € 𝄞 \u0000", "keys": {"{": "}", "[": "]"}}],
+    [-0.0, 1e-7, 12345678901234567890, -3.25E+10, True, False, None, "", " , : ] } "],
+    "a lone string",
+    42,
+    [{"id": i, "name": f"row-{i}", "values": list(range(i % 5)), "emoji": "🚀" * (i % 3)} for i in range(200)],
+]
+
+
+def chunkings(data, seed):
+    rng = random.Random(seed)
+    yield [data]
+    yield [data[i:i + 1] for i in range(len(data))]
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(1, len(data)), min(len(data) - 1, rng.randint(1, 12)))) if len(data) > 1 else []
+        yield [data[a:b] for a, b in zip([0, *cuts], [*cuts, len(data)])]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS, ids=range(len(DOCUMENTS)))
+@pytest.mark.parametrize("indent", [None, 2])
+def test_matches_json_loads_for_any_chunking(document, indent):
+    data = json.dumps(document, indent=indent, ensure_ascii=False).encode("utf-8")
+    for chunks in chunkings(data, seed=len(data)):
+        assert parse_json_stream(iter(chunks)) == json.loads(data)
+
+
+def test_ndjson_matches_json_loads_per_line():
+    rows = [{"region": "eastus", "n": i, "s": "é\n"} for i in range(50)]
+    data = "\n".join(json.dumps(row, ensure_ascii=False) for row in rows).encode("utf-8") + b"\n"
+    for chunks in chunkings(data, seed=1):
+        assert parse_json_stream(iter(chunks)) == [json.loads(line) for line in data.splitlines()]
+
+
+def test_predicate_keeps_the_rows_json_loads_would_filter_to():
+    document = {"errorEntries": [{"region": region, "n": n} for n in range(30) for region in ("eastus", "westus")], "count": 60}
+    data = json.dumps(document).encode("utf-8")
+    keep = lambda row: row["region"] == "eastus"
+    expected = {**document, "errorEntries": [row for row in document["errorEntries"] if keep(row)]}
+    for chunks in chunkings(data, seed=2):
+        assert parse_json_stream(iter(chunks), predicate=keep) == expected
+
+
+@pytest.mark.parametrize("data", [b"[1, 2", b'{"a": }', b"[1] 2", b'["unterminated]', b"[1,]"])
+def test_malformed_input_raises_like_json_loads(data):
+    with pytest.raises(ValueError):
+        json.loads(data)
+    for chunks in chunkings(data, seed=3):
+        with pytest.raises(ValueError):
+            parse_json_stream(iter(chunks))
+
+
+def test_budget_is_enforced():
+    data = json.dumps([{"payload": "x" * 1000} for _ in range(100)]).encode("utf-8")
+    with pytest.raises(StreamBudgetExceeded):
+        parse_json_stream(iter([data[i:i + 512] for i in range(0, len(data), 512)]), budget_bytes=10_000)
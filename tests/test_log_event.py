@@ -0,0 +1,23 @@
+import json
+
+import azure.functions as func
+import interaction_log
+import log_event
+
+
+def test_accepted_events_are_flushed_at_exit(blobs, monkeypatch):
+    monkeypatch.setattr(interaction_log, "_loggers", {})
+    monkeypatch.delenv("AzureWebJobsStorage", raising=False)
+    # Nothing flushes on its own during the test
+    monkeypatch.setattr(log_event, "LOG_EVENT_FLUSH_ENTRIES", 10 ** 6)
+    monkeypatch.setattr(log_event, "LOG_EVENT_FLUSH_SECONDS", 3600)
+
+    body = b'{"event": "a"}\n{"event": "b"}\n'
+    response = log_event.main(func.HttpRequest("POST", "/api/log_event", body=body))
+    assert response.status_code == 202
+
+    interaction_log.flush_all()
+    names = [blob.name for blob in blobs.get_container_client("telemetry").list_blobs(name_starts_with="copilot-logs/")]
+    assert len(names) == 1
+    lines = blobs.get_blob_client("telemetry", names[0]).download_blob().readall().decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == [{"event": "a"}, {"event": "b"}]
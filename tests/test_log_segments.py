@@ -0,0 +1,32 @@
+import json
+
+import log_segments
+
+
+def _legacy(blobs, records):
+    blobs.get_blob_client("telemetry", "interactions-log.json").upload_blob(json.dumps(records).encode("utf-8"), overwrite=True)
+
+
+def test_unchanged_legacy_array_is_not_downloaded_again(blobs):
+    _legacy(blobs, [{"query": "get_latency", "timestamp": "2025-05-25T12:30:00Z"}])
+    assert log_segments.compact("interactions-log.json") == 1
+    downloads = blobs.downloads
+    assert log_segments.compact("interactions-log.json") == 0
+    assert blobs.downloads == downloads
+
+
+def test_empty_legacy_array_is_compacted_once(blobs):
+    _legacy(blobs, [])
+    assert log_segments.compact("interactions-log.json") == 1
+    downloads = blobs.downloads
+    assert log_segments.compact("interactions-log.json") == 0
+    assert blobs.downloads == downloads
+
+    status, response = log_segments.usage_stats({})
+    assert status == 200 and response["requests"] == 0
+
+    # Records appended later replace the marker
+    _legacy(blobs, [{"query": "get_latency", "timestamp": "2025-05-25T12:30:00Z"}])
+    assert log_segments.compact("interactions-log.json") == 1
+    names = [blob.name for blob in blobs.get_container_client("telemetry").list_blobs(name_starts_with="interactions-log-segments/")]
+    assert names == ["interactions-log-segments/legacy/2025/05/25/12.seg"]
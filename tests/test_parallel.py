@@ -0,0 +1,85 @@
+import pytest
+
+import parallel
+from conftest import REGIONS
+from rollups import DAY_MS, HOUR_MS, Rollup, summarize
+from sketches import SketchIndex
+from telemetry_query import latency_table
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    """Turns sharding on for small tables; yields the successful parallel scans, then shuts the pool down."""
+    monkeypatch.setattr(parallel, "PARALLEL_AGGREGATION", True)
+    monkeypatch.setattr(parallel, "PARALLEL_MIN_ROWS", 200)
+    monkeypatch.setattr(parallel, "PARALLEL_WORKERS", 2)
+    scans, scan_parallel = [], parallel._scan_parallel
+
+    def spy(*args):
+        result = scan_parallel(*args)
+        scans.append(args[1:3])
+        return result
+
+    monkeypatch.setattr(parallel, "_scan_parallel", spy)
+    yield scans
+    with parallel._pool_lock:
+        if parallel._pool is not None:
+            parallel._pool.shutdown()
+            parallel._pool = None
+
+
+def in_process(monkeypatch, compute):
+    with monkeypatch.context() as patch:
+        patch.setattr(parallel, "PARALLEL_AGGREGATION", False)
+        return compute()
+
+
+def sketch_state(sketch):
+    return sketch.bins, sketch.zero_count, sketch.count, sketch.min, sketch.max
+
+
+def test_sharded_scans_match_the_in_process_scan(sharded, monkeypatch, latency_rows, time_range):
+    lo, hi, time_filter = time_range
+    table = latency_table(latency_rows(31, 1500))
+    options = {"group_dims": ("region",), "bucket_ms": HOUR_MS, "sketch": True}
+    expected = in_process(monkeypatch, lambda: parallel.scan(table, lo, hi, **options))
+    result = parallel.scan(table, lo, hi, **options)
+    assert sharded, "the scan never went through the process pool"
+    assert result.keys() == expected.keys()
+    for key, acc in expected.items():
+        assert result[key][:2] == [acc[0], pytest.approx(acc[1])] and result[key][2:4] == acc[2:4]
+        assert sketch_state(result[key][4]) == sketch_state(acc[4])
+
+    # summarize() over a range that isn't hour-aligned shards the raw scan
+    ragged = type(time_filter)(lo + 1, hi - 1) if time_filter is not None else None
+    if ragged is not None:
+        expected = in_process(monkeypatch, lambda: summarize(table, ragged, by="region"))
+        result = summarize(table, ragged, by="region")
+        assert result.keys() == expected.keys()
+        for region, (count, total) in expected.items():
+            assert result[region] == [count, pytest.approx(total)]
+
+
+def test_sharded_rollup_matches_the_in_process_one(sharded, monkeypatch, latency_rows, time_range):
+    lo, hi, _ = time_range
+    rows = latency_rows(33, 1500)
+    expected = in_process(monkeypatch, lambda: Rollup(latency_table(rows), HOUR_MS))
+    result = Rollup(latency_table(rows), HOUR_MS)
+    assert sharded
+    assert result.keys == expected.keys
+    for by in (None, "region"):
+        assert result.aggregate(lo, hi, by=by) == expected.aggregate(lo, hi, by=by)
+
+
+def test_sharded_sketch_index_matches_the_in_process_one(sharded, monkeypatch, latency_rows):
+    rows = latency_rows(32, 1500)
+    expected = in_process(monkeypatch, lambda: SketchIndex(latency_table(rows)))
+    result = SketchIndex(latency_table(rows))
+    assert sharded
+    for bucket_ms in (DAY_MS, HOUR_MS):
+        assert result.levels[bucket_ms].keys() == expected.levels[bucket_ms].keys()
+        for key, sketch in expected.levels[bucket_ms].items():
+            assert sketch_state(result.levels[bucket_ms][key]) == sketch_state(sketch)
+    assert {code: sketch_state(s) for code, s in result.missing.items()} == {code: sketch_state(s) for code, s in expected.missing.items()}
+    assert (result.min_ts, result.max_ts) == (expected.min_ts, expected.max_ts)
+    assert len(result.levels[DAY_MS]) <= 3 * len(REGIONS)
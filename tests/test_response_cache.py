@@ -0,0 +1,82 @@
+import pytest
+
+import common
+import telemetry_api
+from conftest import no_log, put_json
+from response_cache import ResponseCache, cache_key, etag_for
+
+
+@pytest.mark.parametrize("function,a,b", [
+    ("check_errors", {"region": "eastus", "code": "503"}, {"code": "503", "region": "eastus"}),
+    ("check_errors", {"region": "EastUS"}, {"region": "eastus"}),
+    ("get_latency", {"regions": " EastUS, westus,"}, {"regions": "eastus,westus"}),
+    ("get_latency", {"stat": "P99", "interval": "1H"}, {"stat": "p99", "interval": "1h"}),
+    ("list_incidents", {"status": "Open", "q": "dns"}, {"status": "open", "q": "dns"}),
+    ("check_errors", {"date": "2025-05"}, {"start_date": "2025-05-01", "end_date": "2025-05-31"}),
+    ("check_errors", {"region": "eastus", "date": "", "code": None, "trace": "1"}, {"region": "eastus"}),
+    ("get_latency", {"region": "eastus", "update_timestamp": "2025-05-10T12:00:00Z"},
+     {"region": "eastus", "update_timestamp": "2025-05-10T12:00:00.000+00:00"}),
+])
+def test_equivalent_queries_share_a_key(function, a, b):
+    assert cache_key(function, a) == cache_key(function, b)
+
+
+@pytest.mark.parametrize("function,a,b", [
+    ("check_errors", {"region": "eastus"}, {"region": "westus"}),
+    ("check_errors", {"region": "eastus"}, {"region": "eastus", "code": "503"}),
+    ("get_latency", {"regions": "eastus,westus"}, {"regions": "westus,eastus"}),
+    ("list_incidents", {"q": "DNS"}, {"q": "dns failure"}),
+    # update_timestamp answers echo the region back as given
+    ("get_latency", {"region": "EastUS", "update_timestamp": "2025-05-10"}, {"region": "eastus", "update_timestamp": "2025-05-10"}),
+])
+def test_different_queries_get_different_keys(function, a, b):
+    assert cache_key(function, a) != cache_key(function, b)
+
+
+def test_unparseable_update_timestamp_is_not_cached():
+    assert cache_key("get_latency", {"region": "eastus", "update_timestamp": "yesterday"}) is None
+
+
+def test_new_blob_version_drops_the_old_entries():
+    cache = ResponseCache()
+    a, b = cache_key("check_errors", {"region": "eastus"}), cache_key("check_errors", {"region": "westus"})
+    cache.put(a, "errors.json", "v1", {"totalErrors": 1}, {})
+    cache.put(b, "errors.json", "v1", {"totalErrors": 2}, {})
+    cache.put(a, "latency.json", "v7", {"averageLatencyMs": 3}, {})
+    assert cache.get(a, "errors.json", "v1")["response"] == {"totalErrors": 1}
+
+    cache.put(a, "errors.json", "v2", {"totalErrors": 5}, {})
+    assert cache.get(a, "errors.json", "v1") is None and cache.get(b, "errors.json", "v1") is None
+    assert cache.get(a, "errors.json", "v2")["response"] == {"totalErrors": 5}
+    # Other blobs keep their entries
+    assert cache.get(a, "latency.json", "v7") is not None
+    stats = cache.stats()
+    assert stats["invalidations"] == 1 and stats["entries"] == 2
+    assert etag_for(a, "v1") != etag_for(a, "v2")
+
+
+def test_expired_and_evicted_entries_are_misses():
+    key = cache_key("check_errors", {})
+    expired = ResponseCache(ttl_seconds=0)
+    expired.put(key, "errors.json", "v1", {"totalErrors": 1}, {})
+    assert expired.get(key, "errors.json", "v1") is None
+    small = ResponseCache(max_entries=1)
+    small.put(key, "errors.json", "v1", {"totalErrors": 1}, {})
+    small.put(cache_key("check_errors", {"region": "eastus"}), "errors.json", "v1", {"totalErrors": 1}, {})
+    assert small.get(key, "errors.json", "v1") is None and small.stats()["evictions"] == 1
+
+
+def test_changed_snapshot_is_answered_afresh(blobs, monkeypatch):
+    monkeypatch.setattr(telemetry_api, "response_cache", ResponseCache())
+    entry = {"region": "eastus", "errorCode": "503", "errorCount": 2, "timestamp": "2025-05-10T12:00:00Z"}
+    put_json(blobs, "errors.json", {"errorEntries": [entry]})
+    first = telemetry_api.run_cached("check_errors", {"region": "EastUS"}, log=no_log)
+    assert first[:2] == (200, {"totalErrors": 2})
+    # Same normalized query, same snapshot: the cached answer and ETag, and a 304 for that ETag
+    assert telemetry_api.run_cached("check_errors", {"region": "eastus"}, log=no_log) == first
+    assert telemetry_api.run_cached("check_errors", {"region": "eastus"}, log=no_log, if_none_match=first[2]) == (304, None, first[2])
+
+    put_json(blobs, "errors.json", {"errorEntries": [entry, {**entry, "errorCount": 3}]})
+    monkeypatch.setattr(common.snapshot_cache, "ttl_seconds", 0)  # revalidate now rather than in a minute
+    second = telemetry_api.run_cached("check_errors", {"region": "eastus"}, log=no_log, if_none_match=first[2])
+    assert second[:2] == (200, {"totalErrors": 5}) and second[2] != first[2]
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from conftest import REGIONS, START, in_range
+from rollups import DAY_MS, HOUR_MS, summarize
+from telemetry_query import TimeRange, errors_table, format_timestamp_ms, latency_table
+
+
+def exact(rows, measure, lo, hi, by=None, default=0, **dims):
+    groups = {}
+    for row in rows:
+        if any(row[dim].lower() not in wanted for dim, wanted in dims.items()) or not in_range(row, lo, hi):
+            continue
+        acc = groups.setdefault(row[by] if by else None, [0, 0])
+        acc[0] += 1
+        acc[1] += row.get(measure, default)
+    return groups if by else {None: groups.get(None, [0, 0])}
+
+
+def assert_matches(result, expected):
+    assert {key: count for key, (count, _) in result.items()} == {key: count for key, (count, _) in expected.items()}
+    for key, (_, total) in expected.items():
+        assert result[key][1] == pytest.approx(total)
+
+
+@pytest.mark.parametrize("by,dims", [(None, {}), ("region", {}), (None, {"region": ["westus", "japaneast"]})])
+def test_latency_summary_matches_exact_totals(latency_rows, time_range, by, dims):
+    lo, hi, time_filter = time_range
+    rows = latency_rows(7, 3000)
+    assert_matches(summarize(latency_table(rows), time_filter, by=by, **dims), exact(rows, "latencyMs", lo, hi, by, **dims))
+
+
+def test_extended_rollups_match_a_rebuild(latency_rows, time_range):
+    lo, hi, time_filter = time_range
+    rows = latency_rows(8, 2000)
+    table = latency_table(rows[:1500])
+    for bucket_range in (None, TimeRange(START, START + DAY_MS), TimeRange(START + HOUR_MS, START + 2 * HOUR_MS)):
+        summarize(table, bucket_range)  # builds the daily and hourly rollups
+    extended = table.extended(rows[1500:])
+    assert ("rollup", DAY_MS) in extended.derived and ("rollup", HOUR_MS) in extended.derived
+    assert_matches(summarize(extended, time_filter, by="region"), exact(rows, "latencyMs", lo, hi, "region"))
+
+
+def test_error_totals_stay_integral():
+    rng = random.Random(9)
+    rows = [{"region": rng.choice(REGIONS), "errorCode": rng.choice([500, 502, 503]), "errorCount": rng.randint(1, 9),
+             "timestamp": format_timestamp_ms(START + rng.randrange(2 * DAY_MS))} for _ in range(1000)]
+    rows.append({"region": "eastus", "errorCode": 500, "timestamp": format_timestamp_ms(START)})  # errorCount defaults to 1
+    table = errors_table({"errorEntries": rows})
+    result = summarize(table, TimeRange(START, START + DAY_MS), by="region")
+    assert result == exact(rows, "errorCount", START, START + DAY_MS, "region", default=1)
+    assert all(isinstance(total, int) for _, total in result.values())
@@ -0,0 +1,71 @@
+import math
+
+import pytest
+
+import telemetry_api
+from conftest import no_log
+from search import KEYWORD_FIELDS, SEARCH_BM25_B, SEARCH_BM25_K1, TEXT_FIELDS, get_search_index, parse_query, tokenize
+from telemetry_query import incidents_table
+
+
+def brute_force(rows, q):
+    """{row id: score} by scoring every row from scratch with the BM25 formula."""
+    query = parse_query(q)
+    docs = []
+    for row in rows:
+        tokens = [token for field in TEXT_FIELDS + KEYWORD_FIELDS for token in tokenize(row.get(field))]
+        keywords = {f"{field}:{str(row[field]).lower()}" for field in KEYWORD_FIELDS}
+        docs.append((tokens, keywords))
+    vocabulary = {token for tokens, _ in docs for token in tokens}
+    n, avg_length = len(docs), sum(len(tokens) for tokens, _ in docs) / len(docs)
+    df = {term: sum(term in tokens for tokens, _ in docs) for term in vocabulary}
+    scores = {}
+    for i, (tokens, keywords) in enumerate(docs):
+        if not all(keyword in keywords for keyword in query.keywords):
+            continue
+        total = 0.0
+        for token, prefix in query.terms:
+            best = None
+            for term in sorted(vocabulary):
+                if term == token or (prefix and term.startswith(token)):
+                    tf = tokens.count(term)
+                    if not tf:
+                        continue
+                    idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                    norm = SEARCH_BM25_K1 * (1 - SEARCH_BM25_B + SEARCH_BM25_B * len(tokens) / avg_length)
+                    score = idf * tf * (SEARCH_BM25_K1 + 1) / (tf + norm)
+                    best = score if best is None else max(best, score)
+            if best is None:
+                break
+            total += best
+        else:
+            scores[i] = total
+    return scores
+
+
+QUERIES = ["timeout", "database latency", "time*", "DNS failure gateway", "severity:high disk", "status:open region:westus",
+           "certificate expired severity:3", "nosuchword", "timeout nosuchword", "retry*  queue"]
+
+
+@pytest.mark.parametrize("q", QUERIES)
+def test_scores_match_brute_force_bm25(incident_rows, q):
+    rows = incident_rows(11, 400)
+    table = incidents_table(rows[:300])
+    get_search_index(table)
+    table = table.extended(rows[300:])  # the index is extended, not rebuilt
+    scores = get_search_index(table).search(parse_query(q))
+    expected = brute_force(rows, q)
+    assert scores.keys() == expected.keys()
+    for i, score in expected.items():
+        assert scores[i] == pytest.approx(score)
+
+
+def test_list_incidents_ranks_by_relevance(incident_rows):
+    rows = incident_rows(12, 300)
+    table = incidents_table(rows)
+    status, response = telemetry_api.list_incidents({"q": "database timeout", "limit": "20"}, log=no_log, load=lambda *args, **kwargs: table)
+    assert status == 200
+    expected = brute_force(rows, "database timeout")
+    # Best score first; ties go to the larger id, as the paging cursor expects
+    ranked = sorted(expected, key=lambda i: (round(expected[i] * 1e6), rows[i]["id"]), reverse=True)[:20]
+    assert [incident["id"] for incident in response["incidents"]] == [rows[i]["id"] for i in ranked]
@@ -0,0 +1,55 @@
+import random
+
+from conftest import REGIONS, in_range
+from sketches import SKETCH_RELATIVE_ACCURACY, DDSketch, region_sketches
+from telemetry_api import LATENCY_QUANTILES
+from telemetry_query import latency_table
+
+
+def exact_quantile(values, q):
+    # The rank DDSketch.quantile targets
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+def assert_close(sketch, values):
+    assert sketch.count == len(values)
+    assert sketch.min == min(values) and sketch.max == max(values)
+    for q in [*LATENCY_QUANTILES.values(), 0.001, 0.25]:
+        expected = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - expected) <= SKETCH_RELATIVE_ACCURACY * expected * (1 + 1e-9), q
+
+
+def test_quantiles_are_within_the_relative_accuracy():
+    rng = random.Random(1)
+    values = [rng.lognormvariate(3, 1.5) for _ in range(20000)]
+    sketch = DDSketch()
+    for value in values:
+        sketch.add(value)
+    assert_close(sketch, values)
+
+
+def test_merged_sketches_equal_one_sketch_of_everything():
+    rng = random.Random(2)
+    parts = [[rng.expovariate(0.01) for _ in range(rng.randint(1, 500))] for _ in range(10)]
+    merged, whole = DDSketch(), DDSketch()
+    for part in parts:
+        sketch = DDSketch()
+        for value in part:
+            sketch.add(value)
+            whole.add(value)
+        merged.merge(sketch)
+    assert merged.bins == whole.bins and merged.count == whole.count
+    assert_close(merged, [value for part in parts for value in part])
+
+
+def test_region_sketches_match_exact_quantiles(latency_rows, time_range):
+    lo, hi, time_filter = time_range
+    # Long-tailed, like real latencies
+    rows = latency_rows(3, 4000, latency=lambda rng: round(rng.lognormvariate(4, 1), 3))
+    table = latency_table(rows[:3000])
+    region_sketches(table, time_filter)  # builds the index, then extends it
+    table = table.extended(rows[3000:])
+    assert "sketches" in table.derived
+    sketches = region_sketches(table, time_filter)
+    for region in REGIONS:
+        assert_close(sketches[region], [row["latencyMs"] for row in rows if row["region"] == region and in_range(row, lo, hi)])
@@ -0,0 +1,17 @@
+import logging
+
+import common
+from conftest import put_json
+from telemetry_query import errors_table
+
+
+def test_cache_counters_are_logged(blobs, caplog):
+    put_json(blobs, "errors.json", {"errorEntries": []})
+    common.load_table("errors.json", errors_table)
+    common.snapshot_cache.ttl_seconds = 0
+    common.load_table("errors.json", errors_table)
+    with caplog.at_level(logging.INFO):
+        common.log_snapshot_cache_stats()
+    [record] = [r for r in caplog.records if r.getMessage().startswith("Snapshot cache:")]
+    stats = record.custom_dimensions
+    assert stats["misses"] == 1 and stats["revalidations"] == 1 and stats["entries"] == 1
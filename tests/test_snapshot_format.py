@@ -0,0 +1,55 @@
+import io
+import json
+
+import common
+import localblob
+import snapshot_format
+import telemetry_query
+from conftest import put_json
+
+INCIDENTS = [
+    {"id": f"INC-{n}", "region": "EastUS", "status": "open", "title": f"Incident {n}", "timestamp": f"2025-05-{n + 1:02d}T00:00:00Z"}
+    for n in range(5)
+]
+
+
+def count_heads(monkeypatch, suffix):
+    heads = []
+    get_blob_properties = localblob.LocalBlobClient.get_blob_properties
+
+    def counted(client, **kwargs):
+        if client.key[-1].endswith(suffix):
+            heads.append(client.key)
+        return get_blob_properties(client, **kwargs)
+
+    monkeypatch.setattr(localblob.LocalBlobClient, "get_blob_properties", counted)
+    return heads
+
+
+def test_missing_snapshot_is_cached_for_the_ttl(blobs, monkeypatch):
+    monkeypatch.setattr(common, "BINARY_SNAPSHOTS", True)
+    put_json(blobs, "incidents.json", INCIDENTS)
+    heads = count_heads(monkeypatch, ".snap")
+
+    for _ in range(100):
+        table = common.load_table("incidents.json", telemetry_query.incidents_table)
+    assert table.size == len(INCIDENTS)
+    assert len(heads) == 1
+
+    common.binary_snapshots.ttl_seconds = 0
+    common.load_table("incidents.json", telemetry_query.incidents_table)
+    assert len(heads) == 2
+
+
+def test_snapshot_rows_round_trip_and_decode_once(blobs, monkeypatch):
+    monkeypatch.setattr(common, "BINARY_SNAPSHOTS", True)
+    put_json(blobs, "incidents.json", INCIDENTS)
+    out = io.BytesIO()
+    snapshot_format.write_snapshot(telemetry_query.incidents_table(INCIDENTS), "incidents_table", out)
+    blobs.get_blob_client("telemetry", "incidents.snap").upload_blob(out.getvalue(), overwrite=True)
+
+    table = common.load_table("incidents.json", telemetry_query.incidents_table)
+    assert isinstance(table.rows, snapshot_format._Rows)
+    assert list(table.rows) == json.loads(json.dumps(INCIDENTS))
+    assert table.rows[2] is table.rows[2]
+    assert table.rows[-1]["id"] == "INC-4"
@@ -0,0 +1,42 @@
+import asyncio
+
+import snapshot_cache
+import telemetry_aio
+from conftest import no_log, put_json
+
+ERRORS = {"errorEntries": [{"region": "EastUS", "errorCode": "503", "errorCount": 2, "timestamp": "2025-05-10T12:00:00Z"}]}
+
+
+def run(params, if_none_match=None):
+    return asyncio.run(telemetry_aio.run("check_errors", params, log=no_log, if_none_match=if_none_match))
+
+
+def test_not_modified_and_cached_answers_skip_the_load(blobs, monkeypatch):
+    put_json(blobs, "errors.json", ERRORS)
+    status, response, etag = run({"region": "eastus"})
+    assert (status, response) == (200, {"totalErrors": 2})
+
+    async def no_load(datasets):
+        raise AssertionError("loaded tables for an answer the response cache had")
+
+    monkeypatch.setattr(telemetry_aio, "load_tables", no_load)
+    assert run({"region": "EastUS"}, if_none_match=etag) == (304, None, etag)
+    assert run({"region": "EastUS"}) == (200, {"totalErrors": 2}, etag)
+
+
+def test_blob_too_large_to_cache_is_downloaded_once(blobs, monkeypatch):
+    monkeypatch.setattr(telemetry_aio.snapshot_cache, "max_bytes", 1)
+    put_json(blobs, "errors.json", ERRORS)
+    status, response, _ = run({"region": "eastus"})
+    assert (status, response) == (200, {"totalErrors": 2})
+    assert blobs.downloads == 1
+
+
+def test_async_load_locks_are_dropped_with_their_loop(blobs):
+    cache = snapshot_cache.SnapshotCache()
+    put_json(blobs, "errors.json", ERRORS)
+    client = lambda: telemetry_aio.get_async_blob_client("errors.json")
+    for _ in range(3):
+        asyncio.run(cache.aget("errors.json", client()))
+        cache.invalidate()
+    assert len(cache._async_load_locks) == 1
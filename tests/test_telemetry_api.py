@@ -0,0 +1,168 @@
+import json
+
+import pytest
+
+import common
+import telemetry_api
+from conftest import no_log, put_json
+from search import tokenize
+from telemetry_query import incidents_table, parse_timestamp_ms
+
+
+def _unloadable(*args, **kwargs):
+    raise AssertionError("loaded a table for an invalid request")
+
+
+@pytest.mark.parametrize("handler", [telemetry_api.get_latency, telemetry_api.check_errors])
+@pytest.mark.parametrize("params", [{"interval": "2m"}, {"interval": "1h", "points": "2"}, {"interval": "1h", "downsample": "mean"}])
+def test_invalid_series_options_are_rejected_before_loading(handler, params):
+    status, response = handler(params, log=no_log, load=_unloadable)
+    assert status == 400 and "error" in response
+
+
+LATENCY = [{"region": "eastus", "latencyMs": 100, "timestamp": "2025-05-10T12:00:00Z"},
+           {"region": "westus", "latencyMs": 300, "timestamp": "2025-05-10T13:00:00Z"}]
+ERRORS = {"errorEntries": [{"region": "eastus", "errorCode": "503", "errorCount": 2, "timestamp": "2025-05-10T12:00:00Z"}]}
+INCIDENTS = [{"id": "INC1", "region": "eastus", "status": "open", "timestamp": "2025-05-10T12:00:00Z"}]
+
+
+@pytest.fixture
+def loads(blobs):
+    """Telemetry blobs in the store, and a load() recording which datasets it was asked for."""
+    put_json(blobs, "latency.json", LATENCY)
+    put_json(blobs, "errors.json", ERRORS)
+    put_json(blobs, "incidents.json", INCIDENTS)
+    calls = []
+
+    def load(blob_name, build, prefilter=None):
+        calls.append(blob_name)
+        return common.load_table(blob_name, build, prefilter)
+    return load, calls
+
+
+def test_batch_answers_mixed_functions_from_one_load_per_dataset(loads):
+    load, calls = loads
+    logged = []
+    status, response = telemetry_api.batch([
+        {"function": "get_latency", "params": {"region": "eastus"}, "id": "a"},
+        {"function": "get_latency", "params": {"regions": "eastus,westus"}},
+        {"function": "check_errors", "params": {"region": "eastus"}},
+        {"function": "list_incidents", "params": {"status": "open", "limit": 5}},
+        {"function": "detect_anomalies", "params": {"metric": "latency"}},
+    ], log=lambda *args: logged.append(args), load=load)
+    assert status == 200
+    results = response["results"]
+    assert [(r["id"], r["function"], r["status"]) for r in results] == [
+        ("a", "get_latency", 200), (1, "get_latency", 200), (2, "check_errors", 200), (3, "list_incidents", 200), (4, "detect_anomalies", 200)]
+    assert results[0]["response"] == telemetry_api.get_latency({"region": "eastus"}, log=no_log)[1]
+    assert results[1]["response"]["regionLatencies"] == {"eastus": 100, "westus": 300}
+    assert results[2]["response"] == {"totalErrors": 2}
+    assert results[3]["response"]["incidents"] == INCIDENTS
+    # get_latency and detect_anomalies share latency.json
+    assert sorted(calls) == ["errors.json", "incidents.json", "latency.json"]
+    # One consolidated log entry with a record per sub-query
+    [(query, parameters, entries, _)] = logged
+    assert (query, parameters, len(entries)) == ("batch", {"queries": 5}, 5)
+
+
+def test_batch_accepts_the_queries_envelope(loads):
+    load, _ = loads
+    status, response = telemetry_api.batch({"queries": [{"function": "check_errors"}]}, log=no_log, load=load)
+    assert status == 200 and response["results"][0]["response"] == {"totalErrors": 2}
+
+
+@pytest.mark.parametrize("params", [{"region": ["eastus"]}, {"region": {"name": "eastus"}}])
+def test_batch_rejects_non_scalar_params_per_query(loads, params):
+    load, calls = loads
+    status, response = telemetry_api.batch([
+        {"function": "get_latency", "params": params},
+        {"function": "check_errors", "params": {"region": "eastus", "date": None}},
+    ], log=no_log, load=load)
+    assert status == 200
+    bad, good = response["results"]
+    assert bad["status"] == 400 and "region" in bad["response"]["error"]
+    assert good["status"] == 200 and good["response"] == {"totalErrors": 2}
+    assert calls == ["errors.json"]
+
+
+def test_batch_reports_a_failing_query_without_failing_the_rest(loads, monkeypatch):
+    load, _ = loads
+
+    def broken(params, log, load):
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(telemetry_api.QUERY_HANDLERS, "list_incidents", broken)
+    status, response = telemetry_api.batch([{"function": "list_incidents"}, {"function": "check_errors"}], log=no_log, load=load)
+    assert [r["status"] for r in response["results"]] == [500, 200]
+
+
+@pytest.mark.parametrize("body", [[], {}, {"queries": "x"}, [{"function": "drop_tables"}], [{"function": "get_latency", "params": []}],
+                                  [{"function": "check_errors"}] * (telemetry_api.BATCH_MAX_QUERIES + 1)])
+def test_batch_rejects_malformed_bodies(body):
+    status, response = telemetry_api.batch(body, log=no_log, load=_unloadable)
+    assert status == 400 and "error" in response
+
+
+def walk(table, params):
+    """Every incident list_incidents returns for params, following nextCursor page by page."""
+    seen, cursor = [], None
+    for _ in range(1000):
+        status, response = telemetry_api.list_incidents({**params, **({"cursor": cursor} if cursor else {})},
+                                                        log=no_log, load=lambda *args, **kwargs: table)
+        assert status == 200
+        seen.extend(response["incidents"])
+        cursor = response.get("nextCursor")
+        if not cursor:
+            return seen
+    raise AssertionError("paging never ended")
+
+
+@pytest.mark.parametrize("params", [{"sort": "asc"}, {"sort": "desc"}, {}, {"q": "timeout"}, {"q": "timeout", "sort": "desc"}],
+                         ids=["asc", "desc", "default", "q", "q-desc"])
+def test_paging_visits_every_incident_once(incident_rows, params):
+    rows = incident_rows(21, 300)
+    # Ties on timestamp (and undated rows) are broken by id
+    rows += [{**row, "id": row["id"] + "-dup"} for row in rows[:40]]
+    table = incidents_table(rows)
+    seen = walk(table, {**params, "limit": "7"})
+    ids = [incident["id"] for incident in seen]
+    assert len(ids) == len(set(ids))
+    if "q" in params:
+        expected = {row["id"] for row in rows if "timeout" in tokenize(f"{row['title']} {row['description']}")}
+    else:
+        expected = {row["id"] for row in rows}
+    assert set(ids) == expected
+    if "sort" in params:
+        timestamps = [parse_timestamp_ms(incident.get("timestamp")) for incident in seen]
+        assert timestamps == sorted(timestamps, reverse=params["sort"] == "desc")
+
+
+def test_fields_projection_and_ndjson_pages(incident_rows):
+    rows = incident_rows(22, 30)
+    table = incidents_table(rows)
+    load = lambda *args, **kwargs: table
+    status, response = telemetry_api.list_incidents({"fields": "id, status,missing", "limit": "10"}, log=no_log, load=load)
+    assert status == 200 and response["nextCursor"]
+    assert response["incidents"] == [{"id": row["id"], "status": row["status"]} for row in
+                                     sorted(rows, key=lambda row: (parse_timestamp_ms(row.get("timestamp")), row["id"]))[:10]]
+    lines = [json.loads(line) for line in telemetry_api.incidents_ndjson(response)]
+    assert lines == [*response["incidents"], {"nextCursor": response["nextCursor"]}]
+    # Without paging there is no cursor line
+    _, response = telemetry_api.list_incidents({"fields": "id"}, log=no_log, load=load)
+    assert [json.loads(line) for line in telemetry_api.incidents_ndjson(response)] == [{"id": row["id"]} for row in rows]
+
+
+@pytest.mark.parametrize("params", [{"cursor": "not-a-cursor"}, {"limit": "0"}, {"sort": "sideways"}, {"q": "  "}])
+def test_invalid_paging_params_are_rejected(params):
+    status, response = telemetry_api.list_incidents(params, log=no_log, load=_unloadable)
+    assert status == 400 and "error" in response
+
+
+@pytest.mark.parametrize("params", [{"date": "2025-05-02"}, {"start_date": "2025-05-02", "end_date": "2025-05-03"}, {"stat": "max", "date": "2025-05-02"}])
+def test_compare_ties_go_to_the_region_seen_first(params):
+    # westus appears first in the dataset, but eastus is first among the rows in range
+    rows = [{"region": "westus", "latencyMs": 100, "timestamp": "2025-05-01T12:00:00Z"},
+            {"region": "eastus", "latencyMs": 100.2, "timestamp": "2025-05-02T12:00:00Z"},
+            {"region": "westus", "latencyMs": 99.9, "timestamp": "2025-05-02T13:00:00Z"}]
+    status, response = telemetry_api.get_latency({"compare": "true", **params}, log=no_log, load=lambda name, build, prefilter=None: build(rows))
+    assert status == 200 and response["highestLatencyRegion"] == "eastus" and response["highestLatencyMs"] == 100
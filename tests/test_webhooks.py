@@ -0,0 +1,70 @@
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+import interaction_log
+import webhooks
+
+
+def _wait(queue, **expected):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        stats = queue.stats()
+        if all(stats[key] == value for key, value in expected.items()):
+            return stats
+        time.sleep(0.01)
+    raise AssertionError(f"webhook queue stats {queue.stats()} never reached {expected}")
+
+
+def test_unsigned_deliveries_are_rejected_without_a_secret():
+    body = b'{"action": "opened"}'
+    assert not webhooks.verify_signature(body, None, secret="")
+    assert webhooks.verify_signature(body, None, secret="", allow_unsigned=True)
+    signature = "sha256=" + hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+    assert webhooks.verify_signature(body, signature, secret="s3cret")
+    assert not webhooks.verify_signature(body + b" ", signature, secret="s3cret")
+
+
+def test_failed_delivery_is_processed_again_when_redelivered(tmp_path):
+    recorded, failures = [], [1]
+
+    def record(records):
+        if failures:
+            failures.pop()
+            raise OSError("storage unavailable")
+        recorded.extend(records)
+
+    queue = webhooks.WebhookQueue(record, spill_dir=str(tmp_path), workers=1)
+    body = json.dumps({"action": "completed", "repository": {"full_name": "o/r"}}).encode("utf-8")
+    assert queue.offer(body, "delivery-1", "workflow_run")
+    _wait(queue, failed=1)
+
+    # GitHub redelivers with the same id; it was never recorded, so it isn't a duplicate
+    assert queue.offer(body, "delivery-1", "workflow_run")
+    _wait(queue, processed=1)
+    assert [record["deliveryId"] for record in recorded] == ["delivery-1"]
+
+    # Once recorded, another redelivery is dropped
+    assert queue.offer(body, "delivery-1", "workflow_run")
+    stats = _wait(queue, duplicates=1)
+    assert stats["processed"] == 1 and len(recorded) == 1
+
+
+def test_events_are_in_storage_before_the_queue_counts_them(blobs, monkeypatch):
+    monkeypatch.setattr(interaction_log, "_loggers", {})
+    monkeypatch.delenv("AzureWebJobsStorage", raising=False)
+    record = {"deliveryId": "delivery-1", "event": "push"}
+    webhooks._append_events([record])
+    names = [blob.name for blob in blobs.get_container_client("telemetry").list_blobs(name_starts_with="github-events/")]
+    assert len(names) == 1
+    assert json.loads(blobs.get_blob_client("telemetry", names[0]).download_blob().readall()) == record
+
+    def unavailable(*args, **kwargs):
+        raise OSError("storage unavailable")
+
+    monkeypatch.setattr(interaction_log, "get_blob_client", unavailable)
+    with pytest.raises(OSError):
+        webhooks._append_events([{"deliveryId": "delivery-2", "event": "push"}])